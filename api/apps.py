@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connect the signal handlers that keep the token cache in step with Token and User changes
+        from api import authentication  # noqa: F401
+
+        # Index assistant documents for the local search when they are saved
+        from api import search  # noqa: F401
+
+        # Time the queries of every database connection for the request instrumentation
+        from django.db.backends.signals import connection_created
+        from api.instrumentation import install_query_recorder
+        connection_created.connect(install_query_recorder, dispatch_uid="api.instrumentation")
+
+        # Rate limits and run slots only hold across processes in a shared cache
+        from api.limits import warn_if_per_process
+        warn_if_per_process()
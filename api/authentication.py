@@ -0,0 +1,72 @@
+# Token authentication that remembers which user a token belongs to.
+# DRF's TokenAuthentication joins Token and User on every request; CachedTokenAuthentication keeps the
+# result in an in-process LRU, or with TOKEN_CACHE_SHARED in Django's cache only, so authenticated requests
+# normally make no auth queries. Deleting a token or saving its user (e.g. deactivating it or changing its
+# permissions) drops the cached entry through the signals below. The shared cache is read on every request,
+# so such a change takes effect in all processes at once; the in-process LRU cannot hear of changes made by
+# other processes, which therefore keep serving their entry for up to TOKEN_CACHE_TTL seconds. Bulk updates
+# (User.objects.filter(...).update(is_active=False)) send no signals: call invalidate_user_tokens() after
+# them, or they take effect once entries expire (TOKEN_CACHE_TTL, or TOKEN_CACHE_SHARED_TTL when shared).
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+import copy
+import hashlib
+
+from api.cache import LRUCache
+
+token_cache = LRUCache("tokens", maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+
+
+# Cache key for a token; the token itself is a credential, so only its hash is used as a key
+def token_cache_key(key):
+    return "auth-token:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication with the (user, token) lookup cached per token."""
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        # With the shared cache it is the only tier, so an invalidation by any process is seen at once
+        tier = cache if settings.TOKEN_CACHE_SHARED else token_cache
+        cached = tier.get(cache_key)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            if settings.TOKEN_CACHE_SHARED:
+                cache.set(cache_key, cached, settings.TOKEN_CACHE_SHARED_TTL)
+            else:
+                token_cache.set(cache_key, cached)
+        user, token = cached
+        # A copy per request, so nothing set on request.user leaks into later requests
+        return copy.copy(user), token
+
+
+# Forget a token in both cache tiers
+def invalidate_token(key):
+    cache_key = token_cache_key(key)
+    token_cache.delete(cache_key)
+    if settings.TOKEN_CACHE_SHARED:
+        cache.delete(cache_key)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+# Forget the tokens of these users, e.g. after deactivating them with a queryset update, which sends no signals
+def invalidate_user_tokens(user_ids):
+    for key in Token.objects.filter(user_id__in=user_ids).values_list("key", flat=True):
+        invalidate_token(key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user_tokens([instance.pk])
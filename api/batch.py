@@ -0,0 +1,86 @@
+# Batches of questions to one assistant.
+# Analysts send the same 30-50 questions to every annual-report assistant. A batch answers them concurrently,
+# each question on its own OpenAI thread (a thread runs one run at a time), at most `concurrency` at once,
+# and stores one Chat row per question. Answers are yielded as they finish, so a batch takes about as long
+# as its slowest question (times the number of rounds the concurrency limit imposes), not the sum of all.
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from django.conf import settings
+from django.db import close_old_connections, connection
+import asyncio
+import logging
+
+from api.models import Chat
+from api.telemetry import alink_runs, link_runs
+from api.thread_pool import anew_chat_thread, new_chat_thread
+from api.utils import aanswer_question, answer_question
+
+logger = logging.getLogger(__name__)
+
+
+# Answer one question on a new thread and store it as a Chat row (runs in a worker thread)
+def answer_one(assistant, question):
+    close_old_connections()
+    try:
+        thread_id = new_chat_thread()
+        output, cache_hit = answer_question(
+            assistant, thread_id, question, admission_wait=settings.RUN_ADMISSION_WAIT
+        )
+        chat = Chat.objects.create(assistant=assistant, thread_id=thread_id, input=question, output=output)
+        if not cache_hit:
+            link_runs(chat)
+        return chat
+    finally:
+        connection.close()
+
+
+async def aanswer_one(assistant, question):
+    thread_id = await anew_chat_thread()
+    output, cache_hit = await aanswer_question(
+        assistant, thread_id, question, admission_wait=settings.RUN_ADMISSION_WAIT
+    )
+    chat = await Chat.objects.acreate(assistant=assistant, thread_id=thread_id, input=question, output=output)
+    if not cache_hit:
+        await alink_runs(chat)
+    return chat
+
+
+# Yield (index, chat, error) for every question in the order they finish, using up to `concurrency` threads
+def answer_batch(assistant, questions, concurrency):
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(questions)), thread_name_prefix="batch")
+    try:
+        # Each worker runs in a copy of the request's context, so its time shows up in the request's timings
+        futures = {
+            executor.submit(copy_context().run, answer_one, assistant, question): index
+            for index, question in enumerate(questions)
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                logger.exception("batch question %d for assistant %s failed", futures[future], assistant.pk)
+                yield futures[future], None, e
+    finally:
+        # A client that goes away stops the questions that have not started yet
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def aanswer_batch(assistant, questions, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(index, question):
+        async with semaphore:
+            try:
+                return index, await aanswer_one(assistant, question), None
+            except Exception as e:
+                logger.exception("batch question %d for assistant %s failed", index, assistant.pk)
+                return index, None, e
+
+    tasks = [asyncio.ensure_future(answer(index, question)) for index, question in enumerate(questions)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,78 @@
+# Buffered counting of the questions asked to each assistant.
+# The chat path only adds to an in-process counter; a background thread moves the collected counts to
+# Assistant.query_count every QUERY_COUNT_FLUSH_INTERVAL seconds (and when the process exits) with one
+# `UPDATE ... SET query_count = query_count + n` per assistant, so concurrent chats neither lose
+# increments nor write the assistant row once per message.
+
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+import atexit
+import logging
+import threading
+
+from api.models import Assistant
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    """
+    Thread-safe per-process buffer of query counts by assistant pk, flushed to the database in batches.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def increment(self, assistant_id, n=1):
+        """Count n queries for the assistant; the flusher thread is started on first use."""
+        with self._lock:
+            self._pending[assistant_id] += n
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="query-counter", daemon=True)
+                self._thread.start()
+
+    def pending(self):
+        """Counts that have not been written to the database yet."""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Add the buffered counts to Assistant.query_count; returns the number of queries written."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+        try:
+            with transaction.atomic():
+                # Always in pk order, so flushes from several processes lock the rows in the same order
+                for assistant_id, n in sorted(pending.items()):
+                    Assistant.objects.filter(pk=assistant_id).update(query_count=F("query_count") + n)
+        except Exception:
+            logger.exception("could not flush query counts, keeping them for the next flush")
+            with self._lock:
+                self._pending.update(pending)
+            return 0
+        return sum(pending.values())
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                connection.close()
+
+
+query_counter = QueryCounter(settings.QUERY_COUNT_FLUSH_INTERVAL)
+atexit.register(query_counter.flush)
+
+
+# Count one question asked to the assistant with the given pk
+def count_query(assistant_id):
+    query_counter.increment(assistant_id)
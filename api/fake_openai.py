@@ -0,0 +1,332 @@
+# Local stand-in for the parts of the OpenAI API used by api/utils.py (files, assistants, threads, messages
+# and runs, polled or streamed), for benchmarks that must not spend real API money.
+# It is plugged in as the httpx transport of real OpenAI clients, so requests still go through the OpenAI
+# library and api/transport.py; only the network and OpenAI's servers are replaced. Every call takes
+# `latency` seconds, a run takes `run_latency` seconds, and failures can be injected at a given rate.
+
+from urllib.parse import parse_qs
+import asyncio
+import httpx
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+from openai import AsyncOpenAI, OpenAI
+
+from api.transport import AsyncPooledTransport, PooledTransport, operation_timeout
+
+ROUTES = [
+    ("POST", r"/files", "create_file"),
+    ("POST", r"/assistants", "create_assistant"),
+    ("GET", r"/assistants/(?P<assistant_id>[^/]+)", "retrieve_assistant"),
+    ("POST", r"/assistants/(?P<assistant_id>[^/]+)", "update_assistant"),
+    ("DELETE", r"/assistants/(?P<assistant_id>[^/]+)", "delete_assistant"),
+    ("POST", r"/threads", "create_thread"),
+    ("GET", r"/threads/(?P<thread_id>[^/]+)", "retrieve_thread"),
+    ("DELETE", r"/threads/(?P<thread_id>[^/]+)", "delete_thread"),
+    ("POST", r"/threads/(?P<thread_id>[^/]+)/messages", "create_message"),
+    ("GET", r"/threads/(?P<thread_id>[^/]+)/messages", "list_messages"),
+    ("POST", r"/threads/(?P<thread_id>[^/]+)/runs", "create_run"),
+    ("GET", r"/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)", "retrieve_run"),
+    ("POST", r"/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)/cancel", "cancel_run"),
+]
+ROUTES = [(method, re.compile(rf"^/v1{pattern}$"), name) for method, pattern, name in ROUTES]
+
+
+class FakeOpenAI:
+    """
+    In-memory Assistants API. Thread-safe; the sync and async transports share the same state.
+
+    Attributes:
+        latency (float): Seconds added to every call.
+        run_latency (float): Seconds between creating a run and its completion.
+        failure_rate (float): Share of calls answered with a 500 instead (retried by api/transport.py).
+        run_failure_rate (float): Share of runs that end as "failed".
+        answer (str): The assistant's answer to every message, streamed in `chunks` pieces.
+    """
+
+    def __init__(self, latency=0.0, run_latency=1.0, failure_rate=0.0, run_failure_rate=0.0,
+                 answer="Revenue was EUR 1.2 billion in 2022.", chunks=8, seed=None):
+        self.latency = latency
+        self.run_latency = run_latency
+        self.failure_rate = failure_rate
+        self.run_failure_rate = run_failure_rate
+        self.answer = answer
+        self.chunks = chunks
+        self.random = random.Random(seed)
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.assistants = {}
+        self.threads = {}
+        self.messages = {}
+        self.runs = {}
+        self.calls = {}
+        self.injected_failures = 0
+        self.runs_in_flight = 0
+        self.peak_runs_in_flight = 0
+
+    # Clients -------------------------------------------------------------------------------------------
+
+    def sync_client(self):
+        """An OpenAI client whose requests are answered by this fake."""
+        return OpenAI(api_key="fake", max_retries=0, timeout=operation_timeout(), http_client=httpx.Client(
+            transport=PooledTransport("fake-sync", transport=SyncFakeTransport(self))
+        ))
+
+    def async_client(self):
+        """An AsyncOpenAI client whose requests are answered by this fake."""
+        return AsyncOpenAI(api_key="fake", max_retries=0, timeout=operation_timeout(), http_client=httpx.AsyncClient(
+            transport=AsyncPooledTransport("fake-async", transport=AsyncFakeTransport(self))
+        ))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "injected_failures": self.injected_failures,
+                "runs": len(self.runs),
+                "peak_runs_in_flight": self.peak_runs_in_flight,
+            }
+
+    # Request handling ----------------------------------------------------------------------------------
+
+    def dispatch(self, request):
+        """
+        Answer one request. Returns (status, body) where body is a dict to send as JSON, or
+        ("stream", run) for a streamed run, whose events the transport produces with `run_events`.
+        """
+        for method, pattern, name in ROUTES:
+            match = pattern.match(request.url.path)
+            if match and method == request.method:
+                break
+        else:
+            return 404, {"error": {"message": f"no fake for {request.method} {request.url.path}"}}
+
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.injected_failures += 1
+                return 500, {"error": {"message": "injected failure", "type": "server_error"}}
+
+        if name == "create_file":
+            # The multipart upload is not parsed, only read
+            return 200, self.obj("file", object="file", bytes=len(request.content), filename="upload",
+                                 purpose="assistants", status="processed")
+        body = json.loads(request.content) if request.content else {}
+        query = {key: values[-1] for key, values in parse_qs(request.url.query.decode()).items()}
+        return getattr(self, name)(body=body, query=query, **match.groupdict())
+
+    def obj(self, prefix, **fields):
+        return {"id": f"{prefix}_fake{next(self.ids)}", "created_at": int(time.time()), **fields}
+
+    def create_assistant(self, body, query):
+        assistant = self.obj("asst", object="assistant", model=body.get("model"), name=body.get("name"),
+                             instructions=body.get("instructions"), tools=body.get("tools", []),
+                             file_ids=body.get("file_ids", []), metadata={}, description=None)
+        with self.lock:
+            self.assistants[assistant["id"]] = assistant
+        return 200, assistant
+
+    def retrieve_assistant(self, body, query, assistant_id):
+        with self.lock:
+            # Assistants created outside the fake (e.g. rows already in the database) exist as well
+            return 200, self.assistants.setdefault(assistant_id, {
+                "id": assistant_id, "object": "assistant", "created_at": int(time.time()), "model": "gpt-3.5-turbo-0125",
+                "name": None, "instructions": "", "tools": [], "file_ids": [], "metadata": {}, "description": None,
+            })
+
+    def update_assistant(self, body, query, assistant_id):
+        _, assistant = self.retrieve_assistant(body, query, assistant_id)
+        with self.lock:
+            assistant.update(body)
+        return 200, assistant
+
+    def delete_assistant(self, body, query, assistant_id):
+        with self.lock:
+            self.assistants.pop(assistant_id, None)
+        return 200, {"id": assistant_id, "object": "assistant.deleted", "deleted": True}
+
+    def create_thread(self, body, query):
+        thread = self.obj("thread", object="thread", metadata={})
+        with self.lock:
+            self.threads[thread["id"]] = thread
+            self.messages[thread["id"]] = []
+        return 200, thread
+
+    def retrieve_thread(self, body, query, thread_id):
+        with self.lock:
+            self.messages.setdefault(thread_id, [])
+            return 200, self.threads.setdefault(thread_id, {
+                "id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {},
+            })
+
+    def delete_thread(self, body, query, thread_id):
+        with self.lock:
+            self.threads.pop(thread_id, None)
+            self.messages.pop(thread_id, None)
+        return 200, {"id": thread_id, "object": "thread.deleted", "deleted": True}
+
+    def message(self, thread_id, role, text, **fields):
+        return self.obj("msg", object="thread.message", thread_id=thread_id, role=role, file_ids=[], metadata={},
+                        content=[{"type": "text", "text": {"value": text, "annotations": []}}], **fields)
+
+    def create_message(self, body, query, thread_id):
+        message = self.message(thread_id, body.get("role", "user"), body.get("content", ""))
+        with self.lock:
+            self.messages.setdefault(thread_id, []).append(message)
+        return 200, message
+
+    def list_messages(self, body, query, thread_id):
+        with self.lock:
+            messages = list(self.messages.get(thread_id, []))
+        if query.get("order", "desc") == "desc":
+            messages.reverse()
+        if "after" in query:
+            ids = [message["id"] for message in messages]
+            messages = messages[ids.index(query["after"]) + 1:] if query["after"] in ids else messages
+        limit = int(query.get("limit", 20))
+        page = messages[:limit]
+        return 200, {"object": "list", "data": page, "first_id": page[0]["id"] if page else None,
+                     "last_id": page[-1]["id"] if page else None, "has_more": len(messages) > limit}
+
+    def create_run(self, body, query, thread_id):
+        run = self.obj("run", object="thread.run", thread_id=thread_id, assistant_id=body.get("assistant_id"),
+                       instructions=body.get("instructions"), status="in_progress", last_error=None,
+                       started_at=int(time.time()), completed_at=None, failed_at=None, cancelled_at=None, usage=None,
+                       model="gpt-3.5-turbo-0125", tools=[], file_ids=[], metadata={})
+        run["_finishes_at"] = time.monotonic() + self.run_latency
+        run["_fails"] = bool(self.run_failure_rate) and self.random.random() < self.run_failure_rate
+        with self.lock:
+            self.runs[run["id"]] = run
+            self.runs_in_flight += 1
+            self.peak_runs_in_flight = max(self.peak_runs_in_flight, self.runs_in_flight)
+        if body.get("stream"):
+            return "stream", run
+        return 200, self.public(run)
+
+    def retrieve_run(self, body, query, thread_id, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+        if run is None:
+            return 404, {"error": {"message": f"no run {run_id}"}}
+        if run["status"] == "in_progress" and time.monotonic() >= run["_finishes_at"]:
+            self.finish_run(run)
+        return 200, self.public(run)
+
+    def cancel_run(self, body, query, thread_id, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is not None and run["status"] == "in_progress":
+                run.update(status="cancelled", cancelled_at=int(time.time()))
+                self.runs_in_flight -= 1
+        return 200, self.public(run)
+
+    def finish_run(self, run):
+        """Complete (or fail) the run and post the answer to its thread; returns the answer message."""
+        with self.lock:
+            if run["status"] != "in_progress":
+                return None
+            self.runs_in_flight -= 1
+            if run["_fails"]:
+                run.update(status="failed", failed_at=int(time.time()),
+                           last_error={"code": "server_error", "message": "injected run failure"})
+                return None
+            run.update(status="completed", completed_at=int(time.time()), usage={
+                "prompt_tokens": len(run["instructions"] or "") // 4 + 10,
+                "completion_tokens": len(self.answer) // 4,
+                "total_tokens": len(run["instructions"] or "") // 4 + 10 + len(self.answer) // 4,
+            })
+            message = self.message(run["thread_id"], "assistant", self.answer, assistant_id=run["assistant_id"],
+                                   run_id=run["id"], status="completed")
+            self.messages.setdefault(run["thread_id"], []).append(message)
+            return message
+
+    def public(self, run):
+        return {key: value for key, value in run.items() if not key.startswith("_")}
+
+    def run_events(self, run):
+        """
+        The server-sent events of a streamed run, as (seconds to wait first, bytes or None) pairs: the run is
+        created, then after `run_latency` the answer is streamed in `chunks` deltas and the run completes. A run
+        cancelled meanwhile ends the stream with its cancellation.
+        """
+        yield 0, sse("thread.run.created", self.public(run))
+        yield 0, sse("thread.run.in_progress", self.public(run))
+        # Nothing to send while the run works
+        while run["status"] == "in_progress" and time.monotonic() < run["_finishes_at"]:
+            yield min(0.05, run["_finishes_at"] - time.monotonic()), None
+        message = self.finish_run(run)
+        if message is None:
+            yield 0, sse(f"thread.run.{run['status']}", self.public(run))
+            yield 0, b"event: done\ndata: [DONE]\n\n"
+            return
+        yield 0, sse("thread.message.created", {**message, "content": [], "status": "in_progress"})
+        size = max(1, -(-len(self.answer) // self.chunks))
+        for start in range(0, len(self.answer), size):
+            yield 0, sse("thread.message.delta", {"id": message["id"], "object": "thread.message.delta", "delta": {
+                "content": [{"index": 0, "type": "text", "text": {"value": self.answer[start:start + size],
+                                                                   "annotations": []}}],
+            }})
+        yield 0, sse("thread.message.completed", message)
+        yield 0, sse("thread.run.completed", self.public(run))
+        yield 0, b"event: done\ndata: [DONE]\n\n"
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+# A JSON response whose body is streamed like a network response, so it is read and closed by the client
+def json_response(status, body):
+    return httpx.Response(status, headers={"content-type": "application/json"}, content=iter([json.dumps(body).encode()]))
+
+
+def ajson_response(status, body):
+    async def content():
+        yield json.dumps(body).encode()
+    return httpx.Response(status, headers={"content-type": "application/json"}, content=content())
+
+
+class SyncFakeTransport(httpx.BaseTransport):
+    """Answers the sync client's requests from a FakeOpenAI, sleeping for its latencies."""
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    def handle_request(self, request):
+        request.read()
+        time.sleep(self.fake.latency)
+        status, body = self.fake.dispatch(request)
+        if status == "stream":
+            def events():
+                for delay, data in self.fake.run_events(body):
+                    if delay:
+                        time.sleep(delay)
+                    if data is not None:
+                        yield data
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events())
+        return json_response(status, body)
+
+
+class AsyncFakeTransport(httpx.AsyncBaseTransport):
+    """Answers the async client's requests from a FakeOpenAI without blocking the event loop."""
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        await asyncio.sleep(self.fake.latency)
+        status, body = self.fake.dispatch(request)
+        if status == "stream":
+            async def events():
+                for delay, data in self.fake.run_events(body):
+                    if delay:
+                        await asyncio.sleep(delay)
+                    if data is not None:
+                        yield data
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events())
+        return ajson_response(status, body)
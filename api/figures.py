@@ -0,0 +1,318 @@
+# Financial figures of the assistant documents.
+# Most questions to the assistants are numeric lookups (revenue, net income, fte per year) that cost a full
+# run. While a document is indexed for search (api/search.py), the rows of its tables with one figure per
+# year column are also extracted, e.g. "Total net revenues 7,528 100 8,803 100" under a "2022 2021" header,
+# and stored column-wise as search_index/v1/<sha256>.figures.json.gz. In memory every column is an array,
+# sorted by metric and year, so the rows of a metric are one contiguous slice: a lookup is a dictionary
+# access and a slice instead of a scan, and comparing assistants is one lookup per document.
+
+from array import array
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+import gzip
+import json
+import re
+
+from api.cache import LRUCache
+
+# Bumped whenever the format or the extraction rules change, so old tables are rebuilt
+FIGURES_VERSION = 1
+
+YEAR = re.compile(r"(?<!\d)(?:19|20)\d{2}(?!\d)")
+WORD = re.compile(r"[^\W\d_]{2,}")
+NUMBER = re.compile(r"[-(]?\d[\d.,]*\)?%?")
+CURRENCIES = {"$": "USD", "us$": "USD", "usd": "USD", "€": "EUR", "eur": "EUR"}
+MISSING = {"—", "–", "-", "*"}
+MAX_LABEL_WORDS = 12
+# Words in a row label that do not make it a different metric: "Total net revenues" is the revenue line,
+# "Deferred revenues" is not
+NEUTRAL_WORDS = {"total", "net", "consolidated", "group", "reported", "totaal", "netto", "geconsolideerd"}
+SCALES = (
+    (re.compile(r"in (?:millions|miljoenen)|x\s*(?:€|eur)?\s*1\s*(?:miljoen|million)"), "millions"),
+    (re.compile(r"in (?:thousands|duizenden)|x\s*(?:€|eur)?\s*1[.,]000(?!\d)"), "thousands"),
+    (re.compile(r"in billions"), "billions"),
+)
+
+figures_cache = LRUCache("figures", maxsize=64, ttl=3600.0)
+
+
+def figures_path(sha256):
+    return f"search_index/v{FIGURES_VERSION}/{sha256}.figures.json.gz"
+
+
+# Number in a table cell: "1,275", "(1,275)", "-839.626", "110,9" or "1.92"; thousands separators are told
+# apart from decimal separators by the groups of three digits after them
+def parse_number(text):
+    negative = text.startswith(("-", "(")) or text.endswith(")")
+    digits = text.strip("-()%")
+    if "," in digits and "." in digits:
+        decimal = "," if digits.rfind(",") > digits.rfind(".") else "."
+        digits = digits.replace("." if decimal == "," else ",", "").replace(",", ".")
+    elif re.fullmatch(r"\d{1,3}(?:[.,]\d{3})+", digits):
+        digits = re.sub(r"[.,]", "", digits)
+    else:
+        digits = digits.replace(",", ".")
+    try:
+        value = float(digits)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+# Normalized metric name of a row label, e.g. "Net income (1):" -> "net income"
+def metric_key(label):
+    return " ".join(WORD.findall(label.lower()))
+
+
+def metric_terms(text):
+    """Words of a metric name or query, singular, so "revenue" finds "net revenues"."""
+    return {word[:-1] if len(word) > 3 and word.endswith("s") else word for word in WORD.findall(text.lower())}
+
+
+# Split a table row into its label and its cells, read from the end of the line: (label, cells, currency)
+# where each cell is a (value or None, is percentage) pair
+def split_row(line):
+    tokens = line.replace("%", " % ").replace("$", " $ ").replace("€", " € ").split()
+    cells, currency, percent = [], None, False
+    while tokens:
+        token = tokens[-1]
+        lowered = token.lower()
+        if token == "%":
+            percent = True
+        elif lowered in CURRENCIES:
+            currency = CURRENCIES[lowered]
+        elif token in MISSING:
+            cells.append((None, percent))
+            percent = False
+        elif NUMBER.fullmatch(token):
+            value = parse_number(token)
+            if value is None:
+                break
+            cells.append((value, percent or token.endswith("%")))
+            percent = False
+        else:
+            break
+        tokens.pop()
+    cells.reverse()
+    # A lone dash followed by a number is that number's minus sign ("- 49.040")
+    merged = []
+    for value, is_percent in cells:
+        if merged and merged[-1] == (None, False) and value is not None:
+            merged[-1] = (-value, is_percent)
+        else:
+            merged.append((value, is_percent))
+    return " ".join(tokens), merged, currency
+
+
+# Values of a row for `columns` year columns, dropping footnote markers, percentage and change columns:
+# (label, values, currency, whether the values are percentages), or None if the line is no such row
+def row_values(line, columns):
+    label, cells, currency = split_row(line)
+    # Labels start with a capital and are short; other lines are the wrapped end of a sentence or a long label
+    if not label[:1].isupper() or len(label.split()) > MAX_LABEL_WORDS or len(cells) < columns:
+        return None
+    # "(1)" right after the label is a footnote marker when the figures themselves carry a currency
+    if currency and len(cells) > columns and cells[0][0] is not None and 0 < -cells[0][0] < 10:
+        cells = cells[1:]
+    amounts = [cell for cell in cells if not cell[1]]
+    if len(amounts) >= columns:
+        cells = amounts
+    elif len(amounts) == 0:
+        return label, [value for value, _ in cells[:columns]], None, True
+    else:
+        return None
+    # "5,886 78 6,492 74": an amount and its share of the total per year
+    if len(cells) == 2 * columns and all(value is None or abs(value) <= 100 for value, _ in cells[1::2]):
+        cells = cells[::2]
+    return label, [value for value, _ in cells[:columns]], currency, False
+
+
+# The year columns of a table header such as "2022 2021", "31 dec 2022 31 dec 2021" or "2022 2021Increase/"
+def header_years(line):
+    years = [int(year) for year in YEAR.findall(line)]
+    if len(years) < 2 or len(set(years)) != len(years) or line.rstrip().endswith("."):
+        return None
+    if len(WORD.findall(YEAR.sub(" ", line))) > 6:
+        return None
+    return years
+
+
+def page_scale(text):
+    lowered = text.lower()
+    for pattern, scale in SCALES:
+        if pattern.search(lowered):
+            return scale
+    return ""
+
+
+def extract_figures(pages):
+    """
+    Find the table rows of the pages that have a figure for every year of the table header above them.
+
+    Returns:
+        list: (label, year, value, page, unit) tuples; unit is "%" or the currency and scale, e.g. "USD millions".
+    """
+    rows = []
+    for number, text in enumerate(pages, start=1):
+        scale = page_scale(text)
+        years, table_currency = None, None
+        for line in text.splitlines():
+            found = header_years(line)
+            if found:
+                years, table_currency = found, None
+                continue
+            if years is None:
+                continue
+            # A line of currencies only, such as "EUR EUR", gives the currency of the table's columns
+            currencies = {CURRENCIES.get(token.lower()) for token in line.split()}
+            if currencies and None not in currencies:
+                table_currency = currencies.pop()
+                continue
+            row = row_values(line, len(years))
+            if row is None:
+                continue
+            label, values, currency, percent = row
+            if percent:
+                unit = "%"
+            else:
+                table_currency = currency or table_currency
+                unit = " ".join(part for part in (table_currency, scale) if part)
+            for year, value in zip(years, values):
+                if value is not None:
+                    rows.append((label.strip(" :"), year, value, number, unit))
+    return rows
+
+
+class FigureTable:
+    """
+    The figures of one document, column-wise: `metric`, `year`, `value`, `page` and `unit` are parallel
+    arrays sorted by metric and then by year (newest first); metric and unit hold codes into `metrics`
+    and `units`. The rows of metric code m are rows[offsets[m]:offsets[m + 1]].
+    """
+
+    def __init__(self, metrics, labels, units, offsets, year, value, page, unit):
+        self.metrics = metrics
+        self.labels = labels
+        self.units = units
+        self.offsets = array("I", offsets)
+        self.year = array("H", year)
+        self.value = array("d", value)
+        self.page = array("H", page)
+        self.unit = array("H", unit)
+        self.codes = {key: code for code, key in enumerate(metrics)}
+        # Metric codes per word, to find the metrics a query names
+        self.terms = {}
+        for code, key in enumerate(metrics):
+            for term in metric_terms(key):
+                self.terms.setdefault(term, []).append(code)
+
+    def __len__(self):
+        return len(self.value)
+
+    @classmethod
+    def build(cls, figures):
+        """Build the table from extract_figures() rows; a figure repeated on later pages is kept once."""
+        keyed = sorted(
+            (metric_key(label), -year, page, value, unit, label) for label, year, value, page, unit in figures
+            if metric_key(label)
+        )
+        metrics, labels, units, offsets = [], [], [], []
+        unit_codes, seen = {}, set()
+        year, value, page, unit = [], [], [], []
+        for key, negative_year, row_page, row_value, row_unit, label in keyed:
+            if (key, negative_year, row_value, row_unit) in seen:
+                continue
+            seen.add((key, negative_year, row_value, row_unit))
+            if not metrics or metrics[-1] != key:
+                metrics.append(key)
+                labels.append(label)
+                offsets.append(len(value))
+            year.append(-negative_year)
+            value.append(row_value)
+            page.append(row_page)
+            unit.append(unit_codes.setdefault(row_unit, len(unit_codes)))
+        offsets.append(len(value))
+        units = sorted(unit_codes, key=unit_codes.get)
+        return cls(metrics, labels, units, offsets, year, value, page, unit)
+
+    def to_json(self):
+        return {
+            "version": FIGURES_VERSION,
+            "metrics": self.metrics,
+            "labels": self.labels,
+            "units": self.units,
+            "offsets": self.offsets.tolist(),
+            "year": self.year.tolist(),
+            "value": self.value.tolist(),
+            "page": self.page.tolist(),
+            "unit": self.unit.tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["metrics"], data["labels"], data["units"], data["offsets"],
+                   data["year"], data["value"], data["page"], data["unit"])
+
+    def rows(self, code, year=None):
+        """The (year, value, unit, page) rows of a metric, newest first, optionally of one year only."""
+        start, end = self.offsets[code], self.offsets[code + 1]
+        return [
+            {"year": self.year[i], "value": self.value[i], "unit": self.units[self.unit[i]], "page": self.page[i]}
+            for i in range(start, end) if year is None or self.year[i] == year
+        ]
+
+    def match(self, query, year=None, limit=5):
+        """
+        Codes of the metrics named by the query, best first: the exact name, then names made of the query's
+        words and neutral words only (e.g. "Total net revenues" for "revenue"), then names with words that
+        qualify the query's (e.g. "Deferred revenues"), the fewest first, then the metrics with the most
+        figures. With `year`, only metrics with a figure for that year.
+        """
+        exact = self.codes.get(metric_key(query))
+        terms = metric_terms(query)
+        if not terms:
+            return []
+        candidates = None
+        for term in terms:
+            codes = set(self.terms.get(term, ()))
+            candidates = codes if candidates is None else candidates & codes
+            if not candidates:
+                return []
+        if year is not None:
+            candidates = {code for code in candidates if year in self.year[self.offsets[code]:self.offsets[code + 1]]}
+
+        def rank(code):
+            # Words of the name that qualify the query's, e.g. "deferred" in "Deferred revenues"
+            extra = sum(1 for word in metric_key(self.metrics[code]).split()
+                        if word not in NEUTRAL_WORDS and not metric_terms(word) <= terms)
+            tier = 0 if code == exact else 1 if extra == 0 else 2
+            return tier, extra, self.offsets[code] - self.offsets[code + 1], code
+
+        return sorted(candidates, key=rank)[:limit]
+
+    def lookup(self, query, year=None, limit=5):
+        """The best matching metrics with their figures, as returned by the figures endpoints."""
+        return [{"metric": self.labels[code], "values": self.rows(code, year)}
+                for code in self.match(query, year, limit)]
+
+
+def write_figures(sha256, table):
+    path = figures_path(sha256)
+    data = gzip.compress(json.dumps(table.to_json(), separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(data))
+    figures_cache.delete(sha256)
+
+
+# The figure table of a stored file from this process' cache or from storage; None if it was not built yet
+def load_figures(sha256):
+    table = figures_cache.get(sha256)
+    if table is None:
+        try:
+            with default_storage.open(figures_path(sha256), "rb") as f:
+                table = FigureTable.from_json(json.loads(gzip.decompress(f.read())))
+        except FileNotFoundError:
+            return None
+        figures_cache.set(sha256, table)
+    return table
@@ -0,0 +1,74 @@
+# Content-addressed storage for assistant documents.
+# Every distinct file is written to media/assistant_files/<sha256>/<name> once and registered as a
+# StoredFile; uploading the same report again returns the existing row instead of another copy.
+# Documents are only ever read in chunks of UPLOAD_CHUNK_SIZE, so memory use does not grow with
+# their size.
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models.fields.files import FieldFile
+import hashlib
+import os
+
+from api.models import StoredFile
+
+
+# Hash a file in chunks, returning its hex SHA-256 and size in bytes
+def hash_file(f):
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in f.chunks(settings.UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+# Return the StoredFile for this upload (or already stored file), storing it only if its content is new
+def store_file(f):
+    committed = isinstance(f, FieldFile) and f._committed
+    if committed:
+        # Already in storage: files saved through the registry are found by path without hashing
+        existing = StoredFile.objects.filter(file=f.name).first()
+        if existing is not None:
+            return existing
+
+    sha256, size = hash_file(f)
+    existing = StoredFile.objects.filter(sha256=sha256).first()
+    if existing is not None:
+        return existing
+
+    if committed:
+        # A file stored before the registry existed: register it where it is
+        path = f.name
+    else:
+        f.seek(0)
+        path = default_storage.save(f"assistant_files/{sha256}/{os.path.basename(f.name)}", f)
+
+    try:
+        with transaction.atomic():
+            return StoredFile.objects.create(sha256=sha256, file=path, size=size)
+    except IntegrityError:
+        # The same content was registered concurrently; keep that copy
+        if not committed:
+            default_storage.delete(path)
+        return StoredFile.objects.get(sha256=sha256)
+
+
+class ChunkedReader:
+    """
+    Read-only file wrapper whose reads never return more than `chunk_size` bytes, so code that
+    calls `read()` without a size (or with a large one) cannot pull a whole document into memory.
+    """
+
+    def __init__(self, f, chunk_size=None):
+        self.f = f
+        self.chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+        return self.f.read(size)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
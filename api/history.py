@@ -0,0 +1,68 @@
+# Local mirror of the conversation history of OpenAI threads.
+# Whenever we talk to a thread, the messages it gained since the last one stored locally (the sync cursor)
+# are listed from OpenAI once and stored as ThreadMessage rows. The history endpoint then serves a thread
+# from t_thread_message with one indexed query. Answers served from the answer cache never reach OpenAI,
+# so they are not part of the thread and not mirrored.
+
+from datetime import datetime, timezone
+from django.db.models import Subquery
+
+from api.models import ThreadMessage
+
+
+# Text of a message: its text parts, one per line (image parts are left out)
+def message_text(message):
+    return "\n".join(part.text.value for part in message.content if part.type == "text")
+
+
+# The id of the newest locally stored message of the thread, or None if none is stored yet
+def last_message_id(thread_id):
+    return ThreadMessage.objects.filter(thread_id=thread_id).order_by("-id").values_list("message_id", flat=True).first()
+
+
+async def alast_message_id(thread_id):
+    return await (
+        ThreadMessage.objects.filter(thread_id=thread_id).order_by("-id").values_list("message_id", flat=True).afirst()
+    )
+
+
+def message_rows(messages):
+    return [
+        ThreadMessage(
+            thread_id=message.thread_id,
+            message_id=message.id,
+            role=message.role,
+            content=message_text(message),
+            run_id=message.run_id or "",
+            created_at=datetime.fromtimestamp(message.created_at, tz=timezone.utc),
+        )
+        for message in messages
+    ]
+
+
+# Store messages listed from OpenAI in conversation order; ones stored already (e.g. by another process) are skipped
+def store_messages(messages):
+    ThreadMessage.objects.bulk_create(message_rows(messages), ignore_conflicts=True)
+
+
+async def astore_messages(messages):
+    await ThreadMessage.objects.abulk_create(message_rows(messages), ignore_conflicts=True)
+
+
+# Text of the first assistant message stored after the message with the given id, or None. Read back from the
+# mirror rather than from what one mirror call listed: a concurrent mirror (e.g. the history endpoint's) may
+# have stored the answer first, and then this call lists nothing new
+def stored_answer(thread_id, message_id):
+    return answer_rows(thread_id, message_id).first()
+
+
+async def astored_answer(thread_id, message_id):
+    return await answer_rows(thread_id, message_id).afirst()
+
+
+def answer_rows(thread_id, message_id):
+    question = ThreadMessage.objects.filter(message_id=message_id).values("id")
+    return (
+        ThreadMessage.objects.filter(thread_id=thread_id, role="assistant", id__gt=Subquery(question))
+        .order_by("id").values_list("content", flat=True)
+    )
@@ -0,0 +1,327 @@
+# Per-request performance instrumentation.
+# InstrumentationMiddleware opens a RequestTimings for every request. While the request runs, the database
+# execute wrapper, the OpenAI transports (api/transport.py), the run polling loops and the timed() wrappers
+# around the utils functions add to it. When the response is ready the breakdown is added to the
+# Prometheus metrics below (served at /api/v1/metrics/) and summarized in a Server-Timing header.
+# The metrics are per process; Prometheus adds up the gunicorn workers when each one is scraped.
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextvars import ContextVar
+from django.conf import settings
+import asyncio
+import functools
+import math
+import re
+import threading
+import time
+
+# Every metric registers itself here by name, in the order they are rendered
+metrics = {}
+
+# Latency buckets in seconds, wide enough for assistant runs that take a minute
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Counter:
+    """Thread-safe Prometheus counter with labels."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        metrics[name] = self
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in sorted(self._values.items())]
+
+    def label_names(self, sample_name):
+        return self.labels
+
+
+class Gauge(Counter):
+    """Thread-safe Prometheus gauge with labels: a counter that can also go down."""
+
+    type = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram with labels; `buckets` are the upper bounds, +Inf is added."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = (*buckets, math.inf)
+        self._values = {}
+        self._lock = threading.Lock()
+        metrics[name] = self
+
+    def observe(self, *label_values, value):
+        with self._lock:
+            counts, total = self._values.get(label_values) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[label_values] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        samples = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", (*labels, format_value(bound)), cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+    def label_names(self, sample_name):
+        return (*self.labels, "le") if sample_name.endswith("_bucket") else self.labels
+
+
+http_requests = Counter(
+    "http_requests_total", "Requests served, by view and status code.", ("method", "view", "status"))
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time to produce the response.", ("method", "view"))
+http_request_db_queries = Histogram(
+    "http_request_db_queries", "Database queries per request.", ("view",), QUERY_BUCKETS)
+http_request_db_duration = Histogram(
+    "http_request_db_duration_seconds", "Time per request spent in database queries.", ("view",))
+http_request_openai_duration = Histogram(
+    "http_request_openai_duration_seconds", "Time per request spent in OpenAI calls.", ("view",))
+http_request_poll_wait = Histogram(
+    "http_request_poll_wait_seconds", "Time per request spent sleeping between run status polls.", ("view",))
+openai_request_duration = Histogram(
+    "openai_request_duration_seconds", "OpenAI calls by operation, including retries and reading the body.",
+    ("operation", "status"))
+operation_duration = Histogram(
+    "api_operation_duration_seconds", "Time spent in the instrumented api.utils functions.", ("operation",))
+
+
+# Request methods used as the `method` label; any other method a client sends is counted as "other"
+HTTP_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Render every metric in the Prometheus text exposition format (version 0.0.4)
+def render_metrics():
+    lines = []
+    for metric in metrics.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, label_values, value in metric.samples():
+            labels = ",".join(f'{label}="{escape_label(v)}"'
+                              for label, v in zip(metric.label_names(name), label_values))
+            lines.append(f"{name}{{{labels}}} {format_value(value)}" if labels else f"{name} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestTimings:
+    """Where one request's time went: database queries, OpenAI calls by operation and run polling sleeps."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.upstream = {}
+        self.poll_wait = 0.0
+        # Async views run their queries in a worker thread that shares this object
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += seconds
+
+    def add_upstream(self, operation, seconds):
+        with self._lock:
+            calls, total = self.upstream.get(operation, (0, 0.0))
+            self.upstream[operation] = (calls + 1, total + seconds)
+
+    def add_poll_wait(self, seconds):
+        with self._lock:
+            self.poll_wait += seconds
+
+    @property
+    def upstream_time(self):
+        with self._lock:
+            return sum(total for _, total in self.upstream.values())
+
+    def server_timing(self, total):
+        """The Server-Timing header value, durations in milliseconds."""
+        with self._lock:
+            entries = [f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"']
+            entries += [f'openai.{operation};dur={seconds * 1000:.1f};desc="{calls} calls"'
+                        for operation, (calls, seconds) in sorted(self.upstream.items())]
+            if self.poll_wait:
+                entries.append(f"poll;dur={self.poll_wait * 1000:.1f}")
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# The timings of the request being served in this thread or task, if any
+current_timings = ContextVar("current_timings", default=None)
+
+
+# Database execute wrapper, installed on every connection as it is created (see ApiConfig.ready)
+def record_query(execute, sql, params, many, context):
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# Record one OpenAI call (called by the transports once its response body is closed)
+def record_upstream(operation, seconds, status):
+    openai_request_duration.observe(operation, status, value=seconds)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add_upstream(operation, seconds)
+
+
+# Sleep between run status polls, counting the time as polling wait
+def poll_sleep(seconds):
+    time.sleep(seconds)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add_poll_wait(seconds)
+
+
+async def apoll_sleep(seconds):
+    await asyncio.sleep(seconds)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add_poll_wait(seconds)
+
+
+# Decorator recording how long a sync or async utils function takes under `operation`
+def timed(operation):
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    operation_duration.observe(operation, value=time.perf_counter() - started)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    operation_duration.observe(operation, value=time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# Operation name of an OpenAI API call in the SDK's terms, e.g. POST /v1/threads/thread_abc/runs -> threads.runs.create
+ID_SEGMENT = re.compile(r"^(asst|thread|run|msg|file|step)_")
+
+
+def operation_name(method, path):
+    segments = [segment for segment in path.strip("/").split("/") if segment and segment != "v1"]
+    names = [segment for segment in segments if not ID_SEGMENT.match(segment)]
+    if not names:
+        return "unknown"
+    addressed = bool(segments) and ID_SEGMENT.match(segments[-1]) is not None
+    if names[-1] in ("cancel", "submit_tool_outputs"):
+        verb = names.pop()
+    elif method == "GET":
+        verb = "retrieve" if addressed else "list"
+    elif method == "DELETE":
+        verb = "delete"
+    else:
+        verb = "update" if addressed else "create"
+    return ".".join([*names, verb])
+
+
+class InstrumentationMiddleware:
+    """
+    Time every request and break the time down into database, OpenAI and polling time.
+
+    Works for both the WSGI and the ASGI stack. Put it first in MIDDLEWARE so the timings cover the
+    other middleware too. With SERVER_TIMING the breakdown is also sent as a Server-Timing header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        match = getattr(request, "resolver_match", None)
+        # Only resolved view names are used as labels, so unknown URLs cannot grow the metrics without bound
+        view = match.view_name if match is not None else "unmatched"
+        method = request.method if request.method in HTTP_METHODS else "other"
+        http_requests.inc(method, view, str(response.status_code))
+        http_request_duration.observe(method, view, value=total)
+        http_request_db_queries.observe(view, value=timings.db_queries)
+        http_request_db_duration.observe(view, value=timings.db_time)
+        http_request_openai_duration.observe(view, value=timings.upstream_time)
+        http_request_poll_wait.observe(view, value=timings.poll_wait)
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = timings.server_timing(total)
+        return response
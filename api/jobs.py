@@ -0,0 +1,145 @@
+# Background execution of chat messages.
+# A PUT on /chat/<pk>/?async=true stores a ChatJob and returns 202 straight away; the job is then answered
+# by a small thread pool inside the web process (or by `manage.py run_chat_jobs` in a separate process),
+# and clients poll /chat/jobs/<job id>/ until it is done. A `?wait=` long-poll holds a sync (WSGI) worker, so
+# it is capped at CHAT_JOB_SYNC_MAX_WAIT there; the async view (ASGI) waits up to CHAT_JOB_MAX_WAIT without
+# holding a thread.
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+import asyncio
+import logging
+import threading
+import time
+
+from api.models import ChatJob, Chat
+from api.utils import answer_question
+from api.telemetry import link_runs
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Jobs submitted to this process' pool signal their waiters here so long-polls return immediately. An event
+# is registered when the job is submitted and removed when it has run (or was claimed elsewhere)
+_done_events = {}
+_done_events_lock = threading.Lock()
+
+# Seconds between checks of a job's event by an async long-poll; checking costs no query
+EVENT_CHECK_INTERVAL = 0.05
+
+
+# Lazily create the process-wide worker pool
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CHAT_JOB_WORKERS,
+                thread_name_prefix="chat-job",
+            )
+        return _executor
+
+
+# Store a job for the given chat and hand it to the worker pool once the row is committed; nothing is
+# registered when the transaction rolls back
+def enqueue_chat_job(chat, assistant, msg):
+    job = ChatJob.objects.create(assistant=assistant, thread_id=chat.thread_id, input=msg)
+    transaction.on_commit(lambda: submit_chat_job(job.pk))
+    return job
+
+
+def submit_chat_job(job_id):
+    with _done_events_lock:
+        _done_events[job_id] = threading.Event()
+    return get_executor().submit(run_chat_job, job_id)
+
+
+# Drop the job's event; run_chat_job pops it too, whichever sees the job finished first
+def forget_job(job_id):
+    with _done_events_lock:
+        return _done_events.pop(job_id, None)
+
+
+# Atomically move a queued job to running; returns False if another worker got there first
+def claim_job(job_id):
+    return ChatJob.objects.filter(pk=job_id, status=ChatJob.QUEUED).update(
+        status=ChatJob.RUNNING, started_at=timezone.now()
+    ) == 1
+
+
+# Answer one job: send the message to the assistant and store the Chat row with the output
+def run_chat_job(job_id):
+    close_old_connections()
+    try:
+        if not claim_job(job_id):
+            return
+        job = ChatJob.objects.select_related("assistant").get(pk=job_id)
+        try:
+            output, cache_hit = answer_question(
+                job.assistant, job.thread_id, job.input, admission_wait=settings.RUN_ADMISSION_WAIT
+            )
+            chat = Chat.objects.create(
+                assistant=job.assistant, thread_id=job.thread_id, input=job.input, output=output
+            )
+            if not cache_hit:
+                link_runs(chat)
+        except Exception as e:
+            logger.exception("chat job %s failed", job_id)
+            ChatJob.objects.filter(pk=job_id).update(
+                status=ChatJob.FAILED, error=str(e) or e.__class__.__name__, finished_at=timezone.now()
+            )
+        else:
+            ChatJob.objects.filter(pk=job_id).update(
+                status=ChatJob.DONE, chat=chat, finished_at=timezone.now()
+            )
+    finally:
+        event = forget_job(job_id)
+        if event is not None:
+            event.set()
+        connection.close()
+
+
+# Block for up to `timeout` seconds (at most CHAT_JOB_SYNC_MAX_WAIT) until the job is finished, then return its
+# latest state
+def wait_for_job(job, timeout):
+    deadline = time.monotonic() + min(timeout, settings.CHAT_JOB_SYNC_MAX_WAIT)
+    while not job.is_finished:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        with _done_events_lock:
+            event = _done_events.get(job.pk)
+        if event is not None:
+            # Answered in this process: sleep until the worker signals
+            event.wait(remaining)
+        else:
+            # Answered elsewhere (another worker or run_chat_jobs): fall back to re-reading the row
+            time.sleep(min(settings.CHAT_JOB_POLL_INTERVAL, remaining))
+        job.refresh_from_db()
+    if job.is_finished:
+        forget_job(job.pk)
+    return job
+
+
+# Async counterpart of `wait_for_job`, for up to CHAT_JOB_MAX_WAIT seconds; the wait holds no thread
+async def await_job(job, timeout):
+    deadline = time.monotonic() + min(timeout, settings.CHAT_JOB_MAX_WAIT)
+    while not job.is_finished:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        with _done_events_lock:
+            event = _done_events.get(job.pk)
+        if event is not None:
+            while not event.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(EVENT_CHECK_INTERVAL)
+        else:
+            await asyncio.sleep(min(settings.CHAT_JOB_POLL_INTERVAL, remaining))
+        await job.arefresh_from_db()
+    if job.is_finished:
+        forget_job(job.pk)
+    return job
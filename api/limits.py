@@ -0,0 +1,229 @@
+# Rate limits and run admission.
+# Requests that start assistant runs take a token from two token buckets, one per client (API token, or IP
+# address without one) and one per assistant; a client over its rate gets 429 with Retry-After straight away.
+# Runs themselves need one of RUN_ADMISSION_LIMIT run slots, so a burst cannot tie up every worker waiting
+# on OpenAI; without a free slot the request gets 503 with Retry-After instead of queueing into a timeout.
+# Buckets and slots live in Django's cache, so they are shared by all processes when REDIS_URL is set and
+# per process otherwise. Answers from the answer cache need no run slot.
+
+from asgiref.sync import sync_to_async
+from contextlib import asynccontextmanager, contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.throttling import BaseThrottle
+import asyncio
+import functools
+import hashlib
+import logging
+import math
+import random
+import time
+
+from api.instrumentation import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Seconds a client is asked to wait when every run slot is taken, and between tries of a waiting job
+ADMISSION_RETRY_AFTER = 2
+ADMISSION_POLL_INTERVAL = 0.25
+
+rate_limit_requests = Counter(
+    "rate_limit_requests_total", "Requests checked against a rate limit, by limiter and result.", ("limiter", "result"))
+run_admissions = Counter(
+    "run_admissions_total", "Assistant runs asking for a run slot, by admitted or rejected.", ("result",))
+runs_in_flight = Gauge("runs_in_flight", "Assistant runs of this process holding a run slot.")
+
+
+# Cache backends that keep their data inside one process
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+# Say so at startup when the limits are on but kept in a per-process cache (no REDIS_URL): every process then
+# admits RUN_ADMISSION_LIMIT runs and grants the full rates on its own; returns whether it warned
+def warn_if_per_process():
+    enabled = settings.RUN_ADMISSION_LIMIT or settings.RATE_LIMIT_CLIENT or settings.RATE_LIMIT_ASSISTANT
+    backend = settings.CACHES["default"]["BACKEND"]
+    if enabled and backend in PROCESS_LOCAL_CACHES:
+        logger.warning("rate limits and run admission are kept in a per-process cache (%s), so every process "
+                       "enforces them on its own; set REDIS_URL to share them", backend.rsplit(".", 1)[-1])
+        return True
+    return False
+
+
+class Overloaded(APIException):
+    status_code = 503
+    default_detail = "Too many assistant runs in progress, try again shortly."
+    default_code = "overloaded"
+
+    def __init__(self, wait=ADMISSION_RETRY_AFTER):
+        super().__init__()
+        self.wait = math.ceil(wait)
+
+
+# "60/m" -> (60, 60): requests per period in seconds, like DRF's throttle rates; None or "" means no limit
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    if not rate:
+        return None
+    count, period = rate.split("/")
+    return int(count), {"s": 1, "m": 60, "h": 3600, "d": 86400}[period.strip()[0]]
+
+
+class TokenBucket:
+    """
+    Token bucket per key, refilled at a rate such as "60/m" and holding at most `burst` tokens, kept in
+    Django's cache as the GCRA "theoretical arrival time": one integer (milliseconds) per key, advanced
+    with the cache's atomic incr, so it needs no locking. Rate and burst are read from settings on use.
+    """
+
+    def __init__(self, name, rate_setting, burst_setting):
+        self.name = name
+        self.rate_setting = rate_setting
+        self.burst_setting = burst_setting
+
+    def take(self, key, cost=1):
+        """
+        Take `cost` tokens for key; returns 0 when they were available, otherwise the seconds until they are.
+        A cost above the burst is taken from a full bucket, leaving it that many tokens in debt.
+        """
+        rate = parse_rate(getattr(settings, self.rate_setting))
+        if rate is None:
+            return 0
+        count, period = rate
+        interval = max(1, round(period * 1000 / count))
+        increment = cost * interval
+        capacity = max((getattr(settings, self.burst_setting) or count) * interval, increment)
+        ttl = math.ceil(capacity / 1000) + 1
+        cache_key = f"rate-limit:{self.name}:{key}"
+        now = int(time.time() * 1000)
+
+        if not cache.add(cache_key, now + increment, ttl):
+            try:
+                arrival = cache.incr(cache_key, increment)
+            except ValueError:
+                # Expired since the add
+                arrival = None
+            if arrival is None or arrival - increment < now:
+                # The bucket was full again; start counting from now
+                cache.set(cache_key, now + increment, ttl)
+            elif arrival - now > capacity:
+                cache.decr(cache_key, increment)
+                rate_limit_requests.inc(self.name, "limited")
+                return (arrival - capacity - now) / 1000
+            else:
+                cache.touch(cache_key, ttl)
+        rate_limit_requests.inc(self.name, "allowed")
+        return 0
+
+
+client_bucket = TokenBucket("client", "RATE_LIMIT_CLIENT", "RATE_LIMIT_CLIENT_BURST")
+assistant_bucket = TokenBucket("assistant", "RATE_LIMIT_ASSISTANT", "RATE_LIMIT_ASSISTANT_BURST")
+
+
+# The client a request counts against: its API token (hashed, it is a credential) or its address
+def client_key(request):
+    token = getattr(request, "auth", None)
+    if token is not None and getattr(token, "key", None):
+        return "token:" + hashlib.sha256(token.key.encode()).hexdigest()[:32]
+    return "ip:" + BaseThrottle().get_ident(request)
+
+
+# Charge a request that starts `cost` runs to its client and assistant; raises Throttled (429) when either is over
+# its rate
+def throttle(request, assistant_id, cost=1):
+    wait = client_bucket.take(client_key(request), cost)
+    if not wait and assistant_id is not None:
+        wait = assistant_bucket.take(assistant_id, cost)
+    if wait:
+        raise Throttled(wait)
+
+
+async def athrottle(request, assistant_id, cost=1):
+    await sync_to_async(throttle)(request, assistant_id, cost)
+
+
+class RunAdmission:
+    """
+    At most RUN_ADMISSION_LIMIT runs at once, as leases on numbered slots taken with the cache's atomic add.
+    A lease expires after the run deadline, so a process that dies mid-run does not keep its slot for good.
+    Interactive requests do not wait for a slot; background jobs and batches wait up to `wait` seconds.
+    """
+
+    # Take any free slot; returns its key, "" without a limit, or None when all are taken
+    def try_acquire(self):
+        limit = settings.RUN_ADMISSION_LIMIT
+        if not limit:
+            return ""
+        ttl = settings.RUN_TIMEOUT + 60
+        # Start at a random slot, so concurrent requests rarely try the same ones
+        start = random.randrange(limit)
+        for i in range(limit):
+            key = f"run-slot:{(start + i) % limit}"
+            if cache.add(key, 1, ttl):
+                return key
+        return None
+
+    def acquire(self, wait=0):
+        deadline = time.monotonic() + wait
+        key = self.try_acquire()
+        while key is None and time.monotonic() < deadline:
+            time.sleep(min(ADMISSION_POLL_INTERVAL, deadline - time.monotonic()))
+            key = self.try_acquire()
+        self.admitted(key)
+        return key
+
+    async def aacquire(self, wait=0):
+        deadline = time.monotonic() + wait
+        key = await sync_to_async(self.try_acquire)()
+        while key is None and time.monotonic() < deadline:
+            await asyncio.sleep(min(ADMISSION_POLL_INTERVAL, deadline - time.monotonic()))
+            key = await sync_to_async(self.try_acquire)()
+        self.admitted(key)
+        return key
+
+    def admitted(self, key):
+        if key is None:
+            run_admissions.inc("rejected")
+        else:
+            run_admissions.inc("admitted")
+            runs_in_flight.inc()
+
+    def release(self, key):
+        runs_in_flight.dec()
+        if key:
+            cache.delete(key)
+
+    async def arelease(self, key):
+        runs_in_flight.dec()
+        if key:
+            await sync_to_async(cache.delete)(key)
+
+
+admission = RunAdmission()
+
+
+# Hold a run slot for the duration of the block; raises Overloaded (503) when none is free within `wait` seconds
+@contextmanager
+def run_slot(wait=0):
+    key = admission.acquire(wait)
+    if key is None:
+        raise Overloaded()
+    try:
+        yield
+    finally:
+        admission.release(key)
+
+
+@asynccontextmanager
+async def arun_slot(wait=0):
+    key = await admission.aacquire(wait)
+    if key is None:
+        raise Overloaded()
+    try:
+        yield
+    finally:
+        await admission.arelease(key)
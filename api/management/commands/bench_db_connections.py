@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from rest_framework.test import APIRequestFactory
+import statistics
+import time
+
+from api.models import Assistant, Chat
+from api.views import AssistantDetailAPIView, AssistantView, ChatDetailAPIView, ChatView
+
+
+class Command(BaseCommand):
+    """
+    Compare the per-request cost of the database connection modes on the list and detail endpoints.
+
+    Every request is wrapped the way Django's request handler does it (close_old_connections before
+    and after), so with CONN_MAX_AGE = 0 each request connects anew, with a persistent connection it is
+    reused after a health check, and with DB_POOL it is taken from and returned to the pool. Run it
+    against the real database (DATABASE_URL) to see the savings there; on SQLite connecting is nearly free.
+    """
+    help = "Benchmark list and detail requests with new, persistent and pooled database connections."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and mode.")
+
+    def handle(self, *args, **options):
+        self.factory = APIRequestFactory(SERVER_NAME="localhost")
+        assistant = Assistant.objects.create(name="bench", instructions="")
+        chat = Chat.objects.create(assistant=assistant, thread_id="thread_bench", input="q", output="a")
+        endpoints = [
+            ("assistant list", AssistantView.as_view(), "/api/v1/assistants/", {}),
+            ("assistant detail", AssistantDetailAPIView.as_view(), f"/api/v1/assistants/{assistant.pk}/", {"pk": assistant.pk}),
+            ("chat list", ChatView.as_view(), "/api/v1/chat/", {}),
+            ("chat detail", ChatDetailAPIView.as_view(), f"/api/v1/chat/{chat.pk}/", {"pk": chat.pk}),
+        ]
+
+        settings_dict = connection.settings_dict
+        original = settings_dict["CONN_MAX_AGE"], settings_dict["CONN_HEALTH_CHECKS"], settings_dict.get("POOL")
+        modes = [("new", 0, False, None), ("persistent", 600, True, None)]
+        if settings_dict["ENGINE"] == "src.postgresql_pool":
+            modes.append(("pooled", 0, False, original[2] or {"min_size": 1, "max_size": 10, "timeout": 10.0,
+                                                              "health_checks": True}))
+        else:
+            self.stdout.write("pooled mode skipped: set DB_POOL with a PostgreSQL DATABASE_URL to include it")
+
+        results = {}
+        try:
+            for mode, max_age, health_checks, pool in modes:
+                connection.close()
+                settings_dict["CONN_MAX_AGE"], settings_dict["CONN_HEALTH_CHECKS"] = max_age, health_checks
+                settings_dict["POOL"] = pool
+                for label, view, url, kwargs in endpoints:
+                    results[label, mode] = self.time(view, url, kwargs, options["requests"])
+        finally:
+            connection.close()
+            settings_dict["CONN_MAX_AGE"], settings_dict["CONN_HEALTH_CHECKS"], settings_dict["POOL"] = original
+            assistant.delete()
+
+        names = [mode for mode, *_ in modes]
+        self.stdout.write(f"{connection.vendor}, median ms per request over {options['requests']} requests")
+        self.stdout.write(f"{'endpoint':<18}" + "".join(f"{name:>12}" for name in names) + f"{'saved':>12}")
+        for label, *_ in endpoints:
+            timings = [results[label, name] for name in names]
+            saved = timings[0] - min(timings[1:])
+            self.stdout.write(f"{label:<18}" + "".join(f"{t:>12.3f}" for t in timings) + f"{saved:>12.3f}")
+
+    def time(self, view, url, kwargs, requests):
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            close_old_connections()
+            response = view(self.factory.get(url), **kwargs)
+            response.render()
+            close_old_connections()
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.content
+        return statistics.median(timings)
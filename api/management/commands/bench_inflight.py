@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+import asyncio
+import itertools
+import threading
+import time
+
+from api import utils
+from api.models import Assistant, Chat
+from api.views import AsyncChatDetailAPIView, ChatDetailAPIView
+
+
+class FakeUpstream:
+    """
+    Stands in for the Assistants API: every run completes `latency` seconds after it is created.
+    Counts how many runs are in flight at once, which is the number this benchmark is about.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.ids = itertools.count()
+        self.started = {}
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def start_run(self):
+        with self.lock:
+            run_id = f"run_{next(self.ids)}"
+            self.started[run_id] = time.monotonic()
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        return self.run(run_id)
+
+    def run(self, run_id):
+        with self.lock:
+            done = run_id not in self.started or time.monotonic() - self.started[run_id] >= self.latency
+            if done and self.started.pop(run_id, None) is not None:
+                self.in_flight -= 1
+        return SimpleNamespace(id=run_id, status="completed" if done else "in_progress",
+                               failed_at=None, last_error=None)
+
+    def obj(self, prefix, **kwargs):
+        return SimpleNamespace(id=f"{prefix}_{next(self.ids)}", **kwargs)
+
+    def messages(self):
+        reply = SimpleNamespace(role="assistant", content=[SimpleNamespace(text=SimpleNamespace(value="ok"))])
+        return SimpleNamespace(data=[reply])
+
+    def sync_client(self):
+        """A client shaped like OpenAI() for the endpoints send_message_to_assistant uses."""
+        return SimpleNamespace(beta=SimpleNamespace(
+            assistants=SimpleNamespace(retrieve=lambda openai_id: self.obj("asst", instructions="")),
+            threads=SimpleNamespace(
+                retrieve=lambda thread_id: SimpleNamespace(id=thread_id),
+                messages=SimpleNamespace(
+                    create=lambda **kwargs: self.obj("msg"),
+                    list=lambda **kwargs: self.messages(),
+                ),
+                runs=SimpleNamespace(
+                    create=lambda **kwargs: self.start_run(),
+                    retrieve=lambda thread_id, run_id, **kwargs: self.run(run_id),
+                ),
+            ),
+        ))
+
+    def async_client(self):
+        """A client shaped like AsyncOpenAI() for the endpoints asend_message_to_assistant uses."""
+        def coro(func):
+            async def wrapper(*args, **kwargs):
+                return func(*args, **kwargs)
+            return wrapper
+
+        client = self.sync_client()
+        return SimpleNamespace(beta=SimpleNamespace(
+            assistants=SimpleNamespace(retrieve=coro(client.beta.assistants.retrieve)),
+            threads=SimpleNamespace(
+                messages=SimpleNamespace(
+                    create=coro(client.beta.threads.messages.create),
+                    list=coro(client.beta.threads.messages.list),
+                ),
+                runs=SimpleNamespace(
+                    create=coro(client.beta.threads.runs.create),
+                    retrieve=coro(client.beta.threads.runs.retrieve),
+                ),
+            ),
+        ))
+
+
+class Command(BaseCommand):
+    """
+    Compare how many assistant runs one process keeps in flight with the sync (WSGI) chat view
+    against the async (ASGI) chat view.
+
+    Both modes send the same number of chat messages through the real views, serializers and
+    database, against a fake upstream whose runs take a fixed time. The WSGI mode is limited by
+    its worker threads (1 for gunicorn's default sync worker); the ASGI mode by nothing but the
+    event loop.
+    """
+    help = "Benchmark in-flight assistant runs per process: WSGI (sync views) vs ASGI (async views)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Chat messages to send per mode.")
+        parser.add_argument("--latency", type=float, default=2.0, help="Seconds each fake run takes.")
+        parser.add_argument("--threads", type=int, default=1,
+                            help="WSGI worker threads per process (gunicorn --threads).")
+
+    def handle(self, *args, **options):
+        assistant = Assistant.objects.create(name="bench", instructions="")
+        chat = Chat.objects.create(thread_id="thread_bench")
+        last_id = chat.pk
+        original = utils.client, utils.async_client
+        # Every message comes from one client and needs a run, which is what the limits are there to stop
+        try:
+            with override_settings(RATE_LIMIT_CLIENT="", RATE_LIMIT_ASSISTANT="", RUN_ADMISSION_LIMIT=0):
+                results = [
+                    ("wsgi", self.bench_wsgi(assistant, chat, options)),
+                    ("asgi", self.bench_asgi(assistant, chat, options)),
+                ]
+        finally:
+            utils.client, utils.async_client = original
+            Chat.objects.filter(pk__gte=last_id).delete()
+            assistant.delete()
+
+        self.stdout.write(f"{options['requests']} messages, {options['latency']:.1f}s per run")
+        self.stdout.write(f"{'mode':<6}{'wall s':>10}{'req/s':>10}{'peak in-flight':>16}")
+        for mode, (wall, peak) in results:
+            self.stdout.write(f"{mode:<6}{wall:>10.2f}{options['requests'] / wall:>10.1f}{peak:>16}")
+
+    def body(self, assistant):
+        return {"assistant_id": assistant.pk, "input": "What was the revenue in 2022?"}
+
+    def bench_wsgi(self, assistant, chat, options):
+        upstream = FakeUpstream(options["latency"])
+        utils.client = upstream.sync_client()
+        factory = RequestFactory(SERVER_NAME="localhost")
+        view = ChatDetailAPIView.as_view()
+
+        def send(_):
+            try:
+                request = factory.put(f"/api/v1/chat/{chat.pk}/", self.body(assistant), content_type="application/json")
+                return view(request, pk=chat.pk).status_code
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+            list(executor.map(send, range(options["requests"])))
+        return time.monotonic() - started, upstream.peak
+
+    def bench_asgi(self, assistant, chat, options):
+        upstream = FakeUpstream(options["latency"])
+        utils.async_client = upstream.async_client()
+        factory = AsyncRequestFactory(headers={"host": "localhost"})
+        view = AsyncChatDetailAPIView.as_view()
+
+        async def send():
+            request = factory.put(f"/api/v1/chat/{chat.pk}/", self.body(assistant), content_type="application/json")
+            response = await view(request, pk=chat.pk)
+            return response.status_code
+
+        async def run_all():
+            return await asyncio.gather(*(send() for _ in range(options["requests"])))
+
+        started = time.monotonic()
+        asyncio.run(run_all())
+        return time.monotonic() - started, upstream.peak
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIRequestFactory
+import statistics
+import time
+
+from api.models import Assistant, Chat
+from api.pagination import IdCursorPagination
+from api.views import ChatView
+
+
+class Command(BaseCommand):
+    """
+    Show that the chat list endpoint responds in flat time as the chat table grows.
+
+    Seeds the table in steps up to the largest size and, at each step, times the first page,
+    a page from the middle of the table (reached through a cursor), the first page of one
+    thread, and the first and a middle page of one assistant (?assistant=). Everything runs in
+    a transaction that is rolled back, so no rows are left behind.
+    """
+    help = "Benchmark the paginated chat list at growing table sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma separated table sizes.")
+        parser.add_argument("--repeat", type=int, default=20, help="Requests per measurement (median is shown).")
+        parser.add_argument("--threads", type=int, default=1000, help="Distinct thread ids in the seeded rows.")
+        parser.add_argument("--assistants", type=int, default=20, help="Assistants to spread the seeded rows over.")
+
+    def handle(self, *args, **options):
+        self.factory = APIRequestFactory(SERVER_NAME="localhost")
+        self.view = ChatView.as_view()
+        self.repeat = options["repeat"]
+
+        self.stdout.write(f"{'rows':>10}{'first page ms':>16}{'middle page ms':>16}{'thread page ms':>16}"
+                          f"{'assistant ms':>16}{'asst middle ms':>16}")
+        with transaction.atomic():
+            assistants = Assistant.objects.bulk_create([
+                Assistant(name=f"bench {i}", instructions="") for i in range(options["assistants"])
+            ])
+            by_assistant = f"/api/v1/chat/?assistant={assistants[0].pk}"
+            seeded = 0
+            for size in sorted(int(size) for size in options["sizes"].split(",")):
+                seeded = self.seed(assistants, seeded, size, options["threads"])
+                first_id = Chat.objects.order_by("id").values_list("id", flat=True).first()
+                last_id = Chat.objects.order_by("-id").values_list("id", flat=True).first()
+                middle = self.cursor_url("/api/v1/chat/", (first_id + last_id) // 2)
+                self.stdout.write(
+                    f"{size:>10}"
+                    f"{self.time('/api/v1/chat/'):>16.2f}"
+                    f"{self.time(middle):>16.2f}"
+                    f"{self.time('/api/v1/chat/?thread_id=thread_bench_7'):>16.2f}"
+                    f"{self.time(by_assistant):>16.2f}"
+                    f"{self.time(self.cursor_url(by_assistant, (first_id + last_id) // 2)):>16.2f}"
+                )
+            transaction.set_rollback(True)
+
+    def seed(self, assistants, seeded, size, threads, batch=10000):
+        while seeded < size:
+            count = min(batch, size - seeded)
+            Chat.objects.bulk_create([
+                Chat(assistant=assistants[(seeded + i) % len(assistants)],
+                     thread_id=f"thread_bench_{(seeded + i) % threads}",
+                     input="What was the revenue in 2022?", output="Revenue was EUR 1.2 billion.")
+                for i in range(count)
+            ])
+            seeded += count
+        return seeded
+
+    def cursor_url(self, url, position):
+        paginator = IdCursorPagination()
+        paginator.base_url = f"http://localhost{url}"
+        return paginator.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+
+    def time(self, url):
+        """Median milliseconds to build and render one page."""
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            response = self.view(self.factory.get(url))
+            response.render()
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.content
+        return statistics.median(timings)
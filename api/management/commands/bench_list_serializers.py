@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+import time
+
+from api.models import Assistant, Chat
+from api.serializers import AssistantListSerializer, AssistantSerializer, ChatListSerializer, ChatSerializer
+
+
+class Command(BaseCommand):
+    """
+    Compare the throughput of the model serializers with the `.values()` list serializers.
+
+    For the assistant and chat lists, times fetching and serializing `--rows` rows both ways, once
+    including the database query and once for serialization alone, and prints rows per second.
+    The rows are seeded in a transaction that is rolled back.
+    """
+    help = "Benchmark rows/sec of the list serializers against the model serializers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000, help="Rows to serialize per measurement.")
+        parser.add_argument("--repeat", type=int, default=5, help="Measurements per case (best is shown).")
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        request = RequestFactory(SERVER_NAME="localhost").get("/api/v1/")
+
+        with transaction.atomic():
+            assistants = Assistant.objects.bulk_create([
+                Assistant(name=f"bench {i}", instructions="Answer questions about the annual report.",
+                          files="assistant_files/report.pdf" if i % 2 else None)
+                for i in range(rows)
+            ])
+            Chat.objects.bulk_create([
+                Chat(assistant=assistants[i % len(assistants)], thread_id=f"thread_bench_{i % 100}",
+                     input="What was the revenue in 2022?", output="Revenue was EUR 1.2 billion.")
+                for i in range(rows)
+            ])
+
+            self.stdout.write(f"{rows} rows, best of {repeat}")
+            self.stdout.write(f"{'list':<12}{'path':<24}{'model rows/s':>14}{'values rows/s':>15}{'speedup':>10}")
+            for label, model, serializer_class, list_serializer_class in (
+                ("assistants", Assistant, AssistantSerializer, AssistantListSerializer),
+                ("chats", Chat, ChatSerializer, ChatListSerializer),
+            ):
+                qs = model.objects.order_by("-id")[:rows]
+
+                def model_path(instances=None):
+                    return serializer_class(
+                        list(qs) if instances is None else instances, many=True, context={"request": request}
+                    ).data
+
+                def values_path(values=None):
+                    serializer = list_serializer_class(request)
+                    return serializer.data(list(serializer.queryset(qs)) if values is None else values)
+
+                instances = list(qs)
+                values = list(list_serializer_class(request).queryset(qs))
+                self.report(label, "query + serialize", rows, repeat, model_path, values_path)
+                self.report(label, "serialize only", rows, repeat,
+                            lambda: model_path(instances), lambda: values_path(values))
+            transaction.set_rollback(True)
+
+    def report(self, label, path, rows, repeat, model_path, values_path):
+        model_rate = rows / self.best(model_path, repeat)
+        values_rate = rows / self.best(values_path, repeat)
+        self.stdout.write(
+            f"{label:<12}{path:<24}{model_rate:>14,.0f}{values_rate:>15,.0f}{values_rate / model_rate:>9.1f}x"
+        )
+
+    def best(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
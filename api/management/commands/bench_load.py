@@ -0,0 +1,241 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test import AsyncClient, Client, override_settings
+from rest_framework.authtoken.models import Token
+import asyncio
+import json
+import statistics
+import threading
+import time
+
+from api import utils
+from api.fake_openai import FakeOpenAI
+from api.models import Assistant, Chat, ThreadMessage
+
+ENDPOINTS = ("chat", "open", "list", "detail", "assistants", "assistant")
+
+
+# Latency percentile (0-100) of a sorted list of seconds, in milliseconds
+def percentile(timings, p):
+    if not timings:
+        return None
+    index = min(len(timings) - 1, max(0, round(p / 100 * len(timings)) - 1))
+    return timings[index] * 1000
+
+
+class Command(BaseCommand):
+    """
+    Drive the /api/v1/ endpoints at a given concurrency against a local OpenAI stand-in (api/fake_openai.py)
+    and report throughput, latency percentiles and utilization, so performance can be compared between commits.
+
+    The views, serializers, authentication and database are the real ones; only OpenAI is replaced, with
+    configurable latency and failure injection. The mode follows ASYNC_VIEWS: without it, `--workers` threads
+    serve the requests like gunicorn threads do; with it, every client is a task on one event loop, as under
+    uvicorn. Each of the `--concurrency` clients sends its next request as soon as the previous one returns.
+    """
+    help = "Load-test the API endpoints against a fake OpenAI backend and report req/s and latency percentiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Requests to send in total.")
+        parser.add_argument("--concurrency", type=int, default=20, help="Clients sending requests at the same time.")
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Worker threads serving requests (sync views only, like gunicorn --threads).")
+        parser.add_argument("--mix", default="chat=1,list=4,detail=4,assistants=1",
+                            help=f"Weighted endpoint mix, name=weight, names from: {', '.join(ENDPOINTS)}.")
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds the fake adds to every OpenAI call.")
+        parser.add_argument("--run-latency", type=float, default=1.0, help="Seconds each fake run takes.")
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of OpenAI calls failing with 500.")
+        parser.add_argument("--run-failure-rate", type=float, default=0.0, help="Share of runs ending as failed.")
+        parser.add_argument("--rate-limits", action="store_true",
+                            help="Keep the rate limits and the run admission limit (api/limits.py) on; by default "
+                                 "they are off, so the clients of one token measure the API, not the throttle.")
+        parser.add_argument("--json", help="Also write the results to this file, e.g. to compare commits.")
+
+    def handle(self, *args, **options):
+        self.plan = self.build_plan(options["mix"], options["requests"])
+        fake = FakeOpenAI(options["latency"], options["run_latency"], options["failure_rate"],
+                          options["run_failure_rate"], seed=0)
+        original = utils.client, utils.async_client
+        utils.client, utils.async_client = fake.sync_client(), fake.async_client()
+        utils.assistant_cache.clear()
+
+        self.assistant = Assistant.objects.create(name="bench", instructions="", openai_id="asst_bench")
+        self.chats = [Chat.objects.create(assistant=self.assistant, thread_id=f"thread_bench_{i}", input="", output="")
+                      for i in range(options["concurrency"])]
+        self.opened = []
+        user = User.objects.create_user(f"bench-{time.monotonic_ns()}")
+        self.headers = {"authorization": f"Token {Token.objects.create(user=user).key}"}
+        limits = nullcontext() if options["rate_limits"] else override_settings(
+            RATE_LIMIT_CLIENT="", RATE_LIMIT_ASSISTANT="", RUN_ADMISSION_LIMIT=0)
+        # The fake's thread ids must never reach the shared thread pool, where real chats would be given them
+        with limits, override_settings(THREAD_POOL_SIZE=0):
+            try:
+                started, cpu_started = time.monotonic(), time.process_time()
+                if settings.ASYNC_VIEWS:
+                    mode, results, busy = "asgi", asyncio.run(self.run_asgi(options)), None
+                else:
+                    mode, (results, busy) = "wsgi", self.run_wsgi(options)
+                wall, cpu = time.monotonic() - started, time.process_time() - cpu_started
+            finally:
+                utils.client, utils.async_client = original
+                utils.assistant_cache.clear()
+                # The seed chats and those of "chat" requests go with the assistant; the messages mirrored from
+                # the fake's threads go by thread
+                chats = Chat.objects.filter(Q(assistant=self.assistant) | Q(pk__in=self.opened))
+                ThreadMessage.objects.filter(thread_id__in=chats.values("thread_id")).delete()
+                Chat.objects.filter(pk__in=self.opened).delete()
+                self.assistant.delete()
+                user.delete()
+
+        report = self.summarize(mode, options, results, wall, cpu, busy, fake.stats())
+        self.print_report(report)
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    def build_plan(self, mix, requests):
+        """The endpoint of every request, interleaved according to the weights."""
+        weights = {}
+        for part in mix.split(","):
+            name, _, weight = part.partition("=")
+            if name.strip() not in ENDPOINTS:
+                raise CommandError(f"unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+            weights[name.strip()] = int(weight or 1)
+        cycle = [name for name, weight in weights.items() for _ in range(weight)]
+        if not cycle:
+            raise CommandError("the mix is empty")
+        return [cycle[i % len(cycle)] for i in range(requests)]
+
+    def request_args(self, endpoint, client_index):
+        chat = self.chats[client_index % len(self.chats)]
+        if endpoint == "chat":
+            body = json.dumps({"assistant_id": self.assistant.pk, "input": "What was the revenue in 2022?"})
+            return "put", f"/api/v1/chat/{chat.pk}/", body
+        if endpoint == "open":
+            return "post", "/api/v1/chat/", json.dumps({"assistant_id": self.assistant.pk})
+        return "get", {
+            "list": "/api/v1/chat/?page_size=50",
+            "detail": f"/api/v1/chat/{chat.pk}/",
+            "assistants": "/api/v1/assistants/",
+            "assistant": f"/api/v1/assistants/{self.assistant.pk}/",
+        }[endpoint], None
+
+    def record(self, endpoint, response):
+        """Remember the chats that "open" requests create, which have no assistant yet; returns the status code."""
+        if endpoint == "open" and response.status_code == 201:
+            self.opened.append(response.json()["id"])
+        return response.status_code
+
+    def run_wsgi(self, options):
+        results, lock = [], threading.Lock()
+        slots = threading.BoundedSemaphore(options["workers"])
+        busy = [0.0]
+        requests = iter(enumerate(self.plan))
+
+        def client(index):
+            http = Client(SERVER_NAME="localhost", headers=self.headers, raise_request_exception=False)
+            try:
+                while True:
+                    with lock:
+                        item = next(requests, None)
+                    if item is None:
+                        return
+                    _, endpoint = item
+                    method, path, body = self.request_args(endpoint, index)
+                    started = time.monotonic()
+                    # A request waits for a free worker, as it would in gunicorn's queue
+                    with slots:
+                        served = time.monotonic()
+                        try:
+                            response = getattr(http, method)(path, body, content_type="application/json") \
+                                if body else getattr(http, method)(path)
+                            status = self.record(endpoint, response)
+                        except Exception:
+                            status = None
+                        finished = time.monotonic()
+                    with lock:
+                        busy[0] += finished - served
+                        results.append((endpoint, status, finished - started))
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            list(executor.map(client, range(options["concurrency"])))
+        return results, busy[0]
+
+    async def run_asgi(self, options):
+        results = []
+        requests = iter(enumerate(self.plan))
+
+        async def client(index):
+            # Exceptions reach every client listening for them, so count them as the 500s they become instead
+            http = AsyncClient(headers=self.headers, raise_request_exception=False)
+            for _, endpoint in requests:
+                method, path, body = self.request_args(endpoint, index)
+                started = time.monotonic()
+                try:
+                    if body:
+                        response = await getattr(http, method)(path, body, content_type="application/json")
+                    else:
+                        response = await getattr(http, method)(path)
+                    status = self.record(endpoint, response)
+                except Exception:
+                    status = None
+                results.append((endpoint, status, time.monotonic() - started))
+
+        # AsyncClient always sends "Host: testserver"
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            await asyncio.gather(*(client(i) for i in range(options["concurrency"])))
+        return results
+
+    def summarize(self, mode, options, results, wall, cpu, busy, upstream):
+        def stats(rows):
+            timings = sorted(seconds for _, _, seconds in rows)
+            return {
+                "requests": len(rows),
+                "errors": sum(1 for _, status, _ in rows if status is None or status >= 400),
+                "req_per_s": round(len(rows) / wall, 2),
+                "p50_ms": percentile(timings, 50),
+                "p95_ms": percentile(timings, 95),
+                "p99_ms": percentile(timings, 99),
+                "mean_ms": statistics.fmean(timings) * 1000 if timings else None,
+            }
+
+        return {
+            "mode": mode,
+            "options": {key: options[key] for key in ("requests", "concurrency", "workers", "mix", "latency",
+                                                      "run_latency", "failure_rate", "run_failure_rate")},
+            "wall_s": round(wall, 3),
+            "cpu_utilization": round(cpu / wall, 4),
+            "worker_utilization": round(busy / (options["workers"] * wall), 4) if busy is not None else None,
+            "total": stats(results),
+            "endpoints": {endpoint: stats([row for row in results if row[0] == endpoint])
+                          for endpoint in dict.fromkeys(self.plan)},
+            "upstream": upstream,
+        }
+
+    def print_report(self, report):
+        options = report["options"]
+        self.stdout.write(
+            f"{report['mode']}: {options['requests']} requests, concurrency {options['concurrency']}"
+            + (f", {options['workers']} workers" if report["mode"] == "wsgi" else "")
+            + f", OpenAI latency {options['latency']}s, run {options['run_latency']}s"
+        )
+        self.stdout.write(f"{'endpoint':<12}{'requests':>10}{'errors':>8}{'req/s':>10}"
+                          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, stats in [*report["endpoints"].items(), ("total", report["total"])]:
+            self.stdout.write(
+                f"{name:<12}{stats['requests']:>10}{stats['errors']:>8}{stats['req_per_s']:>10.1f}"
+                f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+            )
+        utilization = f"cpu {report['cpu_utilization']:.0%}"
+        if report["worker_utilization"] is not None:
+            utilization += f", workers busy {report['worker_utilization']:.0%}"
+        self.stdout.write(f"wall {report['wall_s']:.2f}s, {utilization}, "
+                          f"peak runs in flight {report['upstream']['peak_runs_in_flight']}, "
+                          f"injected failures {report['upstream']['injected_failures']}")
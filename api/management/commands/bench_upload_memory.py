@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from openai import OpenAI
+import httpx
+import os
+import tempfile
+import time
+import tracemalloc
+
+from api import utils
+
+
+class DiscardTransport(httpx.BaseTransport):
+    """Consumes the upload body chunk by chunk, like a remote server would, and answers as the Files API."""
+
+    def handle_request(self, request):
+        received = 0
+        for chunk in request.stream:
+            received += len(chunk)
+        return httpx.Response(200, json={
+            "id": "file-bench", "object": "file", "bytes": received, "created_at": int(time.time()),
+            "filename": "report.pdf", "purpose": "assistants", "status": "uploaded",
+        })
+
+
+# Write a PDF of roughly `size` bytes with incompressible stream objects, in chunks
+def write_synthetic_pdf(f, size, chunk_size):
+    f.write(b"%PDF-1.4\n")
+    written, obj = 0, 1
+    while written < size:
+        data = os.urandom(min(chunk_size, size - written))
+        f.write(b"%d 0 obj\n<< /Length %d >>\nstream\n" % (obj, len(data)) + data + b"\nendstream\nendobj\n")
+        written += len(data)
+        obj += 1
+    f.write(b"trailer\n<< /Root 1 0 R >>\n%%EOF\n")
+
+
+class Command(BaseCommand):
+    """
+    Check that the document upload path (hashing, storing and uploading to OpenAI) works in bounded
+    memory: large synthetic PDFs are pushed through store_file/upload_file against a local transport
+    that discards the body, and the peak of Python allocations is measured with tracemalloc.
+
+    Fails when a peak exceeds the bound, and prints the peaks per document size so it is visible
+    that they do not grow with the document.
+    """
+    help = "Measure peak memory of the assistant document upload path for large synthetic PDFs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="5,50", help="Comma separated document sizes in MB.")
+        parser.add_argument("--overhead", type=int, default=1024 * 1024,
+                            help="Bytes allowed on top of four upload chunks.")
+
+    def handle(self, *args, **options):
+        chunk_size = settings.UPLOAD_CHUNK_SIZE
+        bound = chunk_size * 4 + options["overhead"]
+        original = utils.client
+        utils.client = OpenAI(api_key="bench", max_retries=0, http_client=httpx.Client(transport=DiscardTransport()))
+
+        results = []
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+                for size_mb in (int(size) for size in options["sizes"].split(",")):
+                    results.append((size_mb, self.measure(size_mb * 1024 * 1024, chunk_size)))
+        finally:
+            utils.client = original
+
+        self.stdout.write(f"chunk size {chunk_size} bytes, bound {bound} bytes")
+        self.stdout.write(f"{'document MB':>12}{'peak KB':>12}")
+        for size_mb, peak in results:
+            self.stdout.write(f"{size_mb:>12}{peak // 1024:>12}")
+        worst = max(peak for _, peak in results)
+        if worst > bound:
+            raise CommandError(f"peak {worst} bytes exceeds the bound of {bound} bytes")
+        self.stdout.write("ok: peak memory stays within the bound")
+
+    def measure(self, size, chunk_size):
+        upload = TemporaryUploadedFile("report.pdf", "application/pdf", size, None)
+        write_synthetic_pdf(upload.file, size, chunk_size)
+        upload.file.flush()
+        upload.seek(0)
+
+        # Roll back the StoredFile row so the benchmark leaves no trace in the database
+        with transaction.atomic():
+            tracemalloc.start()
+            try:
+                tracemalloc.reset_peak()
+                file_id = utils.upload_file(upload)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            transaction.set_rollback(True)
+        # Storage moved the temporary file into MEDIA_ROOT; close() tolerates it being gone
+        upload.close()
+
+        if file_id != "file-bench":
+            raise CommandError(f"unexpected file id {file_id}")
+        return peak
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.models import PooledThread
+from api.thread_pool import thread_pool
+
+
+class Command(BaseCommand):
+    """
+    Fill the pool of pre-created threads up to THREAD_POOL_SIZE right away, e.g. in a release phase,
+    so the first chats after a deploy do not wait for the background refill.
+    """
+    help = "Create threads until the thread pool holds THREAD_POOL_SIZE unexpired threads."
+
+    def handle(self, *args, **options):
+        created = thread_pool.refill(low_water=thread_pool.size)
+        self.stdout.write(f"created {created} threads, {PooledThread.objects.count()} in the pool")
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+import time
+
+from api.figures import load_figures
+from api.models import StoredFile
+from api.search import index_document, load_index, search
+
+
+class Command(BaseCommand):
+    """
+    Build the local search index and figure table of every stored document that has none yet, e.g. for
+    documents stored before indexing existed (run `register_assistant_files` first for documents that are
+    not registered).
+    With --query, each index is also searched once to show what the endpoint would return and how fast.
+    """
+    help = "Extract the text of the stored documents and build their BM25 search indexes and figure tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Rebuild indexes that already exist.")
+        parser.add_argument("--query", help="Search every indexed document for this query afterwards.")
+
+    def handle(self, *args, **options):
+        indexed = failed = 0
+        for stored in StoredFile.objects.order_by("pk"):
+            started = time.monotonic()
+            if index_document(stored, force=options["force"]):
+                indexed += 1
+                stored.refresh_from_db()
+                figures = load_figures(stored.sha256)
+                self.stdout.write(f"{stored.file.name}: {stored.pages} pages, {len(figures)} figures "
+                                  f"in {time.monotonic() - started:.2f}s")
+            else:
+                failed += 1
+                stored.refresh_from_db()
+                self.stderr.write(f"{stored.file.name}: {stored.index_error}")
+                continue
+
+            if options["query"]:
+                load_index(stored.sha256)
+                started = time.perf_counter()
+                results = search(stored, options["query"], 3)
+                took = (time.perf_counter() - started) * 1000
+                self.stdout.write(f"  {len(results)} pages in {took:.2f} ms" + "".join(
+                    f"\n  p.{result['page']} ({result['score']}): {result['snippet'][:100]}" for result in results
+                ))
+        self.stdout.write(f"{indexed} document(s) indexed, {failed} failed")
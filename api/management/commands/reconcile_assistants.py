@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from openai import NotFoundError
+import json
+
+from api.models import Assistant
+from api.utils import client
+
+
+class Command(BaseCommand):
+    """
+    Compare the local Assistant rows with the assistants that exist in the OpenAI account
+    and report the drift between them:
+
+        orphans     assistants in OpenAI that no local row points to
+        missing     local rows whose openai_id no longer exists in OpenAI
+        mismatched  local rows whose instructions are not what OpenAI has
+
+    The remote list is read once, page by page with cursors. Ids that did not show up in the
+    listing are then confirmed with direct lookups in parallel before being reported missing.
+    """
+    help = "Report drift between local Assistant rows and the assistants in OpenAI."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--page-size", type=int, default=100, help="Assistants per page (max 100).")
+        parser.add_argument("--workers", type=int, default=8, help="Parallel lookups for unlisted ids.")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        remote = {assistant.id: assistant for assistant in self.list_remote(options["page_size"])}
+        local = {
+            row["openai_id"]: row
+            for row in Assistant.objects.values("id", "name", "openai_id", "instructions")
+        }
+
+        # Not in the listing: look each one up directly before calling it missing
+        unlisted = [openai_id for openai_id in local if openai_id not in remote]
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            for openai_id, assistant in zip(unlisted, executor.map(self.retrieve, unlisted)):
+                if assistant is not None:
+                    remote[openai_id] = assistant
+
+        report = {
+            "orphans": sorted(
+                ({"openai_id": a.id, "name": a.name} for openai_id, a in remote.items() if openai_id not in local),
+                key=lambda item: item["openai_id"],
+            ),
+            "missing": [
+                {"id": row["id"], "openai_id": openai_id, "name": row["name"]}
+                for openai_id, row in local.items() if openai_id not in remote
+            ],
+            "mismatched": [
+                {"id": row["id"], "openai_id": openai_id, "name": row["name"]}
+                for openai_id, row in local.items()
+                if openai_id in remote and not instructions_match(remote[openai_id].instructions, row["instructions"])
+            ],
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{len(local)} local, {len(remote)} remote")
+        for kind, items in report.items():
+            self.stdout.write(f"{kind}: {len(items)}")
+            for item in items:
+                self.stdout.write(f"  {item['openai_id']}  {item['name']}")
+
+    def list_remote(self, page_size):
+        """Yield every assistant in the account; the page object follows the `after` cursor itself."""
+        yield from client.beta.assistants.list(limit=page_size, order="asc")
+
+    def retrieve(self, openai_id):
+        try:
+            return client.beta.assistants.retrieve(openai_id)
+        except NotFoundError:
+            return None
+
+
+# The remote instructions are the standard template followed by the user-given instructions
+def instructions_match(remote_instructions, local_instructions):
+    return (remote_instructions or "").rstrip().endswith((local_instructions or "").strip())
@@ -0,0 +1,40 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.files import store_file
+from api.models import Assistant, StoredFile
+
+
+class Command(BaseCommand):
+    """
+    Register the documents of existing assistants in the content-addressed file store.
+
+    Assistants whose document has the same content as one already registered are pointed at
+    that copy. With --delete-duplicates, copies that no assistant uses any more are removed.
+    """
+    help = "Register existing assistant documents as StoredFiles and deduplicate identical copies."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--delete-duplicates", action="store_true",
+                            help="Delete duplicate copies from storage once no assistant points at them.")
+
+    def handle(self, *args, **options):
+        replaced = set()
+        for assistant in Assistant.objects.exclude(files="").exclude(files__isnull=True):
+            if not default_storage.exists(assistant.files.name):
+                self.stderr.write(f"{assistant.pk}: {assistant.files.name} is missing from storage")
+                continue
+            stored = store_file(assistant.files)
+            if stored.file.name != assistant.files.name:
+                replaced.add(assistant.files.name)
+                Assistant.objects.filter(pk=assistant.pk).update(files=stored.file.name)
+                self.stdout.write(f"{assistant.pk}: {assistant.files.name} -> {stored.file.name}")
+
+        if options["delete_duplicates"]:
+            in_use = set(Assistant.objects.values_list("files", flat=True))
+            in_use.update(StoredFile.objects.values_list("file", flat=True))
+            for name in sorted(replaced - in_use):
+                default_storage.delete(name)
+                self.stdout.write(f"deleted {name}")
+
+        self.stdout.write(f"{StoredFile.objects.count()} stored file(s), {len(replaced)} duplicate(s) replaced")
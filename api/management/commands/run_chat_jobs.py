@@ -0,0 +1,50 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+import time
+
+from api.jobs import get_executor, run_chat_job
+from api.models import ChatJob
+
+
+class Command(BaseCommand):
+    """
+    Answer queued chat jobs outside the web process.
+
+    Useful when the web dynos should not run jobs themselves, and to pick up jobs that were
+    left behind when a web process restarted before answering them.
+    """
+    help = "Answer queued background chat jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new jobs instead of exiting.")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between polls with --loop.")
+
+    def handle(self, *args, **options):
+        self.requeue_stale()
+        executor = get_executor()
+        while True:
+            job_ids = list(
+                ChatJob.objects.filter(status=ChatJob.QUEUED)
+                .order_by("created_at")
+                .values_list("pk", flat=True)[:settings.CHAT_JOB_WORKERS * 4]
+            )
+            futures = [executor.submit(run_chat_job, job_id) for job_id in job_ids]
+            for future in futures:
+                future.result()
+            if job_ids:
+                self.stdout.write(f"answered {len(job_ids)} job(s)")
+            if not options["loop"]:
+                break
+            if not job_ids:
+                time.sleep(options["interval"])
+
+    def requeue_stale(self):
+        """Put jobs back in the queue whose worker died while they were running."""
+        cutoff = timezone.now() - timedelta(seconds=settings.RUN_TIMEOUT * 2)
+        count = ChatJob.objects.filter(status=ChatJob.RUNNING, started_at__lt=cutoff).update(
+            status=ChatJob.QUEUED, started_at=None
+        )
+        if count:
+            self.stdout.write(f"requeued {count} stale job(s)")
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_storedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='chat',
+            name='assistant',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.assistant'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['assistant', 'created_at'], name='t_chat_assistant_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['thread_id', 'id'], name='t_chat_thread_id_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_chat_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssistantRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.CharField(max_length=64)),
+                ('thread_id', models.CharField(max_length=31)),
+                ('status', models.CharField(max_length=20)),
+                ('streamed', models.BooleanField(default=False)),
+                ('polls', models.PositiveIntegerField(default=0)),
+                ('queued_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('wall_time', models.FloatField()),
+                ('prompt_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('completion_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('total_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('error_code', models.CharField(blank=True, default='', max_length=64)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('assistant', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.assistant')),
+                ('chat', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='runs', to='api.chat')),
+            ],
+            options={
+                'db_table': 't_assistant_run',
+                'indexes': [models.Index(fields=['assistant', 'created_at'], name='t_run_assistant_created_idx'), models.Index(fields=['thread_id', 'chat'], name='t_run_thread_chat_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_assistantrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledThread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thread_id', models.CharField(max_length=31, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 't_thread_pool',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_pooledthread'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thread_id', models.CharField(max_length=31)),
+                ('message_id', models.CharField(max_length=64, unique=True)),
+                ('role', models.CharField(max_length=20)),
+                ('content', models.TextField()),
+                ('run_id', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 't_thread_message',
+                'indexes': [models.Index(fields=['thread_id', 'id'], name='t_thread_message_thread_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_threadmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='index_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='storedfile',
+            name='indexed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storedfile',
+            name='pages',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_storedfile_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chat',
+            name='t_chat_assistant_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['assistant', 'id'], name='t_chat_assistant_id_idx'),
+        ),
+    ]
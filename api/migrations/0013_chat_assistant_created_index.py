@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_chat_assistant_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['assistant', 'created_at'], name='t_chat_assistant_created_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
@@ -19,19 +20,157 @@ class Assistant(models.Model):
         return self.name
     
     def increment_query_count(self):
-        self.query_count += 1
-        self.save()
+        # Atomic in the database; the chat path counts through api.counters instead, in batches
+        Assistant.objects.filter(pk=self.pk).update(query_count=models.F("query_count") + 1)
+        self.refresh_from_db(fields=["query_count"])
     
     
 class Chat(models.Model):
-    assistant = models.ForeignKey(Assistant, on_delete=models.CASCADE, null=True)
+    # Covered by the (assistant, id) index below, so no separate index on the foreign key
+    assistant = models.ForeignKey(Assistant, on_delete=models.CASCADE, null=True, db_index=False)
     thread_id = models.CharField(max_length=len("thread_VqYz7vQJX4jJjkIMOA522vah"), null=True)
     input = models.TextField()
     output = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = "t_chat"
+        indexes = [
+            # Per-assistant lists in id order (the list's cursor order), so they are read from the index
+            # without a sort
+            models.Index(fields=["assistant", "id"], name="t_chat_assistant_id_idx"),
+            # Per-assistant time windows (?created_after=/?created_before=), so they seek to the window
+            models.Index(fields=["assistant", "created_at"], name="t_chat_assistant_created_idx"),
+            # Conversation history: the messages of one thread in id order
+            models.Index(fields=["thread_id", "id"], name="t_chat_thread_id_idx"),
+        ]
         
     def get_absolute_url(self):
         return reverse("chat-detail", kwargs={"pk": self.pk})
-    
\ No newline at end of file
+    
+
+class ChatJob(models.Model):
+    """A chat message that is answered in the background instead of inside the request."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    assistant = models.ForeignKey(Assistant, on_delete=models.CASCADE)
+    thread_id = models.CharField(max_length=len("thread_VqYz7vQJX4jJjkIMOA522vah"), null=True)
+    input = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    chat = models.ForeignKey(Chat, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "t_chat_job"
+
+    def get_absolute_url(self):
+        return reverse("chat-job", kwargs={"pk": self.pk})
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+class StoredFile(models.Model):
+    """
+    An uploaded document, stored once per distinct content (keyed by its SHA-256) together
+    with the id of its upload to OpenAI, so identical reports are stored, uploaded and indexed once.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='assistant_files/', max_length=255)
+    size = models.PositiveBigIntegerField()
+    openai_file_id = models.CharField(max_length=64, blank=True, default="")
+    # Local search index (api/search.py): set once the text is extracted and indexed, or why that failed
+    pages = models.PositiveIntegerField(null=True, blank=True)
+    indexed_at = models.DateTimeField(null=True, blank=True)
+    index_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "t_stored_file"
+
+    def __str__(self):
+        return self.file.name
+
+
+class AssistantRun(models.Model):
+    """
+    One assistant run as it happened: when OpenAI queued, started and finished it, how long we
+    waited for it and with how many status polls, its token usage and how it ended.
+    Written for every run that reaches a final state, failed ones included (see api/telemetry.py).
+    """
+    assistant = models.ForeignKey(Assistant, on_delete=models.CASCADE, null=True, db_index=False)
+    # Set once the answer is stored; runs that failed have no chat
+    chat = models.ForeignKey(Chat, on_delete=models.SET_NULL, null=True, blank=True, related_name="runs")
+    run_id = models.CharField(max_length=64)
+    thread_id = models.CharField(max_length=len("thread_VqYz7vQJX4jJjkIMOA522vah"))
+    status = models.CharField(max_length=20)
+    streamed = models.BooleanField(default=False)
+    polls = models.PositiveIntegerField(default=0)
+    # OpenAI's timestamps (whole seconds): queued, started (in_progress) and finished
+    queued_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Seconds from creating the run until we saw it finish
+    wall_time = models.FloatField()
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    total_tokens = models.PositiveIntegerField(null=True, blank=True)
+    error_code = models.CharField(max_length=64, blank=True, default="")
+    error_message = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "t_assistant_run"
+        indexes = [
+            # Latency statistics per assistant over a time range
+            models.Index(fields=["assistant", "created_at"], name="t_run_assistant_created_idx"),
+            # Linking a thread's finished runs to the chat that stores their answer
+            models.Index(fields=["thread_id", "chat"], name="t_run_thread_chat_idx"),
+        ]
+
+
+class PooledThread(models.Model):
+    """
+    An OpenAI thread created ahead of time, waiting to be handed to a new chat (see api/thread_pool.py).
+    """
+    thread_id = models.CharField(max_length=len("thread_VqYz7vQJX4jJjkIMOA522vah"), unique=True)
+    # Threads are handed out oldest first and dropped once older than THREAD_POOL_EXPIRY
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = "t_thread_pool"
+
+
+class ThreadMessage(models.Model):
+    """
+    A message of an OpenAI thread, mirrored locally (see api/history.py) so a conversation's
+    history is served from the database instead of being listed from OpenAI every time.
+    """
+    thread_id = models.CharField(max_length=len("thread_VqYz7vQJX4jJjkIMOA522vah"))
+    message_id = models.CharField(max_length=64, unique=True)
+    role = models.CharField(max_length=20)
+    content = models.TextField()
+    run_id = models.CharField(max_length=64, blank=True, default="")
+    # OpenAI's timestamp (whole seconds); the conversation order is the local id order
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = "t_thread_message"
+        indexes = [
+            # A thread's history in order, and its last message as the sync cursor
+            models.Index(fields=["thread_id", "id"], name="t_thread_message_thread_idx"),
+        ]
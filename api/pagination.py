@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key, newest first.
+
+    Every page is a single `WHERE id < <cursor> ORDER BY id DESC LIMIT n` query, so fetching a page
+    costs the same no matter how many rows the table holds or how deep the client has paged.
+    Clients follow the opaque `next`/`previous` links; `?page_size=` changes the page size up to
+    `max_page_size`.
+    """
+    ordering = "-id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
@@ -0,0 +1,310 @@
+# Local full-text search over the assistant documents.
+# When an assistant is saved with a document, its text is extracted page by page (in a background thread,
+# a 140-page annual report takes seconds), split into passages of about SEARCH_CHUNK_WORDS words and turned
+# into a BM25 inverted index that is stored next to the documents as search_index/<sha256>.json.gz.
+# Identical documents share one index, like they share one StoredFile. Searches load the index once per
+# process and answer from memory in milliseconds, with the best passage of each matching page as snippet.
+# The same pass extracts the figures of the document's tables (api/figures.py).
+# With SEARCH_CONTEXT_PASSAGES the best passages for a question are also given to its run, so the
+# assistant's remote retrieval has less to find.
+
+from asgiref.sync import sync_to_async
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+from api.cache import LRUCache
+from api.figures import FigureTable, extract_figures, figures_path, load_figures, write_figures
+from api.models import Assistant, StoredFile
+
+try:
+    import pypdf
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the index format or the tokenizer changes, so old indexes are not read
+INDEX_VERSION = 1
+
+# BM25 parameters: term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+
+SNIPPET_CHARS = 300
+
+TOKEN = re.compile(r"\w+")
+
+index_cache = LRUCache("search_index", maxsize=settings.SEARCH_INDEX_CACHE_SIZE, ttl=3600.0)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class IndexNotReady(Exception):
+    """The document has not been indexed yet (or its index is missing)."""
+
+
+class IndexFailed(Exception):
+    """The document could not be indexed, e.g. because it is not a PDF or has no text layer."""
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def index_path(sha256):
+    return f"search_index/v{INDEX_VERSION}/{sha256}.json.gz"
+
+
+# Text of every page of the document, in order (plain text files count as one page)
+def extract_pages(stored):
+    name = stored.file.name.lower()
+    with stored.file.open("rb") as f:
+        if name.endswith((".txt", ".md")):
+            return [f.read().decode("utf-8", errors="replace")]
+        if not name.endswith(".pdf"):
+            raise IndexFailed(f"cannot extract text from {os.path.basename(stored.file.name)}")
+        if not PDF_AVAILABLE:
+            raise IndexFailed("PDF text extraction needs the pypdf package")
+        return [page.extract_text() or "" for page in pypdf.PdfReader(f).pages]
+
+
+# Split the pages into passages of about `words` words; a passage never spans two pages
+def chunk_pages(pages, words):
+    chunks = []
+    for number, text in enumerate(pages, start=1):
+        tokens = text.split()
+        starts = list(range(0, len(tokens), words))
+        # A short tail is added to the passage before it instead of standing alone
+        if len(starts) > 1 and len(tokens) - starts[-1] < words // 4:
+            starts.pop()
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else len(tokens)
+            chunks.append((number, " ".join(tokens[start:end])))
+    return chunks
+
+
+def build_index(pages, words):
+    """
+    Build the inverted index of the pages: the passages with their page number and length in tokens,
+    and for every term its postings as a flat [passage, frequency, passage, frequency, ...] list.
+    """
+    chunks = chunk_pages(pages, words)
+    lengths = []
+    postings = {}
+    for i, (_, text) in enumerate(chunks):
+        tokens = tokenize(text)
+        lengths.append(len(tokens))
+        for term, frequency in Counter(tokens).items():
+            postings.setdefault(term, []).extend((i, frequency))
+    return {
+        "version": INDEX_VERSION,
+        "pages": len(pages),
+        "chunks": chunks,
+        "lengths": lengths,
+        "average_length": sum(lengths) / len(lengths) if lengths else 0.0,
+        "postings": postings,
+    }
+
+
+def write_index(sha256, index):
+    path = index_path(sha256)
+    data = gzip.compress(json.dumps(index, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(data))
+    index_cache.delete(sha256)
+    return len(data)
+
+
+# The index of a stored file, from this process' cache or from storage
+def load_index(sha256):
+    index = index_cache.get(sha256)
+    if index is None:
+        try:
+            with default_storage.open(index_path(sha256), "rb") as f:
+                index = json.loads(gzip.decompress(f.read()))
+        except FileNotFoundError:
+            raise IndexNotReady(sha256)
+        index_cache.set(sha256, index)
+    return index
+
+
+# Extract, chunk and index a stored file and build its figure table (api/figures.py), recording the outcome
+# on its row; returns True when indexed
+def index_document(stored, force=False):
+    built = default_storage.exists(index_path(stored.sha256)) and default_storage.exists(figures_path(stored.sha256))
+    if stored.indexed_at and not force and built:
+        return True
+    started = time.monotonic()
+    try:
+        pages = extract_pages(stored)
+        index = build_index(pages, settings.SEARCH_CHUNK_WORDS)
+        if not index["postings"]:
+            raise IndexFailed("the document has no extractable text")
+        size = write_index(stored.sha256, index)
+        figures = FigureTable.build(extract_figures(pages))
+        write_figures(stored.sha256, figures)
+    except Exception as e:
+        if not isinstance(e, IndexFailed):
+            logger.exception("could not index %s", stored.file.name)
+        StoredFile.objects.filter(pk=stored.pk).update(index_error=str(e) or e.__class__.__name__)
+        return False
+    StoredFile.objects.filter(pk=stored.pk).update(pages=len(pages), indexed_at=timezone.now(), index_error="")
+    logger.info("indexed %s: %d pages, %d passages, %d terms, %d bytes, %d figures in %.2fs", stored.file.name,
+                len(pages), len(index["chunks"]), len(index["postings"]), size, len(figures),
+                time.monotonic() - started)
+    return True
+
+
+# Index the stored file registered under this name (runs in the indexing thread)
+def index_file_named(name):
+    close_old_connections()
+    try:
+        stored = StoredFile.objects.filter(file=name).first()
+        if stored is not None:
+            index_document(stored)
+    finally:
+        connection.close()
+
+
+# Lazily create the process-wide indexing thread; one thread keeps text extraction from competing with requests
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+        return _executor
+
+
+@receiver(post_save, sender=Assistant)
+def assistant_saved(sender, instance, **kwargs):
+    if settings.SEARCH_INDEX and instance.files:
+        name = instance.files.name
+        transaction.on_commit(lambda: get_executor().submit(index_file_named, name))
+
+
+# BM25 scores of the passages that contain any of the query terms, best first, as (score, passage index)
+def rank(index, query):
+    terms = set(tokenize(query))
+    lengths = index["lengths"]
+    total = len(lengths)
+    average = index["average_length"] or 1.0
+    scores = {}
+    for term in terms:
+        postings = index["postings"].get(term)
+        if not postings:
+            continue
+        matching = len(postings) // 2
+        idf = math.log(1 + (total - matching + 0.5) / (matching + 0.5))
+        for i in range(0, len(postings), 2):
+            chunk, frequency = postings[i], postings[i + 1]
+            norm = K1 * (1 - B + B * lengths[chunk] / average)
+            scores[chunk] = scores.get(chunk, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+    return sorted(((score, chunk) for chunk, score in scores.items()), reverse=True)
+
+
+# Part of the passage around the first query term in it, at most SNIPPET_CHARS long
+def snippet(text, query):
+    if len(text) <= SNIPPET_CHARS:
+        return text
+    lowered = text.lower()
+    first = len(text)
+    for term in set(tokenize(query)):
+        match = re.search(rf"\b{re.escape(term)}\b", lowered)
+        if match:
+            first = min(first, match.start())
+    start = max(0, first - SNIPPET_CHARS // 3) if first < len(text) else 0
+    start = text.rfind(" ", 0, start) + 1 if start else 0
+    end = text.rfind(" ", start, start + SNIPPET_CHARS)
+    end = end if end > start else start + SNIPPET_CHARS
+    return ("…" if start else "") + text[start:end] + ("…" if end < len(text) else "")
+
+
+def stored_document(assistant):
+    """The StoredFile of the assistant's document, or None if it has none (or it was never registered)."""
+    if not assistant.files:
+        return None
+    return StoredFile.objects.filter(file=assistant.files.name).first()
+
+
+def search(stored, query, limit):
+    """
+    Search one document; returns up to `limit` pages, best first, each with its best passage.
+
+    Raises:
+        IndexFailed: The document could not be indexed.
+        IndexNotReady: The document is still being indexed.
+    """
+    if stored.index_error:
+        raise IndexFailed(stored.index_error)
+    if stored.indexed_at is None:
+        raise IndexNotReady(stored.sha256)
+    index = load_index(stored.sha256)
+    results, pages = [], set()
+    for score, chunk in rank(index, query):
+        page, text = index["chunks"][chunk]
+        if page in pages:
+            continue
+        pages.add(page)
+        results.append({"page": page, "score": round(score, 4), "snippet": snippet(text, query)})
+        if len(results) == limit:
+            break
+    return results
+
+
+def document_figures(stored):
+    """
+    The figure table of one document (see api/figures.py).
+
+    Raises:
+        IndexFailed: The document could not be indexed.
+        IndexNotReady: The document is still being indexed, or was indexed before figures were extracted.
+    """
+    if stored.index_error:
+        raise IndexFailed(stored.index_error)
+    table = load_figures(stored.sha256) if stored.indexed_at else None
+    if table is None:
+        raise IndexNotReady(stored.sha256)
+    return table
+
+
+# The best passages of the assistant's document for a question, as additional run instructions, or None
+def document_context(assistant, question):
+    if not settings.SEARCH_CONTEXT_PASSAGES:
+        return None
+    stored = stored_document(assistant)
+    if stored is None or stored.indexed_at is None:
+        return None
+    try:
+        index = load_index(stored.sha256)
+    except IndexNotReady:
+        return None
+    passages = [index["chunks"][chunk] for _, chunk in rank(index, question)[:settings.SEARCH_CONTEXT_PASSAGES]]
+    if not passages:
+        return None
+    return "Passages from the document that may answer the question:\n" + "\n".join(
+        f"[page {page}] {text}" for page, text in passages
+    )
+
+
+async def adocument_context(assistant, question):
+    if not settings.SEARCH_CONTEXT_PASSAGES:
+        return None
+    return await sync_to_async(document_context)(assistant, question)
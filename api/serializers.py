@@ -2,14 +2,45 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
+from django.core.files.storage import default_storage
 from django.utils import timezone
 from django.urls import reverse
+from django.conf import settings
+from asgiref.sync import sync_to_async
 # Internals
-from api.models import Assistant, Chat
-from api.utils import create_new_assistant, modify_assistant, delete_assistant, create_thread, send_message_to_assistant
+from api.models import Assistant, Chat, ChatJob
+from api.utils import create_new_assistant, modify_assistant, delete_assistant, send_message_to_assistant
+from api.utils import acreate_new_assistant, amodify_assistant, adelete_assistant, asend_message_to_assistant
+from api.utils import invalidate_assistant, invalidate_answers, answer_question, aanswer_question
+from api.telemetry import alink_runs, link_runs
+from api.thread_pool import anew_chat_thread, new_chat_thread
+from api.files import store_file
 
 
-class AssistantSerializer(serializers.ModelSerializer):
+class AsyncSaveMixin:
+    """
+    Adds `asave()`, the async counterpart of `save()`, for use in the async views.
+    Serializers using it implement `acreate()` and `aupdate()` next to `create()` and `update()`.
+    """
+
+    async def asave(self, **kwargs):
+        """
+        Create or update the instance from the validated data without blocking the event loop.
+
+        Returns:
+            Model: The created or updated instance, also stored on `self.instance`.
+        """
+        assert hasattr(self, '_errors'), "You must call `.is_valid()` before calling `.asave()`."
+        assert not self.errors, "You cannot call `.asave()` on a serializer with invalid data."
+        validated_data = {**self.validated_data, **kwargs}
+        if self.instance is not None:
+            self.instance = await self.aupdate(self.instance, validated_data)
+        else:
+            self.instance = await self.acreate(validated_data)
+        return self.instance
+
+
+class AssistantSerializer(AsyncSaveMixin, serializers.ModelSerializer):
     """
     A serializer for the Assistant model that supports both serialization for API
     responses and deserialization for creating or updating Assistant instances from API requests.
@@ -74,6 +105,10 @@ class AssistantSerializer(serializers.ModelSerializer):
             Assistant: The newly created Assistant instance.
         """
         files = validated_data.get('files')
+        if files is not None:
+            # Identical documents are stored once; the new row points at the shared copy
+            files = store_file(files).file
+            validated_data['files'] = files.name
         openai_assistant = create_new_assistant(
             validated_data["name"], 
             validated_data["company_name"], 
@@ -104,15 +139,19 @@ class AssistantSerializer(serializers.ModelSerializer):
         instance.updated_at = timezone.now()
         
         if 'files' in validated_data:
-            instance.files = validated_data['files']
+            files = validated_data['files']
+            instance.files = store_file(files).file.name if files else files
 
         modify_assistant(
             instance.openai_id, 
+            instance.name,
             new_name,
             instance.company_name, 
             instance.instructions,
             instance.files
         )
+        invalidate_assistant(instance.openai_id)
+        invalidate_answers(instance.pk)
         
         if new_name:
             instance.name = new_name
@@ -126,13 +165,68 @@ class AssistantSerializer(serializers.ModelSerializer):
         delete_assistant(
             instance.openai_id 
         )
+        invalidate_assistant(instance.openai_id)
+        invalidate_answers(instance.pk)
             
         instance.delete()
         # instance.refresh_from_db()
         return {"status": "deleted"}
+
+    async def acreate(self, validated_data):
+        """Async counterpart of `create()`."""
+        files = validated_data.get('files')
+        if files is not None:
+            files = (await sync_to_async(store_file)(files)).file
+            validated_data['files'] = files.name
+        openai_assistant = await acreate_new_assistant(
+            validated_data["name"],
+            validated_data["company_name"],
+            validated_data["instructions"],
+            files
+        )
+        new_assistant = Assistant(openai_id=openai_assistant.id, **validated_data)
+        await new_assistant.asave()
+        return new_assistant
+
+    async def aupdate(self, instance, validated_data):
+        """Async counterpart of `update()`."""
+        new_name = validated_data.get('new_name', None)
+        instance.company_name = validated_data.get('company_name', instance.company_name)
+        instance.instructions = validated_data.get('instructions', instance.instructions)
+        instance.updated_at = timezone.now()
+
+        if 'files' in validated_data:
+            files = validated_data['files']
+            instance.files = (await sync_to_async(store_file)(files)).file.name if files else files
+
+        await amodify_assistant(
+            instance.openai_id,
+            instance.name,
+            new_name,
+            instance.company_name,
+            instance.instructions,
+            instance.files
+        )
+        invalidate_assistant(instance.openai_id)
+        invalidate_answers(instance.pk)
+
+        if new_name:
+            instance.name = new_name
+
+        await instance.asave()
+        await instance.arefresh_from_db()
+        return instance
+
+    async def adelete(self, instance):
+        """Async counterpart of `delete()`."""
+        await adelete_assistant(instance.openai_id)
+        invalidate_assistant(instance.openai_id)
+        invalidate_answers(instance.pk)
+        await instance.adelete()
+        return {"status": "deleted"}
     
     
-class ChatSerializer(serializers.ModelSerializer):
+class ChatSerializer(AsyncSaveMixin, serializers.ModelSerializer):
     """
     A serializer for the Chat model that facilitates the serialization of chat data for 
     API responses and the deserialization of input data to create new Chat instances. 
@@ -174,7 +268,8 @@ class ChatSerializer(serializers.ModelSerializer):
             "assistant_id",# ID of the assistant involved in the chat (write-only)
             "thread_id",
             "input",       # User input message to the assistant
-            "output"       # Assistant's response to the user input
+            "output",      # Assistant's response to the user input
+            "created_at",  # When the chat was stored (read-only)
         )
         extra_kwargs = {
             "output": {"read_only": True},  # Output is generated, thus read-only
@@ -184,8 +279,8 @@ class ChatSerializer(serializers.ModelSerializer):
       
       
     def create(self, validated_data):
-        # Assuming send_message_to_assistant now properly handles thread_id creation and message sending
-        thread_id = create_thread()
+        # Take a pre-created thread from the pool (created inline when the pool is empty)
+        thread_id = new_chat_thread()
 
         chat = Chat.objects.create(thread_id=thread_id)
         return chat
@@ -195,15 +290,256 @@ class ChatSerializer(serializers.ModelSerializer):
         assistant_id = validated_data.pop('assistant_id')
         assistant = Assistant.objects.get(id=assistant_id)
 
-        # Use the assistant's OpenAI ID to send the user's input and obtain a response
-        output = send_message_to_assistant(assistant.openai_id, instance.thread_id, validated_data["input"])
+        # Use the assistant's OpenAI ID to send the user's input and obtain a response,
+        # unless the same question was answered before (see ANSWER_CACHE)
+        output, self.answer_cache_hit = answer_question(assistant, instance.thread_id, validated_data["input"])
 
-        # Create and save the new Chat instance with both input and obtained output
+        # Create and save the new Chat instance with both input and obtained output, in the thread the
+        # message was sent in, so its runs can be linked to it
+        validated_data["thread_id"] = instance.thread_id
         chat = Chat(assistant=assistant, **validated_data, output=output)
         chat.save()
+        if not self.answer_cache_hit:
+            link_runs(chat)
+        return chat
+
+    async def acreate(self, validated_data):
+        """Async counterpart of `create()`."""
+        thread_id = await anew_chat_thread()
+        return await Chat.objects.acreate(thread_id=thread_id)
+
+    async def aupdate(self, instance, validated_data):
+        """Async counterpart of `update()`."""
+        assistant_id = validated_data.pop('assistant_id')
+        assistant = await Assistant.objects.aget(id=assistant_id)
+
+        output, self.answer_cache_hit = await aanswer_question(assistant, instance.thread_id, validated_data["input"])
+
+        validated_data["thread_id"] = instance.thread_id
+        chat = Chat(assistant=assistant, **validated_data, output=output)
+        await chat.asave()
+        if not self.answer_cache_hit:
+            await alink_runs(chat)
         return chat
     
     
+class ChatJobSerializer(serializers.ModelSerializer):
+    """
+    A read-only serializer for ChatJob instances, used to report the state of chat messages
+    that are answered in the background. Once the job is done, the answer is taken from the
+    Chat row the job produced.
+
+    Attributes:
+        url (SerializerMethodField): Field to store the URL for the job's status view, dynamically generated.
+        chat_id (IntegerField): ID of the Chat row holding the answer, null until the job is done.
+        output (CharField): The assistant's response, null until the job is done.
+    """
+    url = serializers.SerializerMethodField()
+    chat_id = serializers.IntegerField(read_only=True, default=None)
+    output = serializers.CharField(source="chat.output", read_only=True, default=None)
+
+    def get_url(self, obj):
+        """
+        Method to generate a fully qualified URL for the job's status view.
+
+        Parameters:
+            obj (ChatJob): The ChatJob instance for which the URL is being generated.
+
+        Returns:
+            str: The fully qualified URL to the job's status view, if request context is available. Otherwise, None.
+        """
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(reverse('chat-job', kwargs={'pk': obj.pk}))
+        return None
+
+    class Meta:
+        model = ChatJob
+        fields = (
+            "id",
+            "url",
+            "status",
+            "assistant_id",
+            "thread_id",
+            "input",
+            "chat_id",
+            "output",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        )
+        read_only_fields = fields
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    A serializer for a batch of questions to one assistant. Validates the questions and the
+    concurrency limit, and renders each answered question with the Chat row it was stored in.
+
+    Attributes:
+        questions (ListField): The questions to ask, at most BATCH_MAX_QUESTIONS.
+        concurrency (IntegerField): How many questions are answered at once, at most BATCH_MAX_CONCURRENCY
+            (BATCH_CONCURRENCY when not given).
+    """
+    questions = serializers.ListField(
+        child=serializers.CharField(), min_length=1, max_length=settings.BATCH_MAX_QUESTIONS
+    )
+    concurrency = serializers.IntegerField(
+        min_value=1, max_value=settings.BATCH_MAX_CONCURRENCY, default=settings.BATCH_CONCURRENCY
+    )
+
+    def result(self, index, chat, error):
+        """
+        Render the outcome of one question of the batch.
+
+        Parameters:
+            index (int): Position of the question in `questions`.
+            chat (Chat): The Chat row holding the answer, or None if the question failed.
+            error (Exception): Why the question failed, or None.
+
+        Returns:
+            dict: index, question, the serialized chat (or None) and the error message (or None).
+        """
+        return {
+            "index": index,
+            "question": self.validated_data["questions"][index],
+            "chat": ChatSerializer(chat, context=self.context).data if chat is not None else None,
+            "error": (str(error) or error.__class__.__name__) if error is not None else None,
+        }
+
+
+class ValuesListSerializer:
+    """
+    A read-only serializer for list endpoints that works from `.values()` rows instead of model
+    instances, and produces the same output as the matching ModelSerializer. The absolute URL prefix
+    of the detail view is computed once per request instead of calling `reverse()` and
+    `build_absolute_uri()` for every row, and `?fields=` limits both the output and the selected columns.
+
+    Subclasses set:
+        fields (tuple): Output fields, in order.
+        url_name (str): Name of the detail view used for the `url` field, if the output has one.
+        datetime_fields (tuple): Fields rendered like DRF's DateTimeField.
+        file_fields (tuple): Fields rendered like DRF's FileField (absolute media URL or None).
+    """
+    fields = ()
+    url_name = None
+    datetime_fields = ()
+    file_fields = ()
+
+    def __init__(self, request, fields=None):
+        """
+        Parameters:
+            request (HttpRequest): The current request, used to build absolute URLs.
+            fields (list, optional): The fields to include; all fields when not given.
+
+        Raises:
+            ValidationError: If `fields` names a field this serializer does not have.
+        """
+        self.request = request
+        fields = list(fields or self.fields)
+        unknown = [name for name in fields if name not in self.fields]
+        if unknown:
+            raise serializers.ValidationError({"fields": [f"Unknown field(s): {', '.join(unknown)}."]})
+        self.selected = [name for name in self.fields if name in fields]
+        # "<scheme>://<host>/.../<pk>/" split around the pk, e.g. ("http://host/api/v1/chat/", "/")
+        if self.url_name:
+            self.url_prefix, _, self.url_suffix = request.build_absolute_uri(
+                reverse(self.url_name, kwargs={"pk": 0})
+            ).rpartition("0")
+        self.renderers = [(name, self.renderer(name)) for name in self.selected]
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Build the serializer for a list request, taking the field selection from `?fields=a,b`.
+        """
+        fields = request.GET.get("fields")
+        return cls(request, [name.strip() for name in fields.split(",") if name.strip()] if fields else None)
+
+    def columns(self):
+        """The columns to select: the selected fields (`url` comes from `id`), plus `id` for pagination."""
+        return ["id"] + [name for name in self.selected if name not in ("id", "url")]
+
+    def renderer(self, name):
+        """Return a function producing the value of one output field from a row."""
+        if name == "url":
+            prefix, suffix = self.url_prefix, self.url_suffix
+            return lambda row: f"{prefix}{row['id']}{suffix}"
+        if name in self.datetime_fields:
+            return lambda row: self.render_datetime(row[name])
+        if name in self.file_fields:
+            return lambda row: self.render_file(row[name])
+        return lambda row: row[name]
+
+    def render_datetime(self, value):
+        if value is None:
+            return None
+        value = timezone.localtime(value).isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+    def render_file(self, name):
+        if not name:
+            return None
+        return self.request.build_absolute_uri(default_storage.url(name))
+
+    def queryset(self, qs):
+        """Turn a queryset of the model into one of `.values()` rows with just the needed columns."""
+        return qs.values(*self.columns())
+
+    def to_representation(self, row):
+        return {name: render(row) for name, render in self.renderers}
+
+    def data(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class AssistantListSerializer(ValuesListSerializer):
+    """Fast read-only counterpart of AssistantSerializer for the assistant list."""
+    fields = (
+        "id",
+        "openai_id",
+        "url",
+        "name",
+        "company_name",
+        "instructions",
+        "created_at",
+        "updated_at",
+        "query_count",
+        "files",
+    )
+    url_name = "detail"
+    datetime_fields = ("created_at", "updated_at")
+    file_fields = ("files",)
+
+
+class ChatListSerializer(ValuesListSerializer):
+    """Fast read-only counterpart of ChatSerializer for the chat list."""
+    fields = (
+        "id",
+        "url",
+        "thread_id",
+        "input",
+        "output",
+        "created_at",
+    )
+    url_name = "chat-detail"
+    datetime_fields = ("created_at",)
+
+
+class ThreadMessageListSerializer(ValuesListSerializer):
+    """Read-only serializer for the locally mirrored messages of a thread (conversation history)."""
+    fields = (
+        "id",
+        "message_id",
+        "role",
+        "content",
+        "run_id",
+        "created_at",
+    )
+    datetime_fields = ("created_at",)
+
+
 class UserSerializer(serializers.ModelSerializer):
     """
     A serializer for Django's User model.
@@ -0,0 +1,119 @@
+# Run lifecycle telemetry.
+# Every assistant run that reaches a final state is stored as an AssistantRun row: OpenAI's queued, started
+# and finished timestamps, how long we waited and with how many polls, token usage and the error, if any.
+# The chat that stores the answer is linked afterwards. run_stats() turns the rows into latency percentiles
+# per assistant, to find the slow assistants (and documents) and to size capacity from real traffic.
+
+from asgiref.sync import sync_to_async
+from datetime import datetime, timezone
+import logging
+
+from api.models import AssistantRun
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def from_timestamp(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc) if seconds else None
+
+
+# When the run reached its final state, in OpenAI's unix seconds
+def finished_timestamp(run):
+    if run.status == "expired":
+        return run.expires_at
+    return run.completed_at or run.failed_at or run.cancelled_at
+
+
+# Store a finished run; telemetry must never fail the answer, so errors are only logged
+def record_run(run, stats, assistant_pk=None):
+    error = run.last_error
+    usage = run.usage
+    try:
+        AssistantRun.objects.create(
+            assistant_id=assistant_pk,
+            run_id=run.id,
+            thread_id=run.thread_id,
+            status=run.status,
+            streamed=stats.streamed,
+            polls=stats.polls,
+            queued_at=from_timestamp(run.created_at),
+            started_at=from_timestamp(run.started_at),
+            finished_at=from_timestamp(finished_timestamp(run)),
+            wall_time=stats.wall_time,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None,
+            total_tokens=usage.total_tokens if usage else None,
+            error_code=error.code if error else "",
+            error_message=error.message if error else "",
+        )
+    except Exception:
+        logger.exception("could not record run %s", run.id)
+
+
+async def arecord_run(run, stats, assistant_pk=None):
+    await sync_to_async(record_run)(run, stats, assistant_pk)
+
+
+# Link the thread's completed runs that have no chat yet to the chat that stores their answer.
+# OpenAI runs one run at a time per thread, so these are the runs that produced this chat.
+def link_runs(chat):
+    AssistantRun.objects.filter(thread_id=chat.thread_id, chat=None, status="completed").update(chat=chat)
+
+
+async def alink_runs(chat):
+    await AssistantRun.objects.filter(thread_id=chat.thread_id, chat=None, status="completed").aupdate(chat=chat)
+
+
+# Nearest-rank percentile (0-100) of a sorted list
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def distribution(values):
+    values = sorted(round(value, 3) for value in values if value is not None)
+    result = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+    result["max"] = values[-1] if values else None
+    return result
+
+
+# Latency percentiles, failure rate and token usage per assistant, slowest (by p95 wall time) first
+def run_stats(queryset):
+    rows = queryset.values_list(
+        "assistant_id", "assistant__name", "assistant__files", "status",
+        "wall_time", "queued_at", "started_at", "finished_at", "polls", "total_tokens",
+    )
+    groups = {}
+    for assistant_id, name, document, status, wall_time, queued, started, finished, polls, tokens in rows:
+        group = groups.setdefault(assistant_id, {
+            "assistant": assistant_id, "name": name, "document": document or None,
+            "runs": 0, "failed": 0, "wall_time": [], "queue_time": [], "run_time": [], "polls": [], "tokens": [],
+        })
+        group["runs"] += 1
+        if status != "completed":
+            group["failed"] += 1
+            continue
+        group["wall_time"].append(wall_time)
+        group["polls"].append(polls)
+        group["tokens"].append(tokens)
+        if queued and started:
+            group["queue_time"].append((started - queued).total_seconds())
+        if started and finished:
+            group["run_time"].append((finished - started).total_seconds())
+
+    results = []
+    for group in groups.values():
+        tokens = [n for n in group.pop("tokens") if n is not None]
+        polls = group.pop("polls")
+        group["failure_rate"] = round(group["failed"] / group["runs"], 4)
+        for key in ("wall_time", "queue_time", "run_time"):
+            group[key] = distribution(group[key])
+        group["mean_polls"] = round(sum(polls) / len(polls), 2) if polls else None
+        group["mean_tokens"] = round(sum(tokens) / len(tokens), 1) if tokens else None
+        group["total_tokens"] = sum(tokens)
+        results.append(group)
+    results.sort(key=lambda group: group["wall_time"]["p95"] or 0, reverse=True)
+    return results
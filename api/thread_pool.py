@@ -0,0 +1,165 @@
+# Pool of pre-created OpenAI threads.
+# Opening a chat used to create its thread inline, a full OpenAI round trip before the user typed anything.
+# New chats now take a ready thread id from t_thread_pool and only create one inline when the pool is empty.
+# A background thread per process (started on first use) tops the pool up to THREAD_POOL_SIZE whenever
+# it falls below THREAD_POOL_LOW_WATER, and drops threads older than THREAD_POOL_EXPIRY, deleting them at
+# OpenAI as well. Refills hold a lock in Django's cache, so with a shared cache (REDIS_URL) one process
+# refills at a time; the pool is recounted before every thread is created, so refills that still overlap
+# (per-process caches) do not each add a full pool.
+
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.utils import timezone
+import logging
+import random
+import threading
+
+from api.instrumentation import Counter
+from api.models import PooledThread
+from api.utils import acreate_thread, create_thread, delete_thread
+
+logger = logging.getLogger(__name__)
+
+thread_pool_requests = Counter(
+    "thread_pool_requests_total", "Threads asked of the pool by new chats, by hit or miss.", ("result",))
+thread_pool_created = Counter("thread_pool_created_total", "Threads created for the pool.")
+thread_pool_expired = Counter("thread_pool_expired_total", "Pooled threads dropped unused after THREAD_POOL_EXPIRY.")
+
+# Cache key of the refill lock, and seconds after which a lock whose holder died is given up
+REFILL_LOCK = "thread-pool-refill"
+REFILL_LOCK_TTL = 300
+
+
+class ThreadPool:
+    """
+    Hands out pre-created thread ids stored in the database and refills them from a background thread.
+    The rows are shared by all processes; each id is claimed by deleting its row, so it is used once.
+    Sizes and intervals are read from the THREAD_POOL_* settings on use, so they can be overridden.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    @property
+    def size(self):
+        return settings.THREAD_POOL_SIZE
+
+    @property
+    def low_water(self):
+        return settings.THREAD_POOL_LOW_WATER
+
+    @property
+    def expiry(self):
+        return settings.THREAD_POOL_EXPIRY
+
+    @property
+    def interval(self):
+        return settings.THREAD_POOL_REFILL_INTERVAL
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def take(self):
+        """Claim the oldest unexpired pooled thread id; returns None when the pool is empty."""
+        self.start()
+        cutoff = timezone.now() - timedelta(seconds=self.expiry)
+        candidates = list(
+            PooledThread.objects.filter(created_at__gte=cutoff).order_by("created_at").values_list("pk", "thread_id")[:5]
+        )
+        # Try the oldest few in random order, so concurrent requests rarely go for the same row
+        random.shuffle(candidates)
+        thread_id = None
+        for pk, candidate in candidates:
+            deleted, _ = PooledThread.objects.filter(pk=pk).delete()
+            if deleted:
+                thread_id = candidate
+                break
+        thread_pool_requests.inc("hit" if thread_id else "miss")
+        # Let the refiller check the level, off the request path
+        self._wake.set()
+        return thread_id
+
+    def refill(self, low_water=None):
+        """
+        Drop expired threads and top the pool up when it is below the low-water mark; returns threads created.
+        Does nothing while another refill holds the lock.
+        """
+        low_water = self.low_water if low_water is None else low_water
+        if not cache.add(REFILL_LOCK, 1, REFILL_LOCK_TTL):
+            return 0
+        try:
+            self.expire()
+            available = PooledThread.objects.count()
+            if not self.enabled or available >= low_water:
+                return 0
+            created = 0
+            while created < self.size and PooledThread.objects.count() < self.size:
+                try:
+                    PooledThread.objects.create(thread_id=create_thread())
+                except Exception:
+                    logger.exception("could not create a thread for the pool, retrying at the next refill")
+                    break
+                created += 1
+                thread_pool_created.inc()
+            logger.info("thread pool refilled with %d threads (%d were left)", created, available)
+            return created
+        finally:
+            cache.delete(REFILL_LOCK)
+
+    def expire(self):
+        """Drop the threads older than THREAD_POOL_EXPIRY, here and at OpenAI; returns how many were dropped."""
+        cutoff = timezone.now() - timedelta(seconds=self.expiry)
+        dropped = 0
+        for pk, thread_id in PooledThread.objects.filter(created_at__lt=cutoff).values_list("pk", "thread_id"):
+            # Claimed by deleting its row like a taken thread, so each one is deleted at OpenAI once
+            deleted, _ = PooledThread.objects.filter(pk=pk).delete()
+            if not deleted:
+                continue
+            dropped += 1
+            try:
+                delete_thread(thread_id)
+            except Exception:
+                logger.exception("could not delete expired pooled thread %s", thread_id)
+        if dropped:
+            thread_pool_expired.inc(amount=dropped)
+        return dropped
+
+    def start(self):
+        """Start the refiller thread of this process, once."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="thread-pool", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            close_old_connections()
+            try:
+                self.refill()
+            except Exception:
+                logger.exception("thread pool refill failed")
+            finally:
+                connection.close()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+thread_pool = ThreadPool()
+
+
+# Thread id for a new chat: from the pool when it has one, otherwise created inline
+def new_chat_thread():
+    thread_id = thread_pool.take() if thread_pool.enabled else None
+    return thread_id or create_thread()
+
+
+async def anew_chat_thread():
+    thread_id = await sync_to_async(thread_pool.take)() if thread_pool.enabled else None
+    return thread_id or await acreate_thread()
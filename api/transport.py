@@ -0,0 +1,338 @@
+# HTTP transport for the OpenAI clients.
+# Each client gets one pooled transport per process, sized and tuned from settings (connection limit,
+# keep-alive, HTTP/2 through the `h2` package in requirements.txt). Retries happen here instead of inside the
+# OpenAI library, under a process-wide retry budget so an upstream outage is not multiplied by our retries.
+# Every request is counted, so the share of requests that reused an open connection can be watched and tuned,
+# and timed per operation for the request instrumentation (api/instrumentation.py).
+
+from django.conf import settings
+import asyncio
+import email.utils
+import httpx
+import logging
+import random
+import threading
+import time
+
+from api.instrumentation import operation_name, record_upstream
+
+try:
+    import h2  # noqa: F401 (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# The statuses the OpenAI library itself retries
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Every pooled transport registers itself here by name, so its counters can be reported in one place
+transports = {}
+
+
+class RetryBudget:
+    """
+    Limits retries to a share of the traffic: every request deposits `ratio` tokens (up to `cap`)
+    and every retry spends one, so at most about ratio * requests are retried once the cap is used up.
+    """
+
+    def __init__(self, ratio, cap):
+        self.ratio = ratio
+        self.cap = cap
+        self._tokens = float(cap)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.cap, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """Spend a token for one retry; returns False when the budget is exhausted."""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self):
+        with self._lock:
+            return self._tokens
+
+
+class TransportMetrics:
+    """Thread-safe counters of one transport: requests, new connections, retries and in-flight calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.attempts = 0
+        self.connections = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, n in counts.items():
+                setattr(self, name, getattr(self, name) + n)
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "attempts": self.attempts,
+                "new_connections": self.connections,
+                "reuse_rate": round(1 - self.connections / self.attempts, 4) if self.attempts else None,
+                "retries": self.retries,
+                "retries_denied": self.retries_denied,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+            }
+
+
+# Connection pool limits from settings; max_connections also caps the HTTP/1.1 calls in flight per process
+def pool_limits():
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+# Use HTTP/2 when it is enabled and h2 is installed; say so when it is enabled but h2 is missing
+def use_http2():
+    if settings.OPENAI_HTTP2 and not HTTP2_AVAILABLE:
+        logger.warning("OPENAI_HTTP2 is on but the h2 package is not installed, using HTTP/1.1")
+    return settings.OPENAI_HTTP2 and HTTP2_AVAILABLE
+
+
+# Timeout for one kind of call: `read` seconds to wait for data, with the shared connect and pool timeouts
+def operation_timeout(read=None):
+    return httpx.Timeout(
+        settings.OPENAI_TIMEOUT if read is None else read,
+        connect=settings.OPENAI_CONNECT_TIMEOUT,
+        pool=settings.OPENAI_POOL_TIMEOUT,
+    )
+
+
+# Seconds to wait before retry number `attempt` (0-based): Retry-After when the server sent one, else jittered backoff
+def retry_delay(attempt, response=None):
+    if response is not None:
+        value = response.headers.get("retry-after")
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                try:
+                    seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    seconds = None
+            if seconds is not None and 0 <= seconds <= settings.OPENAI_RETRY_MAX_DELAY:
+                return seconds
+    delay = min(settings.OPENAI_RETRY_MAX_DELAY, settings.OPENAI_RETRY_BASE_DELAY * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
+# Only bodies held in memory can be sent again; streamed uploads are not retried
+def is_replayable(request):
+    return isinstance(request.stream, httpx.ByteStream)
+
+
+class TimedStream(httpx.SyncByteStream):
+    """Response body that calls `on_close` once it has been read and closed."""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class AsyncTimedStream(httpx.AsyncByteStream):
+    """Async response body that calls `on_close` once it has been read and closed."""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __aiter__(self):
+        return self._stream.__aiter__()
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class BasePooledTransport:
+    """Retry and metrics logic shared by the sync and async transports."""
+
+    def __init__(self, name, max_retries, budget):
+        self.name = name
+        self.max_retries = max_retries
+        self.budget = budget
+        self.metrics = TransportMetrics()
+        transports[name] = self
+
+    def should_retry(self, request, attempt):
+        if attempt >= self.max_retries or not is_replayable(request):
+            return False
+        if not self.budget.withdraw():
+            self.metrics.add(retries_denied=1)
+            return False
+        self.metrics.add(retries=1)
+        return True
+
+    def record(self, request, started, status):
+        """Time the call from the first attempt until its body is closed (or it failed)."""
+        record_upstream(operation_name(request.method, request.url.path), time.perf_counter() - started, status)
+
+    def on_trace(self, event):
+        if event == "connection.connect_tcp.started":
+            self.metrics.add(connections=1)
+
+    def stats(self):
+        stats = self.metrics.stats()
+        stats.update({
+            "http2": use_http2(),
+            "max_connections": settings.OPENAI_MAX_CONNECTIONS,
+            "max_keepalive_connections": settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry": settings.OPENAI_KEEPALIVE_EXPIRY,
+            "retry_budget_tokens": round(self.budget.tokens, 2),
+        })
+        return stats
+
+
+class PooledTransport(BasePooledTransport, httpx.BaseTransport):
+    """httpx transport for the sync OpenAI client."""
+
+    def __init__(self, name, transport=None, max_retries=None, budget=None):
+        super().__init__(
+            name,
+            settings.OPENAI_MAX_RETRIES if max_retries is None else max_retries,
+            budget or RetryBudget(settings.OPENAI_RETRY_BUDGET_RATIO, settings.OPENAI_RETRY_BUDGET_CAP),
+        )
+        self._transport = transport or httpx.HTTPTransport(limits=pool_limits(), http2=use_http2())
+
+    def handle_request(self, request):
+        request.extensions = {**request.extensions, "trace": self._trace(request.extensions.get("trace"))}
+        self.budget.deposit()
+        self.metrics.add(requests=1, in_flight=1)
+        started = time.perf_counter()
+        try:
+            attempt = 0
+            while True:
+                self.metrics.add(attempts=1)
+                try:
+                    response = self._transport.handle_request(request)
+                except httpx.TransportError:
+                    if not self.should_retry(request, attempt):
+                        self.metrics.add(errors=1)
+                        self.record(request, started, "error")
+                        raise
+                    delay = retry_delay(attempt)
+                else:
+                    if response.status_code not in RETRY_STATUSES or not self.should_retry(request, attempt):
+                        status = str(response.status_code)
+                        response.stream = TimedStream(response.stream, lambda: self.record(request, started, status))
+                        return response
+                    delay = retry_delay(attempt, response)
+                    # Read the (small) error body so the connection goes back to the pool instead of being dropped
+                    response.read()
+                    response.close()
+                logger.info("retrying %s %s in %.2fs", request.method, request.url, delay)
+                time.sleep(delay)
+                attempt += 1
+        finally:
+            self.metrics.add(in_flight=-1)
+
+    def _trace(self, trace):
+        def callback(event, info):
+            self.on_trace(event)
+            if trace is not None:
+                trace(event, info)
+        return callback
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncPooledTransport(BasePooledTransport, httpx.AsyncBaseTransport):
+    """httpx transport for the async OpenAI client."""
+
+    def __init__(self, name, transport=None, max_retries=None, budget=None):
+        super().__init__(
+            name,
+            settings.OPENAI_MAX_RETRIES if max_retries is None else max_retries,
+            budget or RetryBudget(settings.OPENAI_RETRY_BUDGET_RATIO, settings.OPENAI_RETRY_BUDGET_CAP),
+        )
+        self._transport = transport or httpx.AsyncHTTPTransport(limits=pool_limits(), http2=use_http2())
+
+    async def handle_async_request(self, request):
+        request.extensions = {**request.extensions, "trace": self._trace(request.extensions.get("trace"))}
+        self.budget.deposit()
+        self.metrics.add(requests=1, in_flight=1)
+        started = time.perf_counter()
+        try:
+            attempt = 0
+            while True:
+                self.metrics.add(attempts=1)
+                try:
+                    response = await self._transport.handle_async_request(request)
+                except httpx.TransportError:
+                    if not self.should_retry(request, attempt):
+                        self.metrics.add(errors=1)
+                        self.record(request, started, "error")
+                        raise
+                    delay = retry_delay(attempt)
+                else:
+                    if response.status_code not in RETRY_STATUSES or not self.should_retry(request, attempt):
+                        status = str(response.status_code)
+                        response.stream = AsyncTimedStream(
+                            response.stream, lambda: self.record(request, started, status))
+                        return response
+                    delay = retry_delay(attempt, response)
+                    await response.aread()
+                    await response.aclose()
+                logger.info("retrying %s %s in %.2fs", request.method, request.url, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            self.metrics.add(in_flight=-1)
+
+    def _trace(self, trace):
+        async def callback(event, info):
+            self.on_trace(event)
+            if trace is not None:
+                await trace(event, info)
+        return callback
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# httpx clients to hand to OpenAI(http_client=...) and AsyncOpenAI(http_client=...)
+def http_client():
+    return httpx.Client(transport=PooledTransport("sync"), timeout=operation_timeout(), follow_redirects=True)
+
+
+def async_http_client():
+    return httpx.AsyncClient(transport=AsyncPooledTransport("async"), timeout=operation_timeout(), follow_redirects=True)
@@ -1,6 +1,27 @@
+from django.conf import settings
 from django.urls import path
 # Internals
-from api.views import UserView, TokenView, AssistantView, AssistantDetailAPIView, ChatView, ChatDetailAPIView
+from api.views import UserView, TokenView, ChatStreamView, CacheStatsView, TransportStatsView
+from api.views import MetricsView, RunStatsView
+
+# ASYNC_VIEWS swaps the assistant and chat endpoints for their async views (ASGI deployments)
+if settings.ASYNC_VIEWS:
+    from api.views import (
+        AsyncAssistantView as AssistantView,
+        AsyncAssistantDetailAPIView as AssistantDetailAPIView,
+        AsyncChatView as ChatView,
+        AsyncChatDetailAPIView as ChatDetailAPIView,
+        AsyncChatJobAPIView as ChatJobAPIView,
+        AsyncAssistantBatchView as AssistantBatchView,
+        AsyncThreadMessagesView as ThreadMessagesView,
+        AsyncAssistantSearchView as AssistantSearchView,
+        AsyncAssistantFiguresView as AssistantFiguresView,
+        AsyncFiguresCompareView as FiguresCompareView,
+    )
+else:
+    from api.views import AssistantView, AssistantDetailAPIView, ChatView, ChatDetailAPIView, ChatJobAPIView
+    from api.views import AssistantBatchView
+    from api.views import ThreadMessagesView, AssistantSearchView, AssistantFiguresView, FiguresCompareView
 
 
 urlpatterns = [
@@ -8,8 +29,18 @@ urlpatterns = [
     path('tokens/', TokenView.as_view(), name="tokens"),
     path('assistants/', AssistantView.as_view(), name="assistants"),
     path("assistants/<int:pk>/", AssistantDetailAPIView.as_view(), name="detail"),
+    path("assistants/<int:pk>/batch/", AssistantBatchView.as_view(), name="assistant-batch"),
+    path("assistants/<int:pk>/search/", AssistantSearchView.as_view(), name="assistant-search"),
+    path("assistants/<int:pk>/figures/", AssistantFiguresView.as_view(), name="assistant-figures"),
+    path("figures/", FiguresCompareView.as_view(), name="figures"),
     path('chat/', ChatView.as_view(), name="chat"),
     path('chat/<int:pk>/', ChatDetailAPIView.as_view(), name="chat-detail"),
+    path('chat/jobs/<uuid:pk>/', ChatJobAPIView.as_view(), name="chat-job"),
+    path('chat/<int:pk>/stream/', ChatStreamView.as_view(), name="chat-stream"),
+    path('threads/<str:thread_id>/messages/', ThreadMessagesView.as_view(), name="thread-messages"),
+    path('cache/', CacheStatsView.as_view(), name="cache-stats"),
+    path('transport/', TransportStatsView.as_view(), name="transport-stats"),
+    path('metrics/', MetricsView.as_view(), name="metrics"),
+    path('runs/stats/', RunStatsView.as_view(), name="run-stats"),
     
 ]
-
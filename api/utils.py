@@ -4,38 +4,100 @@
 # If `thread_id` is not provided, a new thread is created using the `create_thread` function. Otherwise, the message is added to the existing thread specified by `thread_id`.
 
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, NotFoundError
 from django.conf import settings
+from asgiref.sync import sync_to_async
+from dataclasses import dataclass
+import asyncio
+import hashlib
+import httpx
+import logging
+import os
+import random
+import re
+import threading
 import time
 
-# Set up OpenAI with API key
+from api.cache import LRUCache
+from api.counters import count_query
+from api.files import ChunkedReader, store_file
+from api.history import alast_message_id, astore_messages, astored_answer, last_message_id, store_messages, stored_answer
+from api.instrumentation import apoll_sleep, poll_sleep, timed
+from api.limits import arun_slot, run_slot
+from api.models import StoredFile
+from api.search import adocument_context, document_context
+from api.telemetry import arecord_run, record_run
+from api.transport import async_http_client, http_client, operation_timeout
+
+logger = logging.getLogger(__name__)
+
+# Set up OpenAI with API key; connection pooling, timeouts and retries are configured in api/transport.py
 client = OpenAI(
     api_key=settings.APIKEY,
+    max_retries=0,
+    timeout=operation_timeout(),
+    http_client=http_client(),
+)
+
+# Async client for code running on the event loop (ASGI views)
+async_client = AsyncOpenAI(
+    api_key=settings.APIKEY,
+    max_retries=0,
+    timeout=operation_timeout(),
+    http_client=async_http_client(),
 )
-    
-# Create an assistant using user-given name and instructions (retrieved from AssistantModel)
-def create_new_assistant(name, company, instructions, uploaded_file=None):
-    # Initialize file_ids as an empty list
-    file_ids = []
-    
-    # Only proceed with file handling if uploaded_file is not None
-    if uploaded_file is not None:
-        # Read the content of the uploaded file into bytes
-        file_content = uploaded_file.read()
-        
-        # Create the file with OpenAI's API
-        file = client.files.create(
-            file=file_content,  # Pass the file content as bytes
-            purpose='assistants'
-        )
-        
-        # Add the created file's ID to the file_ids list
-        file_ids.append(file.id)
-    
 
+# Remote assistant objects by openai_id, so sending a message does not retrieve the assistant every time
+assistant_cache = LRUCache("assistants", maxsize=settings.ASSISTANT_CACHE_SIZE, ttl=settings.ASSISTANT_CACHE_TTL)
 
+# Retrieve an assistant from OpenAI, served from assistant_cache when possible
+def get_assistant(openai_id):
+    assistant = assistant_cache.get(openai_id)
+    if assistant is None:
+        assistant = client.beta.assistants.retrieve(openai_id)
+        assistant_cache.set(openai_id, assistant)
+    return assistant
 
-    instruction_string = f"""
+async def aget_assistant(openai_id):
+    assistant = assistant_cache.get(openai_id)
+    if assistant is None:
+        assistant = await async_client.beta.assistants.retrieve(openai_id)
+        assistant_cache.set(openai_id, assistant)
+    return assistant
+
+# Forget the cached copy after the assistant was changed or deleted
+def invalidate_assistant(openai_id):
+    assistant_cache.delete(openai_id)
+
+# Answers by (assistant, version, normalized question), used when ANSWER_CACHE is on
+answer_cache = LRUCache("answers", maxsize=settings.ANSWER_CACHE_SIZE, ttl=settings.ANSWER_CACHE_TTL)
+
+# Cache key for a question: changing anything that shapes the answer (the remote assistant, the name and
+# company in its instructions, the user-given instructions or the document) gives the assistant a new version,
+# including changes that bypass the serializers' invalidate_answers (admin, shell, migrations)
+def answer_key(assistant, question):
+    fields = (assistant.openai_id, assistant.name, assistant.company_name, assistant.instructions,
+              assistant.files.name or "")
+    version = hashlib.sha256("\0".join(fields).encode()).hexdigest()[:16]
+    normalized = " ".join(re.findall(r"\w+", question.lower()))
+    return (assistant.pk, version, normalized)
+
+def get_cached_answer(assistant, question):
+    if not settings.ANSWER_CACHE:
+        return None
+    return answer_cache.get(answer_key(assistant, question))
+
+def cache_answer(assistant, question, answer):
+    if settings.ANSWER_CACHE and answer:
+        answer_cache.set(answer_key(assistant, question), answer)
+
+# Drop every cached answer of an assistant (its instructions or document changed)
+def invalidate_answers(assistant_pk):
+    answer_cache.delete_where(lambda key: key[0] == assistant_pk)
+    
+# Standard instructions every assistant gets in front of the user-given instructions
+def build_instructions(name, company):
+    return f"""
 Instructions for the OpenAI API Assistant:
 
 1. Introduction: 
@@ -60,6 +122,41 @@ Instructions for the OpenAI API Assistant:
     - Continuously evaluate and refine your responses based on feedback and experience.
     - Learn from any mistakes or misunderstandings to enhance the quality of future interactions.
 """
+
+# Send a stored document to OpenAI, reading it from storage in chunks; returns its file id
+def send_file(stored):
+    with stored.file.open("rb") as f:
+        file = client.files.create(
+            file=(os.path.basename(stored.file.name), ChunkedReader(f)),
+            purpose='assistants',
+            timeout=operation_timeout(settings.OPENAI_UPLOAD_TIMEOUT),
+        )
+    return file.id
+
+# Upload a document to OpenAI once per distinct content and return its file id; later calls reuse it
+@timed("upload_file")
+def upload_file(uploaded_file):
+    stored = store_file(uploaded_file)
+    if not stored.openai_file_id:
+        stored.openai_file_id = send_file(stored)
+        StoredFile.objects.filter(pk=stored.pk).update(openai_file_id=stored.openai_file_id)
+    return stored.openai_file_id
+
+# Create an assistant using user-given name and instructions (retrieved from AssistantModel)
+@timed("create_new_assistant")
+def create_new_assistant(name, company, instructions, uploaded_file=None):
+    # Initialize file_ids as an empty list
+    file_ids = []
+    
+    # Only proceed with file handling if uploaded_file is not None
+    if uploaded_file is not None:
+        # Upload the file with OpenAI's API, unless this content was uploaded before
+        file_ids.append(upload_file(uploaded_file))
+    
+
+
+
+    instruction_string = build_instructions(name, company)
     # if uploaded_file is None:    
     #     description_string = f"Your name is {name}, an assistant working for {company}."
     #     description_string += f"You are designed to make customers feel like they're chatting with a real help desk agent. "
@@ -90,64 +187,20 @@ Instructions for the OpenAI API Assistant:
     return assistant
 
 # Modify an assistant using user-given name and description (retrieved from AssistantModel)
-def modify_assistant(openai_id, new_name, company, instructions, uploaded_file):
-    print(new_name)
+@timed("modify_assistant")
+def modify_assistant(openai_id, current_name, new_name, company, instructions, uploaded_file):
     # Initialize file_ids as an empty list
     file_ids = []
     if uploaded_file:
-        file_content = uploaded_file.read()
-        
-        # Create the file with OpenAI's API
-        file = client.files.create(
-            file=file_content,  # Pass the file content as bytes
-            purpose='assistants'
-        )
-        
-        # Add the created file's ID to the file_ids list
-        file_ids.append(file.id)
-
-    # Retrieve the list of existing assistants
-    existing_assistants = client.beta.assistants.list()
-
-    # Check if the desired assistant exists in the list
-    desired_assistant_id = openai_id  # Placeholder, could be something like "desired_assistant.name", 
-                                      # "desired_assistant" being an instance of AssistantModel
-    assistant = None
-    for existing_assistant in existing_assistants.data:
-        if existing_assistant.id == desired_assistant_id:
-            assistant = existing_assistant
-            break
-      
-    # Retrieve assistant
-    assistant = client.beta.assistants.retrieve(assistant.id)
-    
-    updated_name = new_name if new_name is not None and new_name != assistant.name else assistant.name
-
-    instruction_string = f"""
-Instructions for the OpenAI API Assistant:
-
-1. Introduction: 
-    - You are an assistant named {new_name}, employed by {company}.
-    - Your primary task is to read and analyze files provided by users, if possible.
-
-2. Communication Style:
-    - Your responses should always be cohesive and natural, resembling those of a real help desk agent.
-    - Avoid direct references to the source material; reword information as necessary to provide a seamless interaction.
-    - Ensure that each response is concise yet comprehensive, conveying all crucial information without unnecessary elaboration.
+        # Upload the file with OpenAI's API, unless this content was uploaded before
+        file_ids.append(upload_file(uploaded_file))
 
-3. User Interaction:
-    - Engage with users in a manner that mimics human conversation, aiming to make them feel comfortable and understood.
-    - Base your responses on previous messages from the user, ensuring continuity and relevance in the conversation.
-    - End each response with a question if further clarification is needed, promoting continued engagement and dialogue.
+    # Only send the name when it changes; leaving it out keeps the current one, so the
+    # assistant does not have to be looked up first
+    name_kwargs = {"name": new_name} if new_name else {}
 
-4. Accuracy and Precision:
-    - Strive for accuracy in your analyses of file data, but be aware of potential limitations or errors in interpretation.
-    - Avoid unnecessary references to the file itself unless directly relevant to the user's inquiry.
-
-5. Continuous Improvement:
-    - Continuously evaluate and refine your responses based on feedback and experience.
-    - Learn from any mistakes or misunderstandings to enhance the quality of future interactions.
-"""
+    # The instructions name the assistant, so a company-only update keeps the current name in them
+    instruction_string = build_instructions(new_name or current_name, company)
 
     # if uploaded_file is None:    
     #     description_string =  f"Your name is {updated_name}, an assistant working for {company}."
@@ -168,91 +221,451 @@ Instructions for the OpenAI API Assistant:
 
     # Update the assistant
     assistant = client.beta.assistants.update(
-        assistant.id,
-        name=updated_name,
+        openai_id,
+        **name_kwargs,
         instructions=f"{instruction_string} {instructions}",
         file_ids=file_ids
     )
     
     return assistant
 
+# Delete an assistant by its OpenAI ID
+@timed("delete_assistant")
 def delete_assistant(openai_id):
-     # Retrieve the list of existing assistants
-    existing_assistants = client.beta.assistants.list()
-
-    # Check if the desired assistant exists in the list
-    desired_assistant_id = openai_id  # Placeholder, could be something like "desired_assistant.name", 
-                                      # "desired_assistant" being an instance of AssistantModel
-    assistant = None
-    for existing_assistant in existing_assistants.data:
-        if existing_assistant.id == desired_assistant_id:
-            assistant = existing_assistant
-            break
-      
-    # Retrieve assistant
-    assistant = client.beta.assistants.retrieve(assistant.id)
-    print(assistant.name)
-    
-    client.beta.assistants.delete(assistant.id)
-    
-    print(assistant.name)
+    client.beta.assistants.delete(openai_id)
+    logger.info("deleted assistant %s", openai_id)
+
+
+# Run statuses in which the assistant is still working on an answer
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "cancelling")
+
+
+class RunTimeoutError(Exception):
+    """Raised when a run is still active once its deadline has passed."""
+
+
+class RunFailedError(Exception):
+    """Raised when a run ends in a state other than completed."""
+
+
+@dataclass
+class RunStats:
+    """How a run was waited on: number of status polls, wall time and whether it was streamed."""
+    polls: int = 0
+    wall_time: float = 0.0
+    streamed: bool = False
 
 
-# Wait for the connection with the OpenAI API is established before trying to start a conversation
-def wait_on_run(run, thread):
-    while run.status == "queued" or run.status == "in_progress":
+# Yield sleep intervals: quick first checks, then jittered exponential spacing up to RUN_POLL_MAX
+def poll_intervals():
+    delay = settings.RUN_POLL_INITIAL
+    while True:
+        yield delay * random.uniform(0.8, 1.2)
+        delay = min(delay * settings.RUN_POLL_MULTIPLIER, settings.RUN_POLL_MAX)
+
+
+# Cancel a run that outlived its deadline so the thread accepts new messages again
+def cancel_run(thread_id, run_id):
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception:
+        logger.exception("could not cancel run %s on thread %s", run_id, thread_id)
+
+
+# Wait until the run leaves the queued/in_progress states, polling with adaptive backoff
+def wait_on_run(run, thread_id, timeout=None):
+    timeout = settings.RUN_TIMEOUT if timeout is None else timeout
+    stats = RunStats()
+    started = time.monotonic()
+    deadline = started + timeout
+    intervals = poll_intervals()
+
+    while run.status in ACTIVE_RUN_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            stats.wall_time = time.monotonic() - started
+            cancel_run(thread_id, run.id)
+            raise RunTimeoutError(f"run {run.id} still {run.status} after {stats.wall_time:.1f}s")
+        poll_sleep(min(next(intervals), remaining))
         run = client.beta.threads.runs.retrieve(
-            thread_id=thread.id,
+            thread_id=thread_id,
             run_id=run.id,
+            timeout=operation_timeout(settings.OPENAI_POLL_TIMEOUT),
         )
-        time.sleep(3.5)
+        stats.polls += 1
 
+    stats.wall_time = time.monotonic() - started
+    logger.info("run %s %s after %d polls in %.2fs", run.id, run.status, stats.polls, stats.wall_time)
+    if run.status == "failed":
+        logger.warning("run %s failed at %s: %s", run.id, run.failed_at, run.last_error)
+    return run, stats
+
+
+# Instructions of a run, plus the passages of the document found locally for the question, if any
+def run_instructions(instructions, context=None):
+    if context:
+        return {"instructions": instructions, "additional_instructions": context}
+    return {"instructions": instructions}
+
+
+# Create a run and follow its event stream until it is done (openai>=1.20 only)
+def stream_run(thread_id, assistant_id, instructions, timeout=None, context=None):
+    timeout = settings.RUN_TIMEOUT if timeout is None else timeout
+    stats = RunStats(streamed=True)
+    started = time.monotonic()
+
+    with client.beta.threads.runs.stream(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        **run_instructions(instructions, context),
+        # Events can be far apart while the assistant works, so only the run deadline bounds the read
+        timeout=operation_timeout(timeout),
+    ) as stream:
+        # No event may arrive for a long time, so a watchdog cancels the run at the deadline, which ends the
+        # stream; the read timeout only covers a connection that went silent
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            run = stream.current_run
+            if run is not None:
+                cancel_run(thread_id, run.id)
+
+        watchdog = threading.Timer(timeout, expire)
+        watchdog.daemon = True
+        watchdog.start()
+        run = None
+        try:
+            for event in stream:
+                if expired.is_set():
+                    break
+            else:
+                run = stream.get_final_run()
+        except httpx.ReadTimeout:
+            watchdog.cancel()
+            if not expired.is_set():
+                expire()
+        finally:
+            watchdog.cancel()
+    # Either no final run, or the one the watchdog cancelled
+    if run is None or (expired.is_set() and run.status != "completed"):
+        stats.wall_time = time.monotonic() - started
+        raise RunTimeoutError(f"streamed run still active after {stats.wall_time:.1f}s")
+
+    stats.wall_time = time.monotonic() - started
+    logger.info("run %s %s (streamed) in %.2fs", run.id, run.status, stats.wall_time)
     if run.status == "failed":
-        print(run.failed_at)
-    return run
+        logger.warning("run %s failed at %s: %s", run.id, run.failed_at, run.last_error)
+    return run, stats
+
+
+# Start a run on the thread and block until it has finished, streaming when the client supports it
+@timed("run_to_completion")
+def run_to_completion(thread_id, assistant_id, instructions, timeout=None, context=None):
+    if settings.RUN_STREAMING and hasattr(client.beta.threads.runs, "stream"):
+        return stream_run(thread_id, assistant_id, instructions, timeout, context)
+
+    run = client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        **run_instructions(instructions, context)
+    )
+    return wait_on_run(run, thread_id, timeout)
 
 # Function to create a new thread
+@timed("create_thread")
 def create_thread():
     # Retrieve the assistant object
     thread = client.beta.threads.create()
-    print(f"created thread with id {thread.id}")
+    logger.info("created thread with id %s", thread.id)
     return thread.id
 
-# Send/retrieve messages to/from assistant
-def send_message_to_assistant(openai_id, thread_id, msg):
-    # Retrieve assistant
-    assistant = client.beta.assistants.retrieve(openai_id)
+# Delete a thread that will not be used, e.g. an expired pooled one; one that is gone already is fine
+@timed("delete_thread")
+def delete_thread(thread_id):
+    try:
+        client.beta.threads.delete(thread_id)
+    except NotFoundError:
+        return
+    logger.info("deleted thread with id %s", thread_id)
+
+# Largest page OpenAI returns when listing messages
+MESSAGE_PAGE_SIZE = 100
+
+
+# List the messages the thread gained since the last one stored locally, store them and return them
+def mirror_messages(thread_id):
+    after = last_message_id(thread_id)
+    messages = []
+    while True:
+        page = client.beta.threads.messages.list(
+            thread_id=thread_id, order="asc", limit=MESSAGE_PAGE_SIZE, **({"after": after} if after else {})
+        )
+        messages += page.data
+        # A short page is the last one, so the usual empty follow-up request is not needed
+        if len(page.data) < MESSAGE_PAGE_SIZE:
+            break
+        after = page.data[-1].id
+    store_messages(messages)
+    return messages
+
 
-    thread = client.beta.threads.retrieve(thread_id)
-    print(f"retrieved thread with id {thread.id}")
+# Send/retrieve messages to/from assistant
+@timed("send_message_to_assistant")
+def send_message_to_assistant(openai_id, thread_id, msg, assistant_pk=None, context=None):
+    # Retrieve assistant (cached)
+    assistant = get_assistant(openai_id)
 
     # Define the user's message
     message = client.beta.threads.messages.create(
-        thread_id=thread.id,
+        thread_id=thread_id,
         role="user",
         content=msg)
 
-    # Send the message and pre-given instructions to assistant 
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
+    # Send the message and pre-given instructions to assistant and wait for the answer
+    run, stats = run_to_completion(thread_id, assistant.id, assistant.instructions, context=context)
+    record_run(run, stats, assistant_pk)
+    if run.status != "completed":
+        raise RunFailedError(f"run {run.id} ended as {run.status}: {run.last_error}")
+
+    # Mirror the thread's new messages (the question and the answer) and return the answer
+    mirror_messages(thread_id)
+    answer = stored_answer(thread_id, message.id)
+    if answer is None:
+        raise RunFailedError(f"run {run.id} completed without an answer")
+    return answer
+    
+
+
+# Answer a question from the answer cache when possible, otherwise through a run, which needs a run slot
+# (api/limits.py) within `admission_wait` seconds; returns (answer, cache hit)
+def answer_question(assistant, thread_id, msg, admission_wait=0):
+    count_query(assistant.pk)
+    answer = get_cached_answer(assistant, msg)
+    if answer is not None:
+        return answer, True
+    with run_slot(admission_wait):
+        answer = send_message_to_assistant(
+            assistant.openai_id, thread_id, msg, assistant.pk, context=document_context(assistant, msg)
+        )
+    cache_answer(assistant, msg, answer)
+    return answer, False
+
+
+# Send a message and yield the assistant's answer in pieces as the run produces them
+async def stream_message_to_assistant(openai_id, thread_id, msg, timeout=None, assistant_pk=None, context=None):
+    timeout = settings.RUN_TIMEOUT if timeout is None else timeout
+    stats = RunStats(streamed=True)
+    started = time.monotonic()
+    deadline = started + timeout
+
+    assistant = await aget_assistant(openai_id)
+    await async_client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=msg)
+
+    async with async_client.beta.threads.runs.stream(
+        thread_id=thread_id,
         assistant_id=assistant.id,
-        instructions=assistant.instructions
+        **run_instructions(assistant.instructions, context),
+        # Events can be far apart while the assistant works, so only the run deadline bounds the read
+        timeout=operation_timeout(timeout),
+    ) as stream:
+        deltas = aiter(stream.text_deltas)
+        while True:
+            # Each wait for the next delta ends at the deadline, also while no event arrives
+            try:
+                text = await asyncio.wait_for(anext(deltas), deadline - time.monotonic())
+            except StopAsyncIteration:
+                break
+            except (TimeoutError, httpx.ReadTimeout):
+                run = stream.current_run
+                if run is not None:
+                    await acancel_run(thread_id, run.id)
+                raise RunTimeoutError(f"streamed run still active after {timeout:.1f}s")
+            yield text
+        run = await stream.get_final_run()
+
+    stats.wall_time = time.monotonic() - started
+    await arecord_run(run, stats, assistant_pk)
+    await amirror_messages(thread_id)
+    if run.status != "completed":
+        raise RunFailedError(f"run {run.id} ended as {run.status}: {run.last_error}")
+
+
+# Async counterparts of the helpers above, built on async_client for the ASGI views.
+# They follow the same steps so both deployment modes behave the same.
+
+# Upload a document to OpenAI once per distinct content and return its file id; later calls reuse it
+@timed("upload_file")
+async def aupload_file(uploaded_file):
+    stored = await sync_to_async(store_file)(uploaded_file)
+    if not stored.openai_file_id:
+        # The document is read from storage while it is sent, so it is sent from a worker thread instead of
+        # reading the file on the event loop
+        stored.openai_file_id = await sync_to_async(send_file, thread_sensitive=False)(stored)
+        await StoredFile.objects.filter(pk=stored.pk).aupdate(openai_file_id=stored.openai_file_id)
+    return stored.openai_file_id
+
+# Create an assistant using user-given name and instructions (retrieved from AssistantModel)
+@timed("create_new_assistant")
+async def acreate_new_assistant(name, company, instructions, uploaded_file=None):
+    file_ids = []
+    if uploaded_file is not None:
+        file_ids.append(await aupload_file(uploaded_file))
+
+    return await async_client.beta.assistants.create(
+        name=name,
+        instructions=f"{build_instructions(name, company)}. {instructions}",
+        model= "gpt-3.5-turbo-0125",
+        tools=[{"type": "retrieval"}],
+        file_ids=file_ids
     )
 
-    # Wait for connection with the OpenAI API
-    wait_on_run(run, thread)
+# Modify an assistant using user-given name and description (retrieved from AssistantModel)
+@timed("modify_assistant")
+async def amodify_assistant(openai_id, current_name, new_name, company, instructions, uploaded_file):
+    file_ids = []
+    if uploaded_file:
+        file_ids.append(await aupload_file(uploaded_file))
+
+    name_kwargs = {"name": new_name} if new_name else {}
 
-    # Retrieve the conversation messages
-    messages = client.beta.threads.messages.list(
-        thread_id=thread.id,
-        order="asc",
-        after=message.id
+    return await async_client.beta.assistants.update(
+        openai_id,
+        **name_kwargs,
+        instructions=f"{build_instructions(new_name or current_name, company)} {instructions}",
+        file_ids=file_ids
     )
 
-    # Retrieve and return the response message
-    for message in messages.data:
-        role = message.role
-        content = message.content[0].text.value
-        
-        return content
-    
\ No newline at end of file
+@timed("delete_assistant")
+async def adelete_assistant(openai_id):
+    await async_client.beta.assistants.delete(openai_id)
+    logger.info("deleted assistant %s", openai_id)
+
+# Function to create a new thread
+@timed("create_thread")
+async def acreate_thread():
+    thread = await async_client.beta.threads.create()
+    logger.info("created thread with id %s", thread.id)
+    return thread.id
+
+# Wait until the run leaves the queued/in_progress states without blocking the event loop
+async def await_on_run(run, thread_id, timeout=None):
+    timeout = settings.RUN_TIMEOUT if timeout is None else timeout
+    stats = RunStats()
+    started = time.monotonic()
+    intervals = poll_intervals()
+
+    try:
+        async with asyncio.timeout(timeout):
+            while run.status in ACTIVE_RUN_STATUSES:
+                await apoll_sleep(next(intervals))
+                run = await async_client.beta.threads.runs.retrieve(
+                    thread_id=thread_id,
+                    run_id=run.id,
+                    timeout=operation_timeout(settings.OPENAI_POLL_TIMEOUT),
+                )
+                stats.polls += 1
+    except TimeoutError:
+        stats.wall_time = time.monotonic() - started
+        await acancel_run(thread_id, run.id)
+        raise RunTimeoutError(f"run {run.id} still {run.status} after {stats.wall_time:.1f}s")
+
+    stats.wall_time = time.monotonic() - started
+    logger.info("run %s %s after %d polls in %.2fs", run.id, run.status, stats.polls, stats.wall_time)
+    if run.status == "failed":
+        logger.warning("run %s failed at %s: %s", run.id, run.failed_at, run.last_error)
+    return run, stats
+
+# Cancel a run that outlived its deadline so the thread accepts new messages again
+async def acancel_run(thread_id, run_id):
+    try:
+        await async_client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception:
+        logger.exception("could not cancel run %s on thread %s", run_id, thread_id)
+
+# Start a run on the thread and wait for it to finish, streaming when the client supports it
+@timed("run_to_completion")
+async def arun_to_completion(thread_id, assistant_id, instructions, timeout=None, context=None):
+    if not (settings.RUN_STREAMING and hasattr(async_client.beta.threads.runs, "stream")):
+        run = await async_client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            **run_instructions(instructions, context)
+        )
+        return await await_on_run(run, thread_id, timeout)
+
+    timeout = settings.RUN_TIMEOUT if timeout is None else timeout
+    stats = RunStats(streamed=True)
+    started = time.monotonic()
+    async with async_client.beta.threads.runs.stream(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        **run_instructions(instructions, context),
+        # Events can be far apart while the assistant works, so only the run deadline bounds the read
+        timeout=operation_timeout(timeout),
+    ) as stream:
+        try:
+            async with asyncio.timeout(timeout):
+                run = await stream.get_final_run()
+        except TimeoutError:
+            stats.wall_time = time.monotonic() - started
+            if stream.current_run is not None:
+                await acancel_run(thread_id, stream.current_run.id)
+            raise RunTimeoutError(f"streamed run still active after {stats.wall_time:.1f}s")
+
+    stats.wall_time = time.monotonic() - started
+    logger.info("run %s %s (streamed) in %.2fs", run.id, run.status, stats.wall_time)
+    if run.status == "failed":
+        logger.warning("run %s failed at %s: %s", run.id, run.failed_at, run.last_error)
+    return run, stats
+
+async def amirror_messages(thread_id):
+    after = await alast_message_id(thread_id)
+    messages = []
+    while True:
+        page = await async_client.beta.threads.messages.list(
+            thread_id=thread_id, order="asc", limit=MESSAGE_PAGE_SIZE, **({"after": after} if after else {})
+        )
+        messages += page.data
+        if len(page.data) < MESSAGE_PAGE_SIZE:
+            break
+        after = page.data[-1].id
+    await astore_messages(messages)
+    return messages
+
+
+# Send/retrieve messages to/from assistant
+@timed("send_message_to_assistant")
+async def asend_message_to_assistant(openai_id, thread_id, msg, assistant_pk=None, context=None):
+    assistant = await aget_assistant(openai_id)
+
+    message = await async_client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=msg)
+
+    run, stats = await arun_to_completion(thread_id, assistant.id, assistant.instructions, context=context)
+    await arecord_run(run, stats, assistant_pk)
+    if run.status != "completed":
+        raise RunFailedError(f"run {run.id} ended as {run.status}: {run.last_error}")
+
+    await amirror_messages(thread_id)
+    answer = await astored_answer(thread_id, message.id)
+    if answer is None:
+        raise RunFailedError(f"run {run.id} completed without an answer")
+    return answer
+
+async def aanswer_question(assistant, thread_id, msg, admission_wait=0):
+    count_query(assistant.pk)
+    answer = get_cached_answer(assistant, msg)
+    if answer is not None:
+        return answer, True
+    async with arun_slot(admission_wait):
+        answer = await asend_message_to_assistant(
+            assistant.openai_id, thread_id, msg, assistant.pk, context=await adocument_context(assistant, msg)
+        )
+    cache_answer(assistant, msg, answer)
+    return answer, False
@@ -1,15 +1,97 @@
 from rest_framework import views, status, serializers
 from rest_framework.response import Response
+from django.conf import settings
 from django.http import Http404
 from django.urls import reverse
-from rest_framework.authentication import TokenAuthentication, SessionAuthentication, BaseAuthentication
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.authentication import SessionAuthentication, BaseAuthentication
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.contrib.auth.models import User
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.parsers import JSONParser, FormParser, MultiPartParser
+from rest_framework.request import Request
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from contextlib import contextmanager
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+import json
+import logging
+import openai
+import time
 
 # Import your serializers and models
-from api.serializers import UserSerializer, TokenSerializer, AssistantSerializer, ChatSerializer
-from api.models import Assistant, Chat
+from api.serializers import UserSerializer, TokenSerializer, AssistantSerializer, ChatSerializer, ChatJobSerializer
+from api.serializers import AssistantListSerializer, ChatListSerializer, BatchSerializer, ThreadMessageListSerializer
+from api.models import Assistant, AssistantRun, Chat, ChatJob, StoredFile, ThreadMessage
+from api.jobs import await_job, enqueue_chat_job, wait_for_job
+from api.batch import aanswer_batch, answer_batch
+from api.utils import stream_message_to_assistant, mirror_messages, amirror_messages, RunFailedError, RunTimeoutError
+from api.authentication import CachedTokenAuthentication
+from api.cache import caches
+from api.transport import transports
+from api.instrumentation import render_metrics
+from api.limits import Overloaded, admission, athrottle, throttle
+from api.telemetry import alink_runs, run_stats
+from api.search import IndexFailed, IndexNotReady, adocument_context, document_figures, search, stored_document
+from api.counters import count_query
+from api.pagination import IdCursorPagination
+
+logger = logging.getLogger(__name__)
+
+
+class RunFailed(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = "The assistant could not answer the message."
+    default_code = "run_failed"
+
+
+class RunTimedOut(APIException):
+    status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = "The assistant did not answer the message in time."
+    default_code = "run_timeout"
+
+
+# Report an assistant run that failed or timed out as a 502/504 JSON error instead of an unhandled 500
+@contextmanager
+def run_errors(chat):
+    try:
+        yield
+    except RunFailedError:
+        logger.warning("run for chat %s failed", chat.pk, exc_info=True)
+        raise RunFailed()
+    except RunTimeoutError:
+        logger.warning("run for chat %s timed out", chat.pk, exc_info=True)
+        raise RunTimedOut()
+
+# Apply the ?assistant=<id>, ?thread_id=<id> and ?created_after=/?created_before=<ISO 8601> filters of the chat list
+def filter_chats(qs, params):
+    assistant = params.get("assistant")
+    if assistant:
+        if not assistant.isdigit():
+            raise ValidationError({"assistant": ["A valid integer is required."]})
+        qs = qs.filter(assistant_id=int(assistant))
+    thread_id = params.get("thread_id")
+    if thread_id:
+        qs = qs.filter(thread_id=thread_id)
+    for param, lookup in (("created_after", "created_at__gte"), ("created_before", "created_at__lt")):
+        value = params.get(param)
+        if value:
+            try:
+                when = parse_datetime(value)
+            except ValueError:
+                when = None
+            if when is None:
+                raise ValidationError({param: ["A valid ISO 8601 datetime is required."]})
+            if timezone.is_naive(when):
+                when = timezone.make_aware(when)
+            qs = qs.filter(**{lookup: when})
+    return qs
+
 
 class NoAuthentication(BaseAuthentication):
     """Custom authentication class that bypasses all authentication."""
@@ -22,7 +104,7 @@ class AssistantDetailAPIView(views.APIView):
     API view to retrieve, update, or delete assistant details.
     """
     serializer_class = AssistantSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [AllowAny]
     
     def get_object(self, pk):
@@ -70,14 +152,17 @@ class AssistantView(views.APIView):
         permission_classes (list): Permissions required to interact with this view.
     """
     serializer_class = AssistantSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [AllowAny]
 
+    pagination_class = IdCursorPagination
+
     def get(self, request, format=None):
-        """Handle GET request to list all assistants."""
-        qs = Assistant.objects.all()
-        serializer = self.serializer_class(qs, many=True, context={'request': request})
-        return Response(serializer.data)
+        """Handle GET request to list assistants, one cursor page at a time."""
+        serializer = AssistantListSerializer.from_request(request)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(serializer.queryset(Assistant.objects.all()), request, view=self)
+        return paginator.get_paginated_response(serializer.data(page))
     
     def post(self, request, format=None):
         """Handle POST request to create a new assistant."""
@@ -98,14 +183,18 @@ class ChatView(views.APIView):
     API view to list or create chat records.
     """
     serializer_class = ChatSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [AllowAny]
 
+    pagination_class = IdCursorPagination
+
     def get(self, request, format=None):
-        """Handle GET request to list all chat records (Dummy implementation)."""
-        chat = Chat.objects.all()  # Placeholder for actual chat retrieval logic
-        serializer = self.serializer_class(chat, many=True, context={'request': request})
-        return Response(serializer.data)
+        """Handle GET request to list chat records, optionally filtered by assistant or thread_id, one cursor page at a time."""
+        serializer = ChatListSerializer.from_request(request)
+        chat = filter_chats(Chat.objects.all(), request.query_params)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(serializer.queryset(chat), request, view=self)
+        return paginator.get_paginated_response(serializer.data(page))
     
     def post(self, request, format=None):
         """Handle POST request to create a new chat record."""
@@ -121,7 +210,7 @@ class ChatDetailAPIView(views.APIView):
     API view to retrieve, update, or delete assistant details.
     """
     serializer_class = ChatSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [AllowAny]
     
     def get_object(self, pk):
@@ -138,16 +227,696 @@ class ChatDetailAPIView(views.APIView):
         return Response(serializer.data)
     
     def put(self, request, pk, format=None):
-        """Handle PUT request to update an assistant by pk."""
+        """
+        Handle PUT request to send a message in the chat by pk.
+
+        With `?async=true` the message is stored as a background job and a 202 with the job's
+        status URL is returned instead of waiting for the assistant's answer.
+        """
         chat = self.get_object(pk)
         serializer = self.serializer_class(chat, data=request.data)
-        if serializer.is_valid():
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        throttle(request, serializer.validated_data["assistant_id"])
+
+        if request.query_params.get("async", "").lower() in ("1", "true", "yes"):
+            assistant = Assistant.objects.filter(pk=serializer.validated_data["assistant_id"]).first()
+            if assistant is None:
+                return Response({"assistant_id": ["Assistant does not exist."]}, status=status.HTTP_400_BAD_REQUEST)
+            job = enqueue_chat_job(chat, assistant, serializer.validated_data.get("input", ""))
+            job_serializer = ChatJobSerializer(job, context={'request': request})
+            return Response(job_serializer.data, status=status.HTTP_202_ACCEPTED,
+                            headers={"Location": job_serializer.data["url"]})
+
+        with run_errors(chat):
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return answer_cache_header(Response(serializer.data, status=status.HTTP_200_OK), serializer)
+
+
+class ChatJobAPIView(views.APIView):
+    """
+    API view to check on a chat message that is answered in the background.
+    """
+    serializer_class = ChatJobSerializer
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [AllowAny]
+
+    def get_object(self, pk):
+        """Attempt to get the job by primary key (pk) or raise Http404."""
+        try:
+            return ChatJob.objects.select_related("chat").get(pk=pk)
+        except ChatJob.DoesNotExist:
+            raise Http404
+
+    def get(self, request, pk, format=None):
+        """
+        Handle GET request to retrieve a job by pk.
+
+        `?wait=<seconds>` long-polls: the response is held until the job is done or the wait
+        (capped by CHAT_JOB_SYNC_MAX_WAIT, as it holds this worker) runs out.
+        """
+        job = self.get_object(pk)
+        try:
+            wait = float(request.query_params.get("wait", 0))
+        except ValueError:
+            return Response({"wait": ["A number of seconds is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        if wait > 0:
+            job = wait_for_job(job, wait)
+        serializer = self.serializer_class(job, context={'request': request})
+        return Response(serializer.data)
+
+
+class AssistantSearchView(views.APIView):
+    """
+    API view to search the document of an assistant in its local index.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [AllowAny]
+
+    def get(self, request, pk, format=None):
+        """Handle GET request to find the pages of the assistant's document that best match `?q=`."""
+        assistant = Assistant.objects.filter(pk=pk).first()
+        if assistant is None:
+            raise Http404
+        data, code = search_assistant_document(assistant, request.query_params)
+        response = Response(data, status=code)
+        if code == status.HTTP_503_SERVICE_UNAVAILABLE:
+            response["Retry-After"] = SEARCH_RETRY_AFTER
+        return response
+
+
+class AssistantFiguresView(views.APIView):
+    """
+    API view to look up figures in the tables of an assistant's document.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [AllowAny]
+
+    def get(self, request, pk, format=None):
+        """Handle GET request for the figures of `?metric=` (optionally of `?year=`) in the assistant's document."""
+        assistant = Assistant.objects.filter(pk=pk).first()
+        if assistant is None:
+            raise Http404
+        data, code = assistant_figures(assistant, request.query_params)
+        response = Response(data, status=code)
+        if code == status.HTTP_503_SERVICE_UNAVAILABLE:
+            response["Retry-After"] = SEARCH_RETRY_AFTER
+        return response
+
+
+class FiguresCompareView(views.APIView):
+    """
+    API view to compare one figure across the documents of several assistants.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [AllowAny]
+
+    def get(self, request, format=None):
+        """Handle GET request for the best match of `?metric=` in every (or every `?assistant=`) assistant's document."""
+        data, code = compare_figures(request.query_params)
+        return Response(data, status=code)
+
+
+class ThreadMessagesView(views.APIView):
+    """
+    API view to list the conversation history of a thread from the local message mirror.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [AllowAny]
+
+    pagination_class = IdCursorPagination
+
+    def get(self, request, thread_id, format=None):
+        """
+        Handle GET request to list the thread's messages, newest first, one cursor page at a time.
+
+        A page is one indexed query. The mirror is brought up to date from OpenAI first with `?sync=true`,
+        and automatically when the thread has no messages stored yet (threads from before the mirror).
+        """
+        serializer = ThreadMessageListSerializer.from_request(request)
+        messages = serializer.queryset(ThreadMessage.objects.filter(thread_id=thread_id))
+        paginator = self.pagination_class()
+        page = None if wants_sync(request) else paginator.paginate_queryset(messages, request, view=self)
+        if not page and "cursor" not in request.query_params:
+            try:
+                mirror_messages(thread_id)
+            except openai.NotFoundError:
+                raise Http404
+            page = paginator.paginate_queryset(messages, request, view=self)
+        return paginator.get_paginated_response(serializer.data(page))
+
+
+class AssistantBatchView(views.APIView):
+    """
+    API view to ask one assistant a batch of questions, answered concurrently.
+    """
+    serializer_class = BatchSerializer
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [AllowAny]
+
+    def post(self, request, pk, format=None):
+        """
+        Handle POST request to answer `questions` with the assistant by pk, `concurrency` at a time.
+
+        Every question gets its own thread and Chat row. All answers are returned together, or with
+        `?stream=true` each one is sent as an `answer` Server-Sent Event as soon as it is ready.
+        """
+        assistant = Assistant.objects.filter(pk=pk).first()
+        if assistant is None:
+            raise Http404
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Every question is a run, so a batch costs as many tokens as it has questions
+        throttle(request, assistant.pk, len(serializer.validated_data["questions"]))
+
+        results = answer_batch(assistant, serializer.validated_data["questions"], serializer.validated_data["concurrency"])
+        if wants_stream(request):
+            return event_stream_response(batch_events(serializer, results))
+        return Response(batch_summary(assistant, [serializer.result(*result) for result in results]))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAPIView(View):
+    """
+    Base class for the async views served under ASGI.
+
+    Covers the parts of DRF's APIView that the sync views rely on: (cached) token authentication,
+    parsing of JSON/form/multipart bodies into `request.data`, and JSON error responses.
+    Handlers receive a DRF `Request`, so serializers can be used exactly as in the sync views.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    parser_classes = [JSONParser, FormParser, MultiPartParser]
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(
+            request,
+            parsers=[parser() for parser in self.parser_classes],
+            authenticators=[auth() for auth in self.authentication_classes],
+        )
+        try:
+            # The token lookup is a database query, so resolve the user off the event loop
+            await sync_to_async(lambda: request.user)()
+            if request.content_type.startswith("multipart/"):
+                # Parsing an upload reads the body and writes the file to disk; keep that off the event loop
+                await sync_to_async(lambda: request.data, thread_sensitive=False)()
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as e:
+            detail = e.detail if isinstance(e.detail, (dict, list)) else {"detail": str(e.detail)}
+            response = JsonResponse(detail, status=e.status_code, safe=False)
+            # Throttled (429) and Overloaded (503) tell the client when to retry, as DRF does for the sync views
+            if getattr(e, "wait", None):
+                response["Retry-After"] = "%d" % e.wait
+            return response
+        except Http404:
+            return JsonResponse({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+class AsyncAssistantDetailAPIView(AsyncAPIView):
+    """
+    Async API view to retrieve, update, or delete assistant details.
+    """
+    serializer_class = AssistantSerializer
+
+    async def get_object(self, pk):
+        """Attempt to get the assistant by primary key (pk) or raise Http404."""
+        try:
+            return await Assistant.objects.aget(pk=pk)
+        except Assistant.DoesNotExist:
+            raise Http404
+
+    async def get(self, request, pk, format=None):
+        """Handle GET request to retrieve an assistant by pk."""
+        assistant = await self.get_object(pk)
+        serializer = self.serializer_class(assistant, context={'request': request})
+        return JsonResponse(serializer.data)
+
+    async def put(self, request, pk, format=None):
+        """Handle PUT request to update an assistant by pk."""
+        assistant = await self.get_object(pk)
+        serializer = self.serializer_class(assistant, data=request.data)
+        if serializer.is_valid():
+            await serializer.asave()
+            return JsonResponse(serializer.data, status=status.HTTP_200_OK)
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    async def delete(self, request, pk, format=None):
+        assistant = await self.get_object(pk)
+        serializer = self.serializer_class(assistant, data=request.data)
+        if serializer.is_valid():
+            return JsonResponse(serializer.data, status=status.HTTP_204_NO_CONTENT)
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncAssistantView(AsyncAPIView):
+    """
+    Async API view to list all assistants or create a new one.
+    """
+    serializer_class = AssistantSerializer
+
+    pagination_class = IdCursorPagination
+
+    async def get(self, request, format=None):
+        """Handle GET request to list assistants, one cursor page at a time."""
+        serializer = AssistantListSerializer.from_request(request)
+        paginator = self.pagination_class()
+        page = await sync_to_async(paginator.paginate_queryset)(
+            serializer.queryset(Assistant.objects.all()), request, view=self
+        )
+        return JsonResponse(paginator.get_paginated_response(serializer.data(page)).data)
+
+    async def post(self, request, format=None):
+        """Handle POST request to create a new assistant."""
+        serializer = self.serializer_class(data=request.data)
+        if serializer.is_valid():
+            await serializer.asave()
+            return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncChatView(AsyncAPIView):
+    """
+    Async API view to list or create chat records.
+    """
+    serializer_class = ChatSerializer
+
+    pagination_class = IdCursorPagination
+
+    async def get(self, request, format=None):
+        """Handle GET request to list chat records, optionally filtered by assistant or thread_id."""
+        serializer = ChatListSerializer.from_request(request)
+        chat = filter_chats(Chat.objects.all(), request.query_params)
+        paginator = self.pagination_class()
+        page = await sync_to_async(paginator.paginate_queryset)(serializer.queryset(chat), request, view=self)
+        return JsonResponse(paginator.get_paginated_response(serializer.data(page)).data)
+
+    async def post(self, request, format=None):
+        """Handle POST request to create a new chat record."""
+        serializer = self.serializer_class(data=request.data)
+        if serializer.is_valid():
+            await serializer.asave()
+            return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncChatDetailAPIView(AsyncAPIView):
+    """
+    Async API view to retrieve a chat or send a message in it.
+    """
+    serializer_class = ChatSerializer
+
+    async def get_object(self, pk):
+        """Attempt to get the chat by primary key (pk) or raise Http404."""
+        try:
+            return await Chat.objects.aget(pk=pk)
+        except Chat.DoesNotExist:
+            raise Http404
+
+    async def get(self, request, pk, format=None):
+        """Handle GET request to retrieve a chat by pk."""
+        chat = await self.get_object(pk)
+        serializer = self.serializer_class(chat, context={'request': request})
+        return JsonResponse(serializer.data)
+
+    async def put(self, request, pk, format=None):
+        """Handle PUT request to send a message in the chat by pk, optionally as a background job."""
+        chat = await self.get_object(pk)
+        serializer = self.serializer_class(chat, data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        await athrottle(request, serializer.validated_data["assistant_id"])
+
+        if request.query_params.get("async", "").lower() in ("1", "true", "yes"):
+            assistant = await Assistant.objects.filter(pk=serializer.validated_data["assistant_id"]).afirst()
+            if assistant is None:
+                return JsonResponse({"assistant_id": ["Assistant does not exist."]}, status=status.HTTP_400_BAD_REQUEST)
+            job = await sync_to_async(enqueue_chat_job)(chat, assistant, serializer.validated_data.get("input", ""))
+            job_serializer = ChatJobSerializer(job, context={'request': request})
+            response = JsonResponse(job_serializer.data, status=status.HTTP_202_ACCEPTED)
+            response["Location"] = job_serializer.data["url"]
+            return response
+
+        with run_errors(chat):
+            await serializer.asave()
+        return answer_cache_header(JsonResponse(serializer.data, status=status.HTTP_200_OK), serializer)
+
+
+class AsyncChatJobAPIView(AsyncAPIView):
+    """
+    Async API view to check on a chat message that is answered in the background.
+    """
+    serializer_class = ChatJobSerializer
+
+    async def get_object(self, pk):
+        """Attempt to get the job by primary key (pk) or raise Http404."""
+        try:
+            return await ChatJob.objects.select_related("chat").aget(pk=pk)
+        except ChatJob.DoesNotExist:
+            raise Http404
+
+    async def get(self, request, pk, format=None):
+        """
+        Handle GET request to retrieve a job by pk.
+
+        `?wait=<seconds>` long-polls without holding a worker: the response is held until the job is done
+        or the wait (capped by CHAT_JOB_MAX_WAIT) runs out.
+        """
+        job = await self.get_object(pk)
+        try:
+            wait = float(request.query_params.get("wait", 0))
+        except ValueError:
+            return JsonResponse({"wait": ["A number of seconds is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        if wait > 0 and (await await_job(job, wait)).is_finished:
+            # Read again together with the chat holding the answer
+            job = await self.get_object(pk)
+        serializer = self.serializer_class(job, context={'request': request})
+        return JsonResponse(serializer.data)
+
+
+class ChatStreamView(AsyncAPIView):
+    """
+    Async view that sends a message in the chat by pk and relays the answer as Server-Sent Events.
+
+    Accepts `assistant_id` and `input` as query parameters (GET, for EventSource) or as a JSON/form
+    body (POST). Emits `delta` events with pieces of the answer, then a `done` event with the stored
+    chat, or an `error` event. Needs to be served by an ASGI server to stream.
+    """
+
+    async def get(self, request, pk):
+        return await self.stream(request, pk, request.query_params)
+
+    async def post(self, request, pk):
+        return await self.stream(request, pk, request.data)
+
+    async def stream(self, request, pk, data):
+        chat = await Chat.objects.filter(pk=pk).afirst()
+        if chat is None:
+            raise Http404
+
+        errors = {}
+        assistant = None
+        try:
+            assistant = await Assistant.objects.filter(pk=int(data.get("assistant_id"))).afirst()
+        except (TypeError, ValueError):
+            pass
+        if assistant is None:
+            errors["assistant_id"] = ["Assistant does not exist."]
+        msg = data.get("input")
+        if not msg:
+            errors["input"] = ["This field is required."]
+        if errors:
+            return JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+        await athrottle(request, assistant.pk)
+
+        # Take the run slot before the stream starts, so an overloaded server still answers with a 503; the
+        # stream gives it back when it ends (a stream that never starts, when its lease expires)
+        slot = await admission.aacquire()
+        if slot is None:
+            raise Overloaded()
+        return event_stream_response(self.events(request, chat, assistant, msg, slot))
+
+    async def events(self, request, chat, assistant, msg, slot):
+        """Relay the answer's deltas and store the full text as a Chat row when the run completes."""
+        parts = []
+        count_query(assistant.pk)
+        try:
+            context = await adocument_context(assistant, msg)
+            async for text in stream_message_to_assistant(assistant.openai_id, chat.thread_id, msg,
+                                                          assistant_pk=assistant.pk, context=context):
+                parts.append(text)
+                yield sse("delta", {"text": text})
+        except Exception as e:
+            logger.exception("streaming chat %s failed", chat.pk)
+            yield sse("error", {"detail": str(e) or e.__class__.__name__})
+            return
+        finally:
+            await admission.arelease(slot)
+
+        new_chat = await Chat.objects.acreate(
+            assistant=assistant, thread_id=chat.thread_id, input=msg, output="".join(parts)
+        )
+        await alink_runs(new_chat)
+        yield sse("done", ChatSerializer(new_chat, context={'request': request}).data)
+
+
+class AsyncAssistantBatchView(AsyncAPIView):
+    """
+    Async API view to ask one assistant a batch of questions, answered concurrently.
+    """
+    serializer_class = BatchSerializer
+
+    async def post(self, request, pk, format=None):
+        """Handle POST request to answer a batch of questions, all at once or streamed with `?stream=true`."""
+        assistant = await Assistant.objects.filter(pk=pk).afirst()
+        if assistant is None:
+            raise Http404
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        await athrottle(request, assistant.pk, len(serializer.validated_data["questions"]))
+
+        results = aanswer_batch(assistant, serializer.validated_data["questions"], serializer.validated_data["concurrency"])
+        if wants_stream(request):
+            return event_stream_response(abatch_events(serializer, results))
+        return JsonResponse(batch_summary(assistant, [serializer.result(*result) async for result in results]))
+
+
+class AsyncAssistantSearchView(AsyncAPIView):
+    """
+    Async API view to search the document of an assistant in its local index.
+    """
+
+    async def get(self, request, pk, format=None):
+        """Handle GET request to search the assistant's document; the index is loaded and searched off the event loop."""
+        assistant = await Assistant.objects.filter(pk=pk).afirst()
+        if assistant is None:
+            raise Http404
+        data, code = await sync_to_async(search_assistant_document)(assistant, request.query_params)
+        response = JsonResponse(data, status=code)
+        if code == status.HTTP_503_SERVICE_UNAVAILABLE:
+            response["Retry-After"] = SEARCH_RETRY_AFTER
+        return response
+
+
+class AsyncAssistantFiguresView(AsyncAPIView):
+    """
+    Async API view to look up figures in the tables of an assistant's document.
+    """
+
+    async def get(self, request, pk, format=None):
+        """Handle GET request for the figures of `?metric=`; the table is loaded off the event loop."""
+        assistant = await Assistant.objects.filter(pk=pk).afirst()
+        if assistant is None:
+            raise Http404
+        data, code = await sync_to_async(assistant_figures)(assistant, request.query_params)
+        response = JsonResponse(data, status=code)
+        if code == status.HTTP_503_SERVICE_UNAVAILABLE:
+            response["Retry-After"] = SEARCH_RETRY_AFTER
+        return response
+
+
+class AsyncFiguresCompareView(AsyncAPIView):
+    """
+    Async API view to compare one figure across the documents of several assistants.
+    """
+
+    async def get(self, request, format=None):
+        """Handle GET request to compare `?metric=` across assistants."""
+        data, code = await sync_to_async(compare_figures)(request.query_params)
+        return JsonResponse(data, status=code)
+
+
+class AsyncThreadMessagesView(AsyncAPIView):
+    """
+    Async API view to list the conversation history of a thread from the local message mirror.
+    """
+    pagination_class = IdCursorPagination
+
+    async def get(self, request, thread_id, format=None):
+        """Handle GET request to list the thread's messages, newest first, syncing like the sync view."""
+        serializer = ThreadMessageListSerializer.from_request(request)
+        messages = serializer.queryset(ThreadMessage.objects.filter(thread_id=thread_id))
+        paginator = self.pagination_class()
+        paginate = sync_to_async(paginator.paginate_queryset)
+        page = None if wants_sync(request) else await paginate(messages, request, view=self)
+        if not page and "cursor" not in request.query_params:
+            try:
+                await amirror_messages(thread_id)
+            except openai.NotFoundError:
+                raise Http404
+            page = await paginate(messages, request, view=self)
+        return JsonResponse(paginator.get_paginated_response(serializer.data(page)).data)
+
+
+# Seconds a client is asked to wait before searching a document that is still being indexed
+SEARCH_RETRY_AFTER = "5"
+
+
+# Search the assistant's document for ?q= (at most ?limit= pages, default 5); returns (data, status code)
+def search_assistant_document(assistant, params):
+    query = params.get("q", "").strip()
+    if not query:
+        return {"q": ["This field is required."]}, status.HTTP_400_BAD_REQUEST
+    try:
+        limit = min(max(int(params.get("limit", 5)), 1), 20)
+    except ValueError:
+        return {"limit": ["A valid integer is required."]}, status.HTTP_400_BAD_REQUEST
+    stored = stored_document(assistant)
+    if stored is None:
+        return {"detail": "The assistant has no document."}, status.HTTP_404_NOT_FOUND
+
+    started = time.perf_counter()
+    try:
+        results = search(stored, query, limit)
+    except IndexNotReady:
+        return {"detail": "The document is still being indexed."}, status.HTTP_503_SERVICE_UNAVAILABLE
+    except IndexFailed as e:
+        return {"detail": f"The document could not be indexed: {e}"}, status.HTTP_422_UNPROCESSABLE_ENTITY
+    return {
+        "assistant": assistant.pk,
+        "document": stored.file.name,
+        "pages": stored.pages,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        "results": results,
+    }, status.HTTP_200_OK
+
+
+# Most assistants compared by one figures request
+FIGURES_COMPARE_MAX = 100
+
+
+# The ?metric=, ?year= and ?limit= of a figures request: (metric, year, limit, errors)
+def figure_query(params):
+    metric = params.get("metric", "").strip()
+    errors = {} if metric else {"metric": ["This field is required."]}
+    year = limit = None
+    try:
+        year = int(params["year"]) if params.get("year") else None
+    except ValueError:
+        errors["year"] = ["A valid integer is required."]
+    try:
+        limit = min(max(int(params.get("limit", 5)), 1), 20)
+    except ValueError:
+        errors["limit"] = ["A valid integer is required."]
+    return metric, year, limit, errors
+
+
+# Figures of ?metric= (and ?year=) in the assistant's document, best matching metrics first; returns (data, status code)
+def assistant_figures(assistant, params):
+    metric, year, limit, errors = figure_query(params)
+    if errors:
+        return errors, status.HTTP_400_BAD_REQUEST
+    stored = stored_document(assistant)
+    if stored is None:
+        return {"detail": "The assistant has no document."}, status.HTTP_404_NOT_FOUND
+
+    started = time.perf_counter()
+    try:
+        results = document_figures(stored).lookup(metric, year, limit)
+    except IndexNotReady:
+        return {"detail": "The document is still being indexed."}, status.HTTP_503_SERVICE_UNAVAILABLE
+    except IndexFailed as e:
+        return {"detail": f"The document could not be indexed: {e}"}, status.HTTP_422_UNPROCESSABLE_ENTITY
+    return {
+        "assistant": assistant.pk,
+        "document": stored.file.name,
+        "took_ms": round((time.perf_counter() - started) * 1000, 3),
+        "results": results,
+    }, status.HTTP_200_OK
+
+
+# The best match of ?metric= (and ?year=) in the document of each assistant (?assistant=1,2 or all); returns (data, status code)
+def compare_figures(params):
+    metric, year, _, errors = figure_query(params)
+    assistants = Assistant.objects.exclude(files="").exclude(files__isnull=True).order_by("pk")
+    if params.get("assistant"):
+        try:
+            assistants = assistants.filter(pk__in=[int(pk) for pk in params["assistant"].split(",")])
+        except ValueError:
+            errors["assistant"] = ["A comma separated list of assistant ids is required."]
+    if errors:
+        return errors, status.HTTP_400_BAD_REQUEST
+
+    assistants = list(assistants.values_list("pk", "name", "files")[:FIGURES_COMPARE_MAX])
+    documents = {stored.file.name: stored
+                 for stored in StoredFile.objects.filter(file__in=[files for _, _, files in assistants])}
+    started = time.perf_counter()
+    results = []
+    for pk, name, files in assistants:
+        result = {"assistant": pk, "name": name, "document": files, "metric": None, "values": []}
+        stored = documents.get(files)
+        try:
+            if stored is None:
+                raise IndexNotReady(files)
+            found = document_figures(stored).lookup(metric, year, 1)
+        except (IndexNotReady, IndexFailed):
+            result["error"] = "The document is not indexed."
+        else:
+            if found:
+                result.update(found[0])
+        results.append(result)
+    return {
+        "metric": metric,
+        "year": year,
+        "took_ms": round((time.perf_counter() - started) * 1000, 3),
+        "results": results,
+    }, status.HTTP_200_OK
+
+
+# Whether the client asked for the thread to be synced from OpenAI first (?sync=true)
+def wants_sync(request):
+    return request.query_params.get("sync", "").lower() in ("1", "true", "yes")
+
+
+# Whether the client asked for the answers as Server-Sent Events (?stream=true)
+def wants_stream(request):
+    return request.query_params.get("stream", "").lower() in ("1", "true", "yes")
+
+
+# Response relaying the events as they are produced, without buffering by proxies
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# All answers of a batch in question order, with counts of answered and failed questions
+def batch_summary(assistant, results):
+    results.sort(key=lambda result: result["index"])
+    failed = sum(1 for result in results if result["error"] is not None)
+    return {"assistant": assistant.pk, "answered": len(results) - failed, "failed": failed, "results": results}
+
+
+# An `answer` event per question as it finishes, then a `done` event with the counts
+def batch_events(serializer, results):
+    failed = 0
+    for index, chat, error in results:
+        failed += error is not None
+        yield sse("answer", serializer.result(index, chat, error))
+    yield sse("done", {"answered": len(serializer.validated_data["questions"]) - failed, "failed": failed})
+
+
+async def abatch_events(serializer, results):
+    failed = 0
+    async for index, chat, error in results:
+        failed += error is not None
+        yield sse("answer", serializer.result(index, chat, error))
+    yield sse("done", {"answered": len(serializer.validated_data["questions"]) - failed, "failed": failed})
+
+
+# Tell the client whether a chat answer came from the answer cache (only when ANSWER_CACHE is on)
+def answer_cache_header(response, serializer):
+    if settings.ANSWER_CACHE:
+        response["X-Answer-Cache"] = "HIT" if getattr(serializer, "answer_cache_hit", False) else "MISS"
+    return response
+
+
+# Format one Server-Sent Event with a JSON payload
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
-        
 class UserView(views.APIView):
     """
     API view to list or create users. Temporarily allows any access.
@@ -170,6 +939,59 @@ class UserView(views.APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     
+class CacheStatsView(views.APIView):
+    """
+    API view to report the hit/miss counters of this process's in-memory caches. Staff only.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        """Handle GET request to list the counters of every cache by name."""
+        return Response({name: cache.stats() for name, cache in caches.items()})
+
+
+class TransportStatsView(views.APIView):
+    """
+    API view to report the connection pool and retry counters of this process's OpenAI clients. Staff only.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        """Handle GET request to list the counters of every OpenAI transport by name."""
+        return Response({name: transport.stats() for name, transport in transports.items()})
+
+
+class RunStatsView(views.APIView):
+    """
+    API view to report run latency percentiles, failure rates and token usage per assistant. Staff only.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAdminUser]
+    # Window used when ?created_after= is not given
+    default_days = 7
+
+    def get(self, request, format=None):
+        """Handle GET request to aggregate the recorded runs, slowest assistants first."""
+        runs = filter_chats(AssistantRun.objects.all(), request.query_params)
+        if not request.query_params.get("created_after"):
+            runs = runs.filter(created_at__gte=timezone.now() - timedelta(days=self.default_days))
+        return Response({"assistants": run_stats(runs)})
+
+
+class MetricsView(views.APIView):
+    """
+    API view to export this process's request, database and OpenAI timings in the Prometheus text format. Staff only.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        """Handle GET request to render every metric for a Prometheus scrape."""
+        return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 class TokenView(ObtainAuthToken):
     """
     API view to obtain authentication token.
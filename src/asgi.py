@@ -3,6 +3,9 @@ ASGI config for src project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with ``gunicorn src.asgi:application -k uvicorn.workers.UvicornWorker`` and set
+``ASYNC_VIEWS=true`` to run the assistant and chat endpoints as async views.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -14,3 +17,20 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.ASYNC_VIEWS:
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+    from django.views.static import serve
+
+    class StaticRootHandler(ASGIStaticFilesHandler):
+        """
+        Serves collected files from STATIC_ROOT (including the hashed names written by
+        collectstatic), standing in for WhiteNoise, which is left out in async mode.
+        """
+
+        def serve(self, request):
+            return serve(request, self.file_path(request.path), document_root=settings.STATIC_ROOT)
+
+    application = StaticRootHandler(application)
@@ -0,0 +1,99 @@
+# PostgreSQL backend with a driver-level connection pool (psycopg2's ThreadedConnectionPool).
+# Selected in settings.py when DB_POOL is set. Django still opens and closes "its" connection around
+# every request (CONN_MAX_AGE = 0), but opening takes a connection from the process-wide pool and
+# closing hands it back, so requests skip the TCP, TLS and authentication handshakes.
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.db.backends.postgresql.psycopg_any import IsolationLevel, is_psycopg3
+import threading
+
+if is_psycopg3:
+    raise ImproperlyConfigured("src.postgresql_pool requires psycopg2")
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+
+# One pool per database alias, shared by all threads of the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    psycopg2's ThreadedConnectionPool, plus waiting up to `timeout` seconds for a free connection
+    (psycopg2 raises straight away when the pool is exhausted) and a health check on checkout.
+    """
+
+    def __init__(self, conn_params, min_size, max_size, timeout, health_checks):
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, **conn_params)
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.OperationalError(f"no database connection free within {self.timeout}s")
+        try:
+            while True:
+                connection = self._pool.getconn()
+                if not self.health_checks or self.is_usable(connection):
+                    return connection
+                self._pool.putconn(connection, close=True)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection):
+        try:
+            # The pool rolls back an unfinished transaction and drops connections in an unknown state
+            self._pool.putconn(connection, close=bool(connection.closed))
+        finally:
+            self._slots.release()
+
+    def is_usable(self, connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except psycopg2.Error:
+            return False
+        return True
+
+
+def get_pool(alias, conn_params, options):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(conn_params, **options)
+        return _pools[alias]
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    def __init__(self, settings_dict, *args, **kwargs):
+        super().__init__(settings_dict, *args, **kwargs)
+        # A persistent connection would stay with its thread and never go back to the pool
+        if self.settings_dict.get("POOL") and self.settings_dict.get("CONN_MAX_AGE", 0) != 0:
+            raise ImproperlyConfigured("src.postgresql_pool requires CONN_MAX_AGE = 0 when POOL is set")
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get("POOL")
+        if not options:
+            return super().get_new_connection(conn_params)
+
+        connection = get_pool(self.alias, conn_params, options).getconn()
+        # Same per-connection setup as the stock backend
+        isolation_level = self.settings_dict["OPTIONS"].get("isolation_level")
+        self.isolation_level = IsolationLevel.READ_COMMITTED if isolation_level is None else IsolationLevel(isolation_level)
+        if isolation_level is not None:
+            connection.isolation_level = self.isolation_level
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None and self.settings_dict.get("POOL"):
+            with self.wrap_database_errors:
+                get_pool(self.alias, None, None).putconn(self.connection)
+            return
+        super()._close()
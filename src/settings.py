@@ -34,6 +34,9 @@ DEBUG = env.bool("DEBUG", default=False)  # deployment
 
 ALLOWED_HOSTS = [".herokuapp.com", "localhost", "127.0.0.1"]  # deployment
 
+# Serve the assistant and chat endpoints with async views; run under ASGI (see src/asgi.py)
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+
 
 # Application definition
 
@@ -54,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.instrumentation.InstrumentationMiddleware",  # first, so its timings cover the whole request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",  # deployment
@@ -64,6 +68,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if ASYNC_VIEWS:
+    # WhiteNoise's middleware is sync-only and would push every async request through a thread;
+    # src/asgi.py serves static files instead
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
+
 ROOT_URLCONF = 'src.urls'
 
 TEMPLATES = [
@@ -88,10 +97,30 @@ WSGI_APPLICATION = 'src.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Connection reuse: by default each thread keeps its connection for DB_CONN_MAX_AGE seconds and checks
+# that it still works before every request. With DB_POOL, connections are instead taken from and given
+# back to a per-process pool around every request (PostgreSQL only, see src/postgresql_pool/), which
+# suits ASGI, where persistent per-thread connections are not reused reliably. The pool needs Django to close
+# its connection after every request, so DB_POOL forces CONN_MAX_AGE to 0 and DB_CONN_MAX_AGE is ignored.
+DB_POOL = env.bool("DB_POOL", default=False)
+
 DATABASES = {
-    'default': env.dj_db_url("DATABASE_URL")
+    'default': env.dj_db_url(
+        "DATABASE_URL",
+        conn_max_age=0 if DB_POOL else env.int("DB_CONN_MAX_AGE", default=0 if ASYNC_VIEWS else 600),
+        conn_health_checks=env.bool("DB_CONN_HEALTH_CHECKS", default=True),
+    )
 }
 
+if DB_POOL and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['ENGINE'] = 'src.postgresql_pool'
+    DATABASES['default']['POOL'] = {
+        'min_size': env.int("DB_POOL_MIN_SIZE", default=1),
+        'max_size': env.int("DB_POOL_MAX_SIZE", default=10),
+        'timeout': env.float("DB_POOL_TIMEOUT", default=10.0),
+        'health_checks': DATABASES['default']['CONN_HEALTH_CHECKS'],
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -144,4 +173,108 @@ REST_FRAMEWORK = {
 }
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Assistant runs: adaptive polling (seconds) and overall deadline per run
+RUN_POLL_INITIAL = env.float("RUN_POLL_INITIAL", default=0.2)
+RUN_POLL_MAX = env.float("RUN_POLL_MAX", default=2.0)
+RUN_POLL_MULTIPLIER = env.float("RUN_POLL_MULTIPLIER", default=1.6)
+RUN_TIMEOUT = env.float("RUN_TIMEOUT", default=120.0)
+RUN_STREAMING = env.bool("RUN_STREAMING", default=True)
+
+# Background chat jobs (PUT /chat/<pk>/?async=true). A `?wait=` long-poll on a job is capped at CHAT_JOB_MAX_WAIT
+# seconds on the async view, and at CHAT_JOB_SYNC_MAX_WAIT on the sync view, where it holds a worker meanwhile
+CHAT_JOB_WORKERS = env.int("CHAT_JOB_WORKERS", default=4)
+CHAT_JOB_MAX_WAIT = env.float("CHAT_JOB_MAX_WAIT", default=25.0)
+CHAT_JOB_SYNC_MAX_WAIT = env.float("CHAT_JOB_SYNC_MAX_WAIT", default=1.0)
+CHAT_JOB_POLL_INTERVAL = env.float("CHAT_JOB_POLL_INTERVAL", default=0.5)
+
+# Per-process cache of remote assistant objects (seconds, entries)
+ASSISTANT_CACHE_TTL = env.float("ASSISTANT_CACHE_TTL", default=300.0)
+ASSISTANT_CACHE_SIZE = env.int("ASSISTANT_CACHE_SIZE", default=256)
+
+# Uploads larger than UPLOAD_MAX_MEMORY_SIZE are spooled to a temporary file; documents are then
+# hashed, stored and sent to OpenAI in chunks of UPLOAD_CHUNK_SIZE bytes (see api/files.py)
+FILE_UPLOAD_MAX_MEMORY_SIZE = env.int("UPLOAD_MAX_MEMORY_SIZE", default=2621440)
+UPLOAD_CHUNK_SIZE = env.int("UPLOAD_CHUNK_SIZE", default=262144)
+
+# Opt-in per-process cache of answers to repeated questions (seconds, entries)
+ANSWER_CACHE = env.bool("ANSWER_CACHE", default=False)
+ANSWER_CACHE_TTL = env.float("ANSWER_CACHE_TTL", default=3600.0)
+ANSWER_CACHE_SIZE = env.int("ANSWER_CACHE_SIZE", default=1024)
+
+# Questions per assistant are counted in memory and added to Assistant.query_count every this many seconds
+QUERY_COUNT_FLUSH_INTERVAL = env.float("QUERY_COUNT_FLUSH_INTERVAL", default=5.0)
+
+# HTTP transport of the OpenAI clients (see api/transport.py): pool size and keep-alive per process,
+# HTTP/2 (needs the h2 package of requirements.txt), timeouts per kind of call (seconds) and a retry budget
+OPENAI_MAX_CONNECTIONS = env.int("OPENAI_MAX_CONNECTIONS", default=20)
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = env.int("OPENAI_MAX_KEEPALIVE_CONNECTIONS", default=10)
+OPENAI_KEEPALIVE_EXPIRY = env.float("OPENAI_KEEPALIVE_EXPIRY", default=60.0)
+OPENAI_HTTP2 = env.bool("OPENAI_HTTP2", default=True)
+OPENAI_CONNECT_TIMEOUT = env.float("OPENAI_CONNECT_TIMEOUT", default=5.0)
+OPENAI_POOL_TIMEOUT = env.float("OPENAI_POOL_TIMEOUT", default=10.0)
+OPENAI_TIMEOUT = env.float("OPENAI_TIMEOUT", default=60.0)
+OPENAI_POLL_TIMEOUT = env.float("OPENAI_POLL_TIMEOUT", default=15.0)
+OPENAI_UPLOAD_TIMEOUT = env.float("OPENAI_UPLOAD_TIMEOUT", default=300.0)
+OPENAI_MAX_RETRIES = env.int("OPENAI_MAX_RETRIES", default=2)
+OPENAI_RETRY_BASE_DELAY = env.float("OPENAI_RETRY_BASE_DELAY", default=0.5)
+OPENAI_RETRY_MAX_DELAY = env.float("OPENAI_RETRY_MAX_DELAY", default=8.0)
+OPENAI_RETRY_BUDGET_RATIO = env.float("OPENAI_RETRY_BUDGET_RATIO", default=0.1)
+OPENAI_RETRY_BUDGET_CAP = env.float("OPENAI_RETRY_BUDGET_CAP", default=10.0)
+
+# Token authentication cache (api/authentication.py): per process (seconds, entries) or, with
+# TOKEN_CACHE_SHARED, in Django's cache instead, which is Redis when REDIS_URL is set (needs the redis package)
+TOKEN_CACHE_TTL = env.float("TOKEN_CACHE_TTL", default=60.0)
+TOKEN_CACHE_SIZE = env.int("TOKEN_CACHE_SIZE", default=1024)
+TOKEN_CACHE_SHARED = env.bool("TOKEN_CACHE_SHARED", default=False)
+TOKEN_CACHE_SHARED_TTL = env.int("TOKEN_CACHE_SHARED_TTL", default=300)
+
+if env.str("REDIS_URL", default=""):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': env.str("REDIS_URL"),
+        }
+    }
+
+# Per-request timings (api/instrumentation.py) are always collected for /api/v1/metrics/; with SERVER_TIMING
+# they are also sent to the client as a Server-Timing header (database, OpenAI per operation, polling, total)
+SERVER_TIMING = env.bool("SERVER_TIMING", default=True)
+
+# Pool of pre-created OpenAI threads for new chats (api/thread_pool.py): a background thread per process
+# tops the pool up to THREAD_POOL_SIZE once it drops below THREAD_POOL_LOW_WATER, checking at least every
+# THREAD_POOL_REFILL_INTERVAL seconds; threads older than THREAD_POOL_EXPIRY seconds are not handed out and are
+# deleted at OpenAI. Refills lock each other out through Django's cache, across processes with REDIS_URL.
+# THREAD_POOL_SIZE=0 creates every thread inline instead.
+THREAD_POOL_SIZE = env.int("THREAD_POOL_SIZE", default=20)
+THREAD_POOL_LOW_WATER = env.int("THREAD_POOL_LOW_WATER", default=5)
+THREAD_POOL_EXPIRY = env.float("THREAD_POOL_EXPIRY", default=86400.0)
+THREAD_POOL_REFILL_INTERVAL = env.float("THREAD_POOL_REFILL_INTERVAL", default=30.0)
+
+# Batches of questions to one assistant (api/batch.py): questions per batch, and how many are answered
+# at once by default and at most (a batch may ask for its own limit with `concurrency`)
+BATCH_MAX_QUESTIONS = env.int("BATCH_MAX_QUESTIONS", default=50)
+BATCH_CONCURRENCY = env.int("BATCH_CONCURRENCY", default=8)
+BATCH_MAX_CONCURRENCY = env.int("BATCH_MAX_CONCURRENCY", default=16)
+
+# Local search over the assistant documents (api/search.py): with SEARCH_INDEX a saved document is indexed in
+# the background (PDFs need the pypdf package) in passages of SEARCH_CHUNK_WORDS words; SEARCH_INDEX_CACHE_SIZE
+# indexes are kept in memory per process. SEARCH_CONTEXT_PASSAGES > 0 adds that many of the best passages
+# for a question to its run as additional instructions.
+SEARCH_INDEX = env.bool("SEARCH_INDEX", default=True)
+SEARCH_CHUNK_WORDS = env.int("SEARCH_CHUNK_WORDS", default=120)
+SEARCH_INDEX_CACHE_SIZE = env.int("SEARCH_INDEX_CACHE_SIZE", default=16)
+SEARCH_CONTEXT_PASSAGES = env.int("SEARCH_CONTEXT_PASSAGES", default=0)
+
+# Rate limits and run admission (api/limits.py), kept in Django's cache (shared with REDIS_URL, else per process).
+# Requests that start runs take a token per client (API token or address) and per assistant from token buckets
+# refilled at RATE_LIMIT_* ("<requests>/<s|m|h|d>", empty for no limit) holding up to RATE_LIMIT_*_BURST tokens.
+# At most RUN_ADMISSION_LIMIT runs are in flight at once (0 for no limit); chat requests without a free run slot
+# get 503 at once, background jobs and batch questions wait up to RUN_ADMISSION_WAIT seconds for one.
+RATE_LIMIT_CLIENT = env.str("RATE_LIMIT_CLIENT", default="60/m")
+RATE_LIMIT_CLIENT_BURST = env.int("RATE_LIMIT_CLIENT_BURST", default=20)
+RATE_LIMIT_ASSISTANT = env.str("RATE_LIMIT_ASSISTANT", default="600/m")
+RATE_LIMIT_ASSISTANT_BURST = env.int("RATE_LIMIT_ASSISTANT_BURST", default=100)
+RUN_ADMISSION_LIMIT = env.int("RUN_ADMISSION_LIMIT", default=64)
+RUN_ADMISSION_WAIT = env.float("RUN_ADMISSION_WAIT", default=60.0)